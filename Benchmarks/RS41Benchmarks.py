@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 frame codec benchmarks
+"""
+
+#############################################
+# The following code benchmarks the frame   #
+# codec hot path of the RS41-SG/P           #
+# radiosonde simulation framework, using    #
+# the RS41 log files in the "Examples"      #
+# folder. Each benchmark reports a frames   #
+# per second rate. The results are written  #
+# as JSON, and can be compared with the     #
+# results of a previous (baseline) run.     #
+#                                           #
+# To measure the JIT backend speedup, run   #
+# with RS41_BACKEND=numpy first, and use    #
+# its results as the baseline.              #
+#                                           #
+# Usage:                                    #
+# python RS41Benchmarks.py                  #
+#        [--output Results.json]            #
+#        [--baseline Baseline.json]         #
+#        [--tolerance 0.1] [--repeats 5]    #
+#############################################
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+
+# The framework and examples folders, relative to this file
+BenchmarksPath = os.path.dirname(os.path.abspath(__file__))
+FrameworkPath = os.path.join(BenchmarksPath, '..', 'Framework')
+ExamplesPath = os.path.join(BenchmarksPath, '..', 'Examples')
+sys.path.insert(0, FrameworkPath)
+
+from RS41Functions import *
+from RS41SubframeRW import *
+from RS41BlocksRW import *
+from RS41SimFunctions import *
+from RS41FlightExport import *
+
+# Log files used by the benchmarks
+LogFileNames = ['RS41-SGP 2021-01-09-S1511071.txt',
+                'RS41-SGP 2021-01-11-S1340533.txt']
+
+FrameLength = 0x140 # 320 bytes per RS41 regular frame message
+LastSubframe = 50 # Last subframe number in each subframe cycle
+
+# %% Benchmark data
+##################
+# Benchmark data #
+##################
+
+def LoadBenchmarkLogs():
+    '''
+    Load the benchmark log files. Returns a list of (LogFileName, LoggedMessagesLength, LoggedMessages)
+    '''
+    Logs = []
+    for LogFileName in LogFileNames:
+        LoggedMessagesLength, LoggedMessages = ReadLogFile(os.path.join(ExamplesPath, LogFileName))
+        Logs.append((LogFileName, LoggedMessagesLength, LoggedMessages))
+    return Logs
+
+def PrepareBenchmarkData(Logs):
+    '''
+    Prepare the benchmark data: the raw log messages, the Reed-Solomon corrected messages, the subframes
+    array and the decoded columns (see DecodeFlight) of each log. Returns a dictionary
+    '''
+    RawMessages = []
+    DecodedMessages = []
+    Flights = []
+    FlightColumns = []
+    for LogFileName, LoggedMessagesLength, LoggedMessages in Logs:
+        FlightColumns.append(DecodeFlight(LoggedMessagesLength, LoggedMessages))
+
+        # Load the subframes array of the flight
+        SubFrameArray = bytearray(51*16) # 51*16 bytes
+        LoadSuccess, _ = LoadSubframeDataFromLog(LastSubframe + 1, LoggedMessagesLength, LoggedMessages,
+                                                 SubFrameArray, bytearray(1024))
+
+        FlightMessages = []
+        for i in range(LoggedMessagesLength):
+            MessageBytes = bytearray(1024)
+            LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+            RawMessages.append(bytearray(MessageBytes))
+            try:
+                DecodeReedSolomon(MessageBytes)
+            except Exception:
+                pass
+            DecodedMessages.append(MessageBytes)
+
+            # Only frames with valid MEAS and STATUS blocks are used for PTU conversion
+            if CheckMEASblockCRC(MessageBytes) and CheckSTATUSblockCRC(MessageBytes):
+                FlightMessages.append(MessageBytes)
+        if LoadSuccess:
+            Flights.append((SubFrameArray, FlightMessages))
+    RawMessageArray = np.array([np.frombuffer(bytes(MessageBytes[0:FrameLength]), dtype=np.uint8) for MessageBytes in RawMessages])
+    DecodedMessageArray = np.array([np.frombuffer(bytes(MessageBytes[0:FrameLength]), dtype=np.uint8) for MessageBytes in DecodedMessages])
+    return {'Logs': Logs, 'RawMessages': RawMessages, 'RawMessageArray': RawMessageArray,
+            'DecodedMessages': DecodedMessages, 'DecodedMessageArray': DecodedMessageArray, 'Flights': Flights,
+            'FlightColumns': FlightColumns}
+
+# %% Benchmark functions
+#######################
+# Benchmark functions #
+#######################
+# Each benchmark function gets the benchmark data and returns the number of processed frames
+
+def BenchmarkLogParsing(Data):
+    MessageBytes = bytearray(1024)
+    NumOfFrames = 0
+    for LogFileName, _, _ in Data['Logs']:
+        LoggedMessagesLength, LoggedMessages = ReadLogFile(os.path.join(ExamplesPath, LogFileName))
+        for i in range(LoggedMessagesLength):
+            LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        NumOfFrames = NumOfFrames + LoggedMessagesLength
+    return NumOfFrames
+
+def BenchmarkRSDecode(Data):
+    for RawMessageBytes in Data['RawMessages']:
+        MessageBytes = bytearray(RawMessageBytes)
+        try:
+            DecodeReedSolomon(MessageBytes)
+        except Exception:
+            pass
+    return len(Data['RawMessages'])
+
+def BenchmarkRSDecodeBatch(Data):
+    DecodeReedSolomonBatch(Data['RawMessageArray'].copy())
+    return len(Data['RawMessageArray'])
+
+def BenchmarkRSEncode(Data):
+    for DecodedMessageBytes in Data['DecodedMessages']:
+        SetReedSolomon(bytearray(DecodedMessageBytes))
+    return len(Data['DecodedMessages'])
+
+def MakeCRCBenchmark(CheckBlockCRC):
+    def BenchmarkBlockCRC(Data):
+        for MessageBytes in Data['DecodedMessages']:
+            CheckBlockCRC(MessageBytes)
+        return len(Data['DecodedMessages'])
+    return BenchmarkBlockCRC
+
+def BenchmarkDataWhitening(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        DataWhitening(FrameLength, MessageBytes)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkBitStream(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        GetBitStream(MessageBytes, FrameLength*8)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkAudioStream(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        BuildAudioStream(MessageBytes, FrameLength, 10, 4800, 48000)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkBlockReads(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        ReadSTATUSblock(MessageBytes)
+        ReadMEASblock(MessageBytes)
+        ReadGPSINFOblock(MessageBytes)
+        ReadGPSRAWblock(MessageBytes)
+        ReadGPSPOSblock(MessageBytes)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkBlockParsing(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        ParseMessageBlocks(MessageBytes)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkGPSTables(Data):
+    for MessageBytes in Data['DecodedMessages']:
+        GetSVsReceptionQualityData(MessageBytes)
+        GetPsaudorangeandVelocityData(MessageBytes)
+    return len(Data['DecodedMessages'])
+
+def BenchmarkGPSTablesBatch(Data):
+    GetSVsReceptionQualityDataBatch(Data['DecodedMessageArray'])
+    GetPsaudorangeandVelocityDataBatch(Data['DecodedMessageArray'])
+    return len(Data['DecodedMessageArray'])
+
+def BenchmarkPTUConversion(Data):
+    NumOfFrames = 0
+    for SubFrameArray, FlightMessages in Data['Flights']:
+        for MessageBytes in FlightMessages:
+            Temperature = GetAmbientTemperature(SubFrameArray, MessageBytes)
+            HeaterTemperature = GetHeaterTemperature(SubFrameArray, MessageBytes)
+            Pressure = GetPressure(SubFrameArray, MessageBytes)
+            GetRelativeHumidity("RS41-SGP", Pressure, 0, Temperature, HeaterTemperature, SubFrameArray, MessageBytes)
+        NumOfFrames = NumOfFrames + len(FlightMessages)
+    return NumOfFrames
+
+def BenchmarkFlightExportNDJSON(Data):
+    for Columns in Data['FlightColumns']:
+        FormatFlightNDJSON(Columns)
+    return sum(len(Columns['FrameNumber']) for Columns in Data['FlightColumns'])
+
+def BenchmarkFlightExportCSV(Data):
+    for Columns in Data['FlightColumns']:
+        FormatFlightCSV(Columns)
+    return sum(len(Columns['FrameNumber']) for Columns in Data['FlightColumns'])
+
+# The benchmarks, by name
+Benchmarks = {
+    'LogParsing':              BenchmarkLogParsing,
+    'RSDecode':                BenchmarkRSDecode,
+    'RSDecodeBatch':           BenchmarkRSDecodeBatch,
+    'RSEncode':                BenchmarkRSEncode,
+    'CheckSTATUSblockCRC':     MakeCRCBenchmark(CheckSTATUSblockCRC),
+    'CheckMEASblockCRC':       MakeCRCBenchmark(CheckMEASblockCRC),
+    'CheckGPSINFOblockCRC':    MakeCRCBenchmark(CheckGPSINFOblockCRC),
+    'CheckGPSRAWblockCRC':     MakeCRCBenchmark(CheckGPSRAWblockCRC),
+    'CheckGPSPOSblockCRC':     MakeCRCBenchmark(CheckGPSPOSblockCRC),
+    'DataWhitening':           BenchmarkDataWhitening,
+    'BitStream':               BenchmarkBitStream,
+    'AudioStream':             BenchmarkAudioStream,
+    'BlockReads':              BenchmarkBlockReads,
+    'BlockParsing':            BenchmarkBlockParsing,
+    'GPSTables':               BenchmarkGPSTables,
+    'GPSTablesBatch':          BenchmarkGPSTablesBatch,
+    'PTUConversion':           BenchmarkPTUConversion,
+    'FlightExportNDJSON':      BenchmarkFlightExportNDJSON,
+    'FlightExportCSV':         BenchmarkFlightExportCSV,
+}
+
+# %% Benchmark runner
+####################
+# Benchmark runner #
+####################
+
+def RunBenchmark(BenchmarkFunction, Data, Repeats):
+    '''
+    Run a benchmark function several times. Returns the number of frames, the best time in [s] and the frames per second rate
+    '''
+    BestTime = float('inf')
+    for i in range(Repeats):
+        StartTime = time.perf_counter()
+        NumOfFrames = BenchmarkFunction(Data)
+        BestTime = min(BestTime, time.perf_counter() - StartTime)
+    return NumOfFrames, BestTime, NumOfFrames / BestTime
+
+def RunBenchmarks(Repeats = 5, Names = None):
+    '''
+    Run the benchmarks. Returns a JSON serializable results dictionary
+    '''
+    Data = PrepareBenchmarkData(LoadBenchmarkLogs())
+    Results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'backend': GetBackend(),
+               'repeats': Repeats,
+               'benchmarks': {}}
+    for Name, BenchmarkFunction in Benchmarks.items():
+        if (Names is not None) and (Name not in Names):
+            continue
+        NumOfFrames, BestTime, FramesPerSecond = RunBenchmark(BenchmarkFunction, Data, Repeats)
+        Results['benchmarks'][Name] = {'frames': NumOfFrames,
+                                       'seconds': BestTime,
+                                       'frames_per_second': FramesPerSecond}
+    return Results
+
+def CompareWithBaseline(Results, Baseline, Tolerance):
+    '''
+    Compare the benchmark results with baseline results. A benchmark is a regression if its
+    frames per second rate dropped by more than Tolerance (a fraction) relative to the baseline
+    '''
+    Regressions = []
+    for Name, Result in Results['benchmarks'].items():
+        if Name not in Baseline['benchmarks']:
+            continue
+        Ratio = Result['frames_per_second'] / Baseline['benchmarks'][Name]['frames_per_second']
+        Result['baseline_frames_per_second'] = Baseline['benchmarks'][Name]['frames_per_second']
+        Result['speedup'] = Ratio
+        Result['regression'] = Ratio < (1.0 - Tolerance)
+        if Result['regression']:
+            Regressions.append(Name)
+    Results['regressions'] = Regressions
+    return Regressions
+
+def PrintResults(Results):
+    '''
+    Print the benchmark results as a table
+    '''
+    print('Backend: ' + Results['backend'], file = sys.stderr)
+    for Name, Result in Results['benchmarks'].items():
+        Line = Name.ljust(24) + ('%.1f' % Result['frames_per_second']).rjust(12) + ' frames/s'
+        if 'speedup' in Result:
+            Line = Line + ('%.2fx' % Result['speedup']).rjust(10)
+            if Result['regression']:
+                Line = Line + '  REGRESSION'
+        print(Line, file = sys.stderr)
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'RS41 frame codec benchmarks')
+    Parser.add_argument('--output', help = 'JSON results file. Default: standard output')
+    Parser.add_argument('--baseline', help = 'JSON results file of a baseline run to compare with')
+    Parser.add_argument('--tolerance', type = float, default = 0.1, help = 'Allowed slowdown fraction before a regression is reported')
+    Parser.add_argument('--repeats', type = int, default = 5, help = 'Number of runs of each benchmark. The best run is reported')
+    Parser.add_argument('--only', nargs = '+', metavar = 'NAME', choices = list(Benchmarks), help = 'Run only the named benchmarks')
+    Args = Parser.parse_args()
+
+    Results = RunBenchmarks(Args.repeats, Args.only)
+    Regressions = []
+    if Args.baseline:
+        with open(Args.baseline) as file:
+            Regressions = CompareWithBaseline(Results, json.load(file), Args.tolerance)
+    PrintResults(Results)
+
+    if Args.output:
+        with open(Args.output, 'w') as file:
+            json.dump(Results, file, indent = 2)
+    else:
+        json.dump(Results, sys.stdout, indent = 2)
+        print()
+
+    sys.exit(1 if Regressions else 0)
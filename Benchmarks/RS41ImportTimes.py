@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 framework import time measurement
+"""
+
+#############################################
+# The following code measures the import    #
+# time of each RS41-SG/P radiosonde         #
+# simulation framework module. Each module  #
+# is imported in a fresh interpreter, so    #
+# the measured time includes all of the     #
+# module's eager dependencies.              #
+#                                           #
+# Usage:                                    #
+# python RS41ImportTimes.py [Repeats]       #
+#############################################
+
+import os
+import sys
+import subprocess
+
+# The framework folder, relative to this file
+FrameworkPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Framework')
+
+# The framework modules, from the lightest to the heaviest
+FrameworkModules = ['RS41SubframeRW', 'RS41BlocksRW', 'RS41Functions', 'RS41SimFunctions']
+
+def MeasureImportTime(ModuleName):
+    '''
+    Measure the import time of a framework module in a fresh interpreter. Returns the cumulative time in [ms]
+    '''
+    # Run the import with "-X importtime". The interpreter writes a line per imported module to stderr:
+    # "import time: self [us] | cumulative [us] | module name"
+    Result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ModuleName],
+                            cwd = FrameworkPath, capture_output = True, text = True, check = True)
+    for Line in Result.stderr.splitlines():
+        Fields = Line.split('|')
+        if (len(Fields) == 3) and (Fields[2].strip() == ModuleName):
+            return int(Fields[1]) / 1000
+    return float('nan')
+
+def MeasureImportTimes(Repeats = 5):
+    '''
+    Measure the import time of all of the framework modules. Returns a dictionary of the best time of each module in [ms]
+    '''
+    ImportTimes = {}
+    for ModuleName in FrameworkModules:
+        ImportTimes[ModuleName] = min([MeasureImportTime(ModuleName) for i in range(Repeats)])
+    return ImportTimes
+
+if __name__ == '__main__':
+    Repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for ModuleName, ImportTime in MeasureImportTimes(Repeats).items():
+        print(ModuleName.ljust(20), ('%.1f' % ImportTime).rjust(8), 'ms')
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 decoder yield curves
+"""
+
+#############################################
+# The following code measures the frame     #
+# error rate (FER) of the receive chain of  #
+# the RS41-SG/P radiosonde simulation       #
+# framework against Eb/N0, with Monte Carlo #
+# trials over a simulated channel.          #
+#                                           #
+# Each trial takes frames from the RS41 log #
+# files in the "Examples" folder:           #
+# 1. Modulation: BuildAudioStream shaping,  #
+#    FM (GFSK) to complex baseband          #
+# 2. Channel: frequency offset and drift,   #
+#    Rayleigh/Rician flat fading, AWGN      #
+# 3. Receiver: IF filter, FM discriminator, #
+#    DemodulateFrames and DecodeReedSolomon #
+#    (with the soft-decision erasures)      #
+# A frame is an error unless it is decoded  #
+# to the transmitted bytes.                 #
+#                                           #
+# The trials run in a process pool. Each    #
+# trial is seeded from (seed, Eb/N0 point,  #
+# trial number), so the results don't       #
+# depend on the number of processes.        #
+#                                           #
+# Usage:                                    #
+# python RS41YieldCurves.py                 #
+#        [--ebn0 0 16 1] [--trials 20]      #
+#        [--offset 0] [--drift 0]           #
+#        [--fading none] [--doppler 1]      #
+#        [--output Results.json]            #
+#############################################
+
+import os
+import sys
+import json
+import time
+import argparse
+import concurrent.futures
+import numpy as np
+
+# The framework and examples folders, relative to this file
+BenchmarksPath = os.path.dirname(os.path.abspath(__file__))
+FrameworkPath = os.path.join(BenchmarksPath, '..', 'Framework')
+ExamplesPath = os.path.join(BenchmarksPath, '..', 'Examples')
+sys.path.insert(0, FrameworkPath)
+
+from RS41Functions import *
+from RS41BlocksRW import *
+from RS41SimFunctions import *
+from RS41Demodulator import *
+
+# Log files used for the transmitted frames
+LogFileNames = ['RS41-SGP 2021-01-09-S1511071.txt',
+                'RS41-SGP 2021-01-11-S1340533.txt']
+
+FrameLength = 0x140 # 320 bytes per RS41 regular frame message
+Preamble = bytearray([0x55] * 40) # RS41 Preamble = 40 bytes of 0x55
+SampleRate = 48000 # [samples/sec] Baseband sample rate
+Deviation = 2400 # [Hz] FSK frequency deviation
+ReceiverBandwidth = 12e3 # [Hz] IF filter bandwidth
+
+# %% Trial data
+##############
+# Trial data #
+##############
+
+# Per process caches: the transmitted frames and their modulating (audio) waveforms
+Frames = []
+FrameWaveforms = {}
+
+def LoadFrames():
+    '''
+    Load the frames of the log files that are decoded without errors. Returns a list of 320 byte messages
+    '''
+    LoadedFrames = []
+    for LogFileName in LogFileNames:
+        LoggedMessagesLength, LoggedMessages = ReadLogFile(os.path.join(ExamplesPath, LogFileName))
+        MessageArray = np.zeros((LoggedMessagesLength, FrameLength), dtype=np.uint8)
+        MessageBytes = bytearray(1024)
+        for i in range(LoggedMessagesLength):
+            LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+            MessageArray[i] = np.frombuffer(MessageBytes, dtype=np.uint8, count=FrameLength)
+        Decoded = DecodeReedSolomonBatch(MessageArray)
+        LoadedFrames.extend(MessageArray[i].tobytes() for i in np.flatnonzero(Decoded))
+    return LoadedFrames
+
+def InitWorker():
+    '''
+    Process pool initializer: load the frames once per process
+    '''
+    if not(Frames):
+        Frames.extend(LoadFrames())
+
+def GetFrameWaveform(FrameIndex):
+    '''
+    Get the modulating waveform of a frame: the preamble and the whitened frame, shaped by BuildAudioStream
+    '''
+    if FrameIndex not in FrameWaveforms:
+        TxDataBytes = Preamble + DataWhitening(FrameLength, bytearray(Frames[FrameIndex]))
+        FrameWaveforms[FrameIndex] = BuildAudioStream(TxDataBytes, len(TxDataBytes), SampleRate / DataRate, DataRate, SampleRate)
+    return FrameWaveforms[FrameIndex]
+
+# %% Channel simulation
+######################
+# Channel simulation #
+######################
+
+def GetFadingGain(rng, NumOfSamples, Fading, Doppler, KFactor, NumOfPaths = 16):
+    '''
+    Get a flat fading complex gain per sample, with a unit mean power. Fading: 'none', 'rayleigh' or 'rician'.
+    The scattered component is a sum of sinusoids with random arrival angles (Jakes' model), with a maximal
+    Doppler shift of Doppler [Hz]. KFactor is the Rician line of sight to scattered power ratio
+    '''
+    if Fading == 'none':
+        return np.ones(NumOfSamples, dtype=np.complex64)
+    if Fading == 'rayleigh':
+        KFactor = 0.0
+    t = np.arange(NumOfSamples) / SampleRate
+    Angles = rng.uniform(0, 2 * np.pi, NumOfPaths)
+    Phases = rng.uniform(0, 2 * np.pi, NumOfPaths)
+    Scattered = np.zeros(NumOfSamples, dtype=np.complex128)
+    for Angle, Phase in zip(Angles, Phases):
+        Scattered += np.exp(1j * (2 * np.pi * Doppler * np.cos(Angle) * t + Phase))
+    Scattered /= np.sqrt(NumOfPaths)
+    LineOfSight = np.exp(1j * rng.uniform(0, 2 * np.pi))
+    return (np.sqrt(KFactor / (KFactor + 1)) * LineOfSight + np.sqrt(1 / (KFactor + 1)) * Scattered).astype(np.complex64)
+
+def SimulateChannel(rng, FrameIndexes, EbN0, Offset, Drift, Fading, Doppler, KFactor):
+    '''
+    Modulate frames to complex baseband and pass them through the simulated channel.
+    Returns the received complex baseband samples
+    '''
+    # The frames are separated by random gaps of unmodulated carrier
+    Segments = []
+    for FrameIndex in FrameIndexes:
+        Segments.append(np.zeros(int(rng.integers(SampleRate // 20, SampleRate // 5)), dtype=np.float32))
+        Segments.append(GetFrameWaveform(FrameIndex))
+    Segments.append(np.zeros(SampleRate // 5, dtype=np.float32))
+    Waveform = np.concatenate(Segments)
+
+    # FM: the waveform is +/-0.5, for a +/-Deviation frequency. Then the frequency offset and its linear drift
+    t = np.arange(len(Waveform)) / SampleRate
+    Phase = 2 * np.pi * np.cumsum(2 * Deviation * Waveform.astype(np.float64)) / SampleRate
+    Phase += 2 * np.pi * (Offset * t + 0.5 * Drift * t * t) + rng.uniform(0, 2 * np.pi)
+    Signal = np.exp(1j * Phase).astype(np.complex64) * GetFadingGain(rng, len(Waveform), Fading, Doppler, KFactor)
+
+    # AWGN. The signal power is 1, so Eb = 1 / DataRate and the noise power in the sample rate bandwidth is
+    # N0 * SampleRate = SampleRate / (DataRate * Eb/N0)
+    NoisePower = SampleRate / (DataRate * 10**(EbN0 / 10))
+    Noise = rng.standard_normal((len(Signal), 2), dtype=np.float32).view(np.complex64)[:, 0] * np.float32(np.sqrt(NoisePower / 2))
+    return Signal + Noise
+
+def ReceiveFrames(Received):
+    '''
+    The receive chain: IF filter and FM discriminator, then DemodulateFrames and DecodeReedSolomon.
+    Returns a list of the decoded message bytes
+    '''
+    import scipy.signal as signal
+    IFFilter = signal.firwin(63, ReceiverBandwidth / 2, fs=SampleRate)
+    Filtered = signal.lfilter(IFFilter, 1.0, Received)
+    Audio = np.angle(Filtered[1:] * np.conj(Filtered[:-1]))
+
+    DecodedFrames = []
+    for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in DemodulateFrames(Audio, SampleRate):
+        try:
+            if DecodeReedSolomon(MessageBytes, ByteReliability):
+                DecodedFrames.append(bytes(MessageBytes[0:FrameLength]))
+        except Exception:
+            pass
+    return DecodedFrames
+
+def RunTrial(Trial):
+    '''
+    Run a Monte Carlo trial: (seed, Eb/N0 point number, Eb/N0 [dB], trial number, channel parameters dictionary).
+    Returns (Eb/N0 point number, number of sent frames, number of correctly decoded frames)
+    '''
+    Seed, Point, EbN0, TrialNumber, Channel = Trial
+    InitWorker()
+    rng = np.random.default_rng(np.random.SeedSequence([Seed, Point, TrialNumber]))
+    FrameIndexes = rng.choice(len(Frames), Channel['frames_per_trial'], replace=False)
+    Received = SimulateChannel(rng, FrameIndexes, EbN0, Channel['offset'], Channel['drift'], Channel['fading'],
+                               Channel['doppler'], Channel['kfactor'])
+    DecodedFrames = set(ReceiveFrames(Received))
+    NumOfCorrect = sum(1 for FrameIndex in FrameIndexes if Frames[FrameIndex] in DecodedFrames)
+    return Point, len(FrameIndexes), NumOfCorrect
+
+# %% Monte Carlo sweep
+#####################
+# Monte Carlo sweep #
+#####################
+
+def RunSweep(EbN0Values, Trials, Channel, Seed = 0, Workers = None):
+    '''
+    Run the Monte Carlo trials of all of the Eb/N0 points in a process pool. Returns a JSON serializable
+    results dictionary, with the frame error rate of each point
+    '''
+    Tasks = [(Seed, Point, float(EbN0), TrialNumber, Channel)
+             for Point, EbN0 in enumerate(EbN0Values) for TrialNumber in range(Trials)]
+    Sent = np.zeros(len(EbN0Values), dtype=np.int64)
+    Correct = np.zeros(len(EbN0Values), dtype=np.int64)
+    StartTime = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = Workers, initializer = InitWorker) as Executor:
+        for Point, NumOfSent, NumOfCorrect in Executor.map(RunTrial, Tasks, chunksize = max(1, Trials // 4)):
+            Sent[Point] += NumOfSent
+            Correct[Point] += NumOfCorrect
+
+    Results = {'seed': Seed,
+               'trials': Trials,
+               'channel': Channel,
+               'seconds': time.perf_counter() - StartTime,
+               'points': []}
+    for Point, EbN0 in enumerate(EbN0Values):
+        Results['points'].append({'ebn0_db': float(EbN0),
+                                  'frames': int(Sent[Point]),
+                                  'decoded': int(Correct[Point]),
+                                  'fer': float(1 - Correct[Point] / Sent[Point])})
+    return Results
+
+def PrintResults(Results):
+    '''
+    Print the frame error rate curve as a table
+    '''
+    print('Eb/N0 [dB]'.rjust(10) + 'Frames'.rjust(9) + 'Decoded'.rjust(9) + 'FER'.rjust(10), file = sys.stderr)
+    for Point in Results['points']:
+        print(('%.1f' % Point['ebn0_db']).rjust(10) + str(Point['frames']).rjust(9) + str(Point['decoded']).rjust(9)
+              + ('%.4f' % Point['fer']).rjust(10), file = sys.stderr)
+    print('%.1f seconds' % Results['seconds'], file = sys.stderr)
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'RS41 decoder frame error rate against Eb/N0')
+    Parser.add_argument('--ebn0', type = float, nargs = 3, default = [0.0, 16.0, 1.0], metavar = ('START', 'STOP', 'STEP'),
+                        help = 'Eb/N0 range [dB], STOP included')
+    Parser.add_argument('--trials', type = int, default = 20, help = 'Trials per Eb/N0 point')
+    Parser.add_argument('--frames-per-trial', type = int, default = 8, help = 'Frames per trial')
+    Parser.add_argument('--offset', type = float, default = 0.0, help = 'Frequency offset [Hz]')
+    Parser.add_argument('--drift', type = float, default = 0.0, help = 'Frequency drift [Hz/sec]')
+    Parser.add_argument('--fading', choices = ['none', 'rayleigh', 'rician'], default = 'none', help = 'Flat fading model')
+    Parser.add_argument('--doppler', type = float, default = 1.0, help = 'Fading maximal Doppler shift [Hz]')
+    Parser.add_argument('--kfactor', type = float, default = 4.0, help = 'Rician K factor (line of sight to scattered power)')
+    Parser.add_argument('--seed', type = int, default = 0, help = 'Random seed')
+    Parser.add_argument('--workers', type = int, help = 'Number of processes. Default: the number of CPUs')
+    Parser.add_argument('--output', help = 'JSON results file. Default: standard output')
+    Args = Parser.parse_args()
+
+    Start, Stop, Step = Args.ebn0
+    EbN0Values = np.arange(Start, Stop + Step / 2, Step)
+    Channel = {'frames_per_trial': Args.frames_per_trial,
+               'offset': Args.offset,
+               'drift': Args.drift,
+               'fading': Args.fading,
+               'doppler': Args.doppler,
+               'kfactor': Args.kfactor}
+    Results = RunSweep(EbN0Values, Args.trials, Channel, Args.seed, Args.workers)
+    PrintResults(Results)
+
+    if Args.output:
+        with open(Args.output, 'w') as file:
+            json.dump(Results, file, indent = 2)
+    else:
+        json.dump(Results, sys.stdout, indent = 2)
+        print()
@@ -58,6 +58,7 @@ import serial
 import pyaudio
 from threading import Thread
 from skyfield.api import load
+import pymap3d
 import random
 import datetime
 import keyboard
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 parallel archive ingest
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions decode a directory of       #
+# flight logs in a process pool, into one   #
+# columnar result (see DecodeFlight).       #
+#                                           #
+# - The files are scheduled in chunks of    #
+#   several files, largest files first, on  #
+#   all of the CPUs by default              #
+# - Each worker decodes its files (parse,   #
+#   Reed-Solomon, CRC, calibration, PTU)    #
+#   and writes the columns to a shared      #
+#   memory block. Only the block name and   #
+#   layout are sent back, so the columns    #
+#   are never pickled                       #
+# - A failing file (or a failing worker     #
+#   process) is reported with its error,    #
+#   and doesn't stop the ingest. The blocks #
+#   that were not read are freed, however   #
+#   the ingest ends                         #
+#                                           #
+# Command line:                             #
+# python RS41ArchiveIngest.py DIRECTORY     #
+#        [--pattern *.txt] [--workers N]    #
+#        [--output columns.npz]             #
+#############################################
+
+import os
+import sys
+import glob
+import time
+import signal
+import argparse
+import traceback
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from RS41DecodeCache import *
+
+# %% Worker functions
+#####################
+# Worker functions #
+#####################
+
+def WriteColumnsToSharedMemory(Columns):
+    '''
+    Copy columns (a dictionary of NumPy arrays) to a new shared memory block.
+    Returns the block name and the layout: a list of (column name, dtype string, offset, length)
+    '''
+    Layout = []
+    Offset = 0
+    for Name, Column in Columns.items():
+        Offset = (Offset + 7) & ~7 # 8 byte alignment
+        Layout.append((Name, Column.dtype.str, Offset, len(Column)))
+        Offset = Offset + Column.nbytes
+    # The block is unlinked by the process that reads it. It stays tracked by the resource tracker that the workers
+    # share with the ingest process (see IngestLogs), which unlinks it at the end of the ingest process if it leaked
+    Block = shared_memory.SharedMemory(create=True, size=max(Offset, 1))
+    try:
+        for (Name, DType, ColumnOffset, Length), Column in zip(Layout, Columns.values()):
+            np.ndarray(Length, dtype=DType, buffer=Block.buf, offset=ColumnOffset)[:] = Column
+        return Block.name, Layout
+    finally:
+        Block.close()
+
+def ReadColumnsFromSharedMemory(BlockName, Layout):
+    '''
+    Copy the columns of a shared memory block (see WriteColumnsToSharedMemory), and free the block
+    '''
+    Block = shared_memory.SharedMemory(name=BlockName)
+    try:
+        return {Name: np.ndarray(Length, dtype=DType, buffer=Block.buf, offset=Offset).copy()
+                for Name, DType, Offset, Length in Layout}
+    finally:
+        Block.close()
+        Block.unlink()
+
+def FreeSharedMemoryBlock(BlockName):
+    '''
+    Free a shared memory block that won't be read (see WriteColumnsToSharedMemory)
+    '''
+    try:
+        Block = shared_memory.SharedMemory(name=BlockName)
+    except FileNotFoundError:
+        return
+    Block.close()
+    Block.unlink()
+
+def IgnoreInterrupt():
+    '''
+    Worker initializer: a Ctrl-C is handled by the ingest process only, so a worker doesn't leave a task half done
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def IngestLogFiles(Tasks):
+    '''
+    Worker: decode a chunk of log files. Tasks is a list of (file number, log file name, calibration options,
+    cache directory or None). Returns a list of (file number, shared memory block name, layout, error message)
+    '''
+    Results = []
+    Cache = None
+    for FileNumber, LogFileName, CalibrationOptions, CacheDirectory in Tasks:
+        try:
+            if CacheDirectory is not None:
+                if Cache is None:
+                    Cache = NewDecodeCache(CacheDirectory)
+                Columns = CachedDecodeFlightFile(Cache, LogFileName, CalibrationOptions)
+            else:
+                Columns = DecodeFlightFile(LogFileName, CalibrationOptions)
+            BlockName, Layout = WriteColumnsToSharedMemory(Columns)
+            Results.append((FileNumber, BlockName, Layout, None))
+        except Exception:
+            Results.append((FileNumber, None, None, traceback.format_exc(limit=-3).strip()))
+    return Results
+
+# %% Ingest functions
+#####################
+# Ingest functions #
+#####################
+
+def PrintIngestProgress(DoneFiles, TotalFiles, NumOfFrames, NumOfErrors, StartTime):
+    '''
+    Print a one line ingest progress report to stderr
+    '''
+    Elapsed = max(time.perf_counter() - StartTime, 1e-9)
+    print('\r[%d/%d files] %5.1f%%  %d frames  %.1f files/sec  %d errors  ' %
+          (DoneFiles, TotalFiles, 100.0 * DoneFiles / max(TotalFiles, 1), NumOfFrames, DoneFiles / Elapsed, NumOfErrors),
+          end = '', file = sys.stderr, flush = True)
+
+def IngestLogs(LogFileNames, Workers = None, ChunkFiles = None, CalibrationOptions = None, CacheDirectory = None,
+               Progress = True):
+    '''
+    Decode flight log files in a process pool. Returns (Columns, Errors):
+    Columns = The columns of all of the files (see FlightColumns), concatenated in the files order,
+              with a 'FileNumber' column: the index of each frame's file in LogFileNames
+    Errors  = A dictionary: log file name -> error message, for the files that failed
+    Workers defaults to the number of CPUs. ChunkFiles (files per scheduled task) defaults to a size that gives
+    each worker about 4 tasks
+    '''
+    Workers = Workers or os.cpu_count() or 1
+    if ChunkFiles is None:
+        ChunkFiles = max(1, len(LogFileNames) // (4 * Workers))
+
+    # Largest files first, so the last tasks are short
+    Sizes = [os.path.getsize(LogFileName) if os.path.exists(LogFileName) else 0 for LogFileName in LogFileNames]
+    Order = sorted(range(len(LogFileNames)), key = lambda FileNumber: -Sizes[FileNumber])
+    Tasks = [(FileNumber, LogFileNames[FileNumber], CalibrationOptions, CacheDirectory) for FileNumber in Order]
+    Chunks = [Tasks[i:i + ChunkFiles] for i in range(0, len(Tasks), ChunkFiles)]
+
+    FileColumns = {}
+    Errors = {}
+    NumOfFrames = 0
+    StartTime = time.perf_counter()
+    Futures = {}
+    ReadBlockNames = set()
+
+    # The workers share the resource tracker of this process (see WriteColumnsToSharedMemory)
+    resource_tracker.ensure_running()
+    Executor = concurrent.futures.ProcessPoolExecutor(max_workers = Workers, initializer = IgnoreInterrupt)
+    try:
+        Futures = {Executor.submit(IngestLogFiles, Chunk): Chunk for Chunk in Chunks}
+        for Future in concurrent.futures.as_completed(Futures):
+            # A failed task (e.g. a worker process that died: BrokenProcessPool) fails each of its files
+            try:
+                Results = Future.result()
+            except Exception:
+                Error = traceback.format_exc(limit=-3).strip()
+                Results = [(FileNumber, None, None, Error) for FileNumber, LogFileName, Options, Directory in Futures[Future]]
+            for FileNumber, BlockName, Layout, Error in Results:
+                if Error is None:
+                    try:
+                        FileColumns[FileNumber] = ReadColumnsFromSharedMemory(BlockName, Layout)
+                        NumOfFrames = NumOfFrames + len(FileColumns[FileNumber]['FrameNumber'])
+                    except Exception:
+                        Error = traceback.format_exc(limit=-3).strip()
+                        FreeSharedMemoryBlock(BlockName)
+                    ReadBlockNames.add(BlockName)
+                if Error is not None:
+                    Errors[LogFileNames[FileNumber]] = Error
+            if Progress:
+                PrintIngestProgress(len(FileColumns) + len(Errors), len(LogFileNames), NumOfFrames, len(Errors), StartTime)
+    finally:
+        # An interrupted ingest doesn't start the pending tasks, and waits for the running tasks.
+        # Then the blocks of the finished tasks that were not read are freed
+        Executor.shutdown(wait = True, cancel_futures = True)
+        for Future in Futures:
+            if Future.done() and not(Future.cancelled()) and (Future.exception() is None):
+                for FileNumber, BlockName, Layout, Error in Future.result():
+                    if (BlockName is not None) and (BlockName not in ReadBlockNames):
+                        FreeSharedMemoryBlock(BlockName)
+        if Progress:
+            print(file = sys.stderr)
+
+    # Concatenate the columns in the files order
+    Columns = NewFlightColumns(0)
+    Columns['FileNumber'] = np.zeros(0, dtype=np.int32)
+    Decoded = sorted(FileColumns)
+    for Name in Columns:
+        if Name == 'FileNumber':
+            Parts = [np.full(len(FileColumns[FileNumber]['FrameNumber']), FileNumber, dtype=np.int32) for FileNumber in Decoded]
+        else:
+            Parts = [FileColumns[FileNumber][Name] for FileNumber in Decoded]
+        if Parts:
+            Columns[Name] = np.concatenate(Parts)
+    return Columns, Errors
+
+def IngestDirectory(Directory, Pattern = '*.txt', Recursive = False, **IngestOptions):
+    '''
+    Decode the flight log files of a directory in a process pool (see IngestLogs).
+    Returns (LogFileNames, Columns, Errors)
+    '''
+    if Recursive:
+        LogFileNames = sorted(glob.glob(os.path.join(glob.escape(Directory), '**', Pattern), recursive = True))
+    else:
+        LogFileNames = sorted(glob.glob(os.path.join(glob.escape(Directory), Pattern)))
+    Columns, Errors = IngestLogs(LogFileNames, **IngestOptions)
+    return LogFileNames, Columns, Errors
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'Decode a directory of RS41 flight logs in parallel')
+    Parser.add_argument('directory', help = 'Log files directory')
+    Parser.add_argument('--pattern', default = '*.txt', help = 'Log file name pattern')
+    Parser.add_argument('--recursive', action = 'store_true', help = 'Include the subdirectories')
+    Parser.add_argument('--workers', type = int, help = 'Number of processes. Default: the number of CPUs')
+    Parser.add_argument('--chunk-files', type = int, help = 'Files per scheduled task')
+    Parser.add_argument('--cache', help = 'Decoded flight cache directory (see RS41DecodeCache)')
+    Parser.add_argument('--output', help = 'Output .npz file of the columns, with a LogFileNames array')
+    Parser.add_argument('--quiet', action = 'store_true', help = 'No progress report')
+    Args = Parser.parse_args()
+
+    LogFileNames, Columns, Errors = IngestDirectory(Args.directory, Args.pattern, Args.recursive, Workers = Args.workers,
+                                                    ChunkFiles = Args.chunk_files, CacheDirectory = Args.cache,
+                                                    Progress = not(Args.quiet))
+    for LogFileName, Error in Errors.items():
+        print('Error: ' + LogFileName + '\n' + Error, file = sys.stderr)
+    print('%d files, %d frames, %d errors' % (len(LogFileNames), len(Columns['FrameNumber']), len(Errors)), file = sys.stderr)
+    if Args.output:
+        np.savez(Args.output, LogFileNames = np.array(LogFileNames), **Columns)
+    sys.exit(1 if Errors else 0)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 multi-receiver arrival consistency check
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions detect a spoofing           #
+# transmitter on the ground, from frames of #
+# one radiosonde received by several        #
+# stations.                                 #
+#                                           #
+# A genuine frame is transmitted from the   #
+# position reported in its GPSPOS block.    #
+# Per frame, the receptions are checked     #
+# against that position:                    #
+# 1. Timing: the receive time differences   #
+#    between the stations must match the    #
+#    range differences (TDOA). Needs        #
+#    GPS-disciplined station clocks         #
+# 2. Signal strength: RSSI + 20*log10(range)#
+#    (the free space path loss) estimates   #
+#    the transmitted power. The estimates of#
+#    all of the stations must be close      #
+#                                           #
+# The check is streaming: each reception is #
+# added as it arrives. Per radiosonde, only #
+# the last frames and check results are     #
+# kept, so the memory per radiosonde is     #
+# bounded. The radiosondes that were not    #
+# received for a while are dropped, and the #
+# number of tracked radiosondes is capped   #
+# (least recently received dropped first).  #
+#############################################
+
+import time
+import collections
+import numpy as np
+from RS41BlocksRW import *
+
+SpeedOfLight = 299792458.0 # [m/sec]
+
+# %% Geometry functions
+#######################
+# Geometry functions #
+#######################
+
+def GetStationECEFPosition(StationPosition):
+    '''
+    Get a station ECEF position in [m], from its geodetic position: (latitude [deg], longitude [deg], altitude [m])
+    '''
+    import pymap3d
+    return np.array(pymap3d.geodetic2ecef(*StationPosition))
+
+def CheckArrivalConsistency(TransmitterPosition, StationPositions, ReceiveTimes, RSSIs,
+                            MaxTimingResidual = 50e-6, MaxPowerSpread = 15.0):
+    '''
+    Check the receptions of a frame by several stations against the transmitter ECEF position in [m].
+    StationPositions is an (N, 3) array of station ECEF positions in [m], ReceiveTimes in [sec] (or None entries,
+    for stations without a synchronized clock) and RSSIs in [dBm] (or None entries). Returns a list of flags:
+    ('Timing', residual [sec]) = The receive time differences don't fit the range differences
+    ('Power', spread [dB])     = The transmitted power estimates of the stations don't fit each other
+    '''
+    Flags = []
+    Ranges = np.linalg.norm(np.asarray(StationPositions, dtype=np.float64) - np.asarray(TransmitterPosition), axis=1)
+
+    # Timing: the transmit time estimates (receive time - time of flight) of all of the stations must agree
+    Timed = np.array([ReceiveTime is not None for ReceiveTime in ReceiveTimes])
+    if Timed.sum() >= 2:
+        TransmitTimes = np.array([ReceiveTimes[i] for i in np.flatnonzero(Timed)]) - Ranges[Timed] / SpeedOfLight
+        TimingResidual = float(np.abs(TransmitTimes - np.median(TransmitTimes)).max())
+        if TimingResidual > MaxTimingResidual:
+            Flags.append(('Timing', TimingResidual))
+
+    # Signal strength: the transmitted power estimates (RSSI + free space path loss) must agree.
+    # The frequency dependent part of the path loss is the same for all of the stations, and is left out
+    Measured = np.array([RSSI is not None for RSSI in RSSIs])
+    if Measured.sum() >= 2:
+        PowerEstimates = np.array([RSSIs[i] for i in np.flatnonzero(Measured)]) + 20 * np.log10(np.maximum(Ranges[Measured], 1.0))
+        PowerSpread = float(PowerEstimates.max() - PowerEstimates.min())
+        if PowerSpread > MaxPowerSpread:
+            Flags.append(('Power', PowerSpread))
+    return Flags
+
+# %% Streaming check
+###################
+# Streaming check #
+###################
+
+def NewArrivalChecker(MaxPendingFrames = 8, HistoryLength = 64, MaxTimingResidual = 50e-6, MaxPowerSpread = 15.0,
+                      MaxIdleTime = 600.0, MaxRadiosondes = 256):
+    '''
+    Create the state of a streaming arrival consistency check.
+    MaxPendingFrames = Frames per radiosonde that can still receive more receptions
+    HistoryLength    = Check results kept per radiosonde, for GetSpoofingScore
+    MaxIdleTime      = A radiosonde with no reception for this long is dropped [sec]. None: never
+    MaxRadiosondes   = Tracked radiosondes. The least recently received radiosonde is dropped first
+    '''
+    return {'MaxPendingFrames': MaxPendingFrames,
+            'HistoryLength': HistoryLength,
+            'MaxTimingResidual': MaxTimingResidual,
+            'MaxPowerSpread': MaxPowerSpread,
+            'MaxIdleTime': MaxIdleTime,
+            'MaxRadiosondes': MaxRadiosondes,
+            'StationECEFPositions': {},
+            'Radiosondes': collections.OrderedDict()}
+
+def NewRadiosondeTrack(ArrivalChecker):
+    '''
+    Create the state of a tracked radiosonde: its pending frames and its last check results
+    '''
+    return {'PendingFrames': collections.OrderedDict(),
+            'History': collections.deque(maxlen = ArrivalChecker['HistoryLength']),
+            'LastReception': time.monotonic()}
+
+def EvictRadiosondeTracks(ArrivalChecker, Now = None):
+    '''
+    Drop the radiosonde tracks with no reception for longer than MaxIdleTime, and the least recently received
+    tracks above MaxRadiosondes. The tracks are kept in the order of their last reception, oldest first
+    '''
+    Radiosondes = ArrivalChecker['Radiosondes']
+    if Now is None:
+        Now = time.monotonic()
+    if ArrivalChecker['MaxIdleTime'] is not None:
+        while Radiosondes and (Now - next(iter(Radiosondes.values()))['LastReception'] > ArrivalChecker['MaxIdleTime']):
+            Radiosondes.popitem(last=False)
+    while len(Radiosondes) > ArrivalChecker['MaxRadiosondes']:
+        Radiosondes.popitem(last=False)
+
+def AddReception(ArrivalChecker, StationName, StationPosition, ReceiveTime, RSSI, MessageBytes):
+    '''
+    Add a reception of a RS41 message byte array (after Reed-Solomon correction) by a station to a streaming
+    arrival consistency check. StationPosition is (latitude [deg], longitude [deg], altitude [m]); ReceiveTime
+    [sec] and RSSI [dBm] may be None. Returns (RadiosondeID, FrameNumber, flags) with the flags of the frame's
+    receptions so far (see CheckArrivalConsistency), or None if the frame has no valid STATUS and GPSPOS blocks
+    '''
+    if not(CheckSTATUSblockCRC(MessageBytes)) or not(CheckGPSPOSblockCRC(MessageBytes)):
+        return None
+    RadiosondeID = GetRadiosondeID(MessageBytes)
+    FrameNumber = GetFrameNumber(MessageBytes)
+
+    # The station ECEF positions are calculated once per station position. The position is kept as a tuple, so a
+    # list or a NumPy array position compares by its values
+    StationPosition = tuple(StationPosition)
+    StationECEFPositions = ArrivalChecker['StationECEFPositions']
+    if (StationName not in StationECEFPositions) or (StationECEFPositions[StationName][0] != StationPosition):
+        StationECEFPositions[StationName] = (StationPosition, GetStationECEFPosition(StationPosition))
+
+    # Add the reception to the frame. The oldest pending frames, and the idle radiosondes, are dropped
+    Radiosondes = ArrivalChecker['Radiosondes']
+    Track = Radiosondes.get(RadiosondeID)
+    if Track is None:
+        Track = Radiosondes[RadiosondeID] = NewRadiosondeTrack(ArrivalChecker)
+    else:
+        Track['LastReception'] = time.monotonic()
+        Radiosondes.move_to_end(RadiosondeID)
+    EvictRadiosondeTracks(ArrivalChecker, Track['LastReception'])
+    PendingFrames = Track['PendingFrames']
+    Frame = PendingFrames.get(FrameNumber)
+    if Frame is None:
+        Frame = PendingFrames[FrameNumber] = {'Position': (GetECEFPositionX(MessageBytes), GetECEFPositionY(MessageBytes),
+                                                           GetECEFPositionZ(MessageBytes)),
+                                              'Receptions': {}}
+        while len(PendingFrames) > ArrivalChecker['MaxPendingFrames']:
+            PendingFrames.popitem(last=False)
+    Frame['Receptions'][StationName] = (StationECEFPositions[StationName][1], ReceiveTime, RSSI)
+
+    # Check the frame's receptions
+    Flags = []
+    if len(Frame['Receptions']) >= 2:
+        Receptions = list(Frame['Receptions'].values())
+        Flags = CheckArrivalConsistency(Frame['Position'], [Reception[0] for Reception in Receptions],
+                                        [Reception[1] for Reception in Receptions], [Reception[2] for Reception in Receptions],
+                                        ArrivalChecker['MaxTimingResidual'], ArrivalChecker['MaxPowerSpread'])
+        Frame['Flags'] = Flags
+        if not(Frame.get('Checked')):
+            Frame['Checked'] = True
+            Track['History'].append(Frame)
+    return RadiosondeID, FrameNumber, Flags
+
+def GetSpoofingScore(ArrivalChecker, RadiosondeID):
+    '''
+    Get the fraction of a radiosonde's last checked frames (up to HistoryLength) that were flagged.
+    Returns None if no frame of the radiosonde was checked
+    '''
+    Track = ArrivalChecker['Radiosondes'].get(RadiosondeID)
+    if (Track is None) or (len(Track['History']) == 0):
+        return None
+    return sum(1 for Frame in Track['History'] if Frame['Flags']) / len(Track['History'])
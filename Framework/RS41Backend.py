@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 accelerated kernels backend
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions are the tight integer loops #
+# of the frame codec: CRC16, bit stream     #
+# extraction, data whitening and the GF(256)#
+# Reed-Solomon arithmetic.                  #
+#                                           #
+# The backend is selected at import time,   #
+# without importing Numba:                  #
+# - "numba": the loops are JIT-compiled     #
+#   with Numba, if it is installed. Numba   #
+#   is imported, and a kernel is compiled,  #
+#   on the kernel's first call              #
+# - "numpy": the kernels are None, and the  #
+#   callers use their NumPy/Python paths    #
+# Set the RS41_BACKEND environment variable #
+# to "numpy" to disable the JIT backend.    #
+#############################################
+
+import os
+import importlib.util
+import numpy as np
+
+# %% Backend selection
+#####################
+# Backend selection #
+#####################
+
+Backend = 'numpy'
+if os.environ.get('RS41_BACKEND', 'numba').lower() != 'numpy':
+    # Importing Numba takes longer than importing the whole framework, so only its presence is checked here
+    if importlib.util.find_spec('numba') is not None:
+        Backend = 'numba'
+
+def GetBackend():
+    '''
+    Get the active backend name and version, e.g. "numba 0.60.0" or "numpy 1.26.4"
+    '''
+    if Backend == 'numba':
+        import numba
+        return Backend + ' ' + numba.__version__
+    return Backend + ' ' + np.__version__
+
+def JITKernel(Function):
+    '''
+    Get a kernel of a loop function, that is compiled with Numba on its first call.
+    Returns None if the Numba backend isn't active
+    '''
+    if Backend != 'numba':
+        return None
+    Compiled = []
+
+    def Kernel(*Args):
+        if not(Compiled):
+            import numba
+            Compiled.append(numba.njit(cache=True, nogil=True)(Function))
+        return Compiled[0](*Args)
+
+    Kernel.__name__ = Function.__name__.replace('Loop', 'Kernel')
+    Kernel.__doc__ = Function.__doc__
+    return Kernel
+
+# %% Kernel loops
+################
+# Kernel loops #
+################
+# The loops are plain Python over NumPy arrays, so they can be compiled by Numba as is
+
+def CRC16Loop(Data, Table):
+    '''
+    CRC-16 (CCITT) of a uint8 array, with a uint16 lookup table
+    '''
+    crc = 0xFFFF
+    for i in range(len(Data)):
+        crc = ((crc << 8) & 0xFFFF) ^ Table[(crc >> 8) ^ Data[i]]
+    return crc
+
+def BitStreamLoop(Data, NumOfBits):
+    '''
+    Get the bits of a uint8 array, MSB first
+    '''
+    Bits = np.zeros(NumOfBits, dtype=np.uint8)
+    for i in range(NumOfBits):
+        Bits[i] = (Data[i >> 3] >> (7 - (i & 7))) & 0x01
+    return Bits
+
+def WhiteningLoop(Data, XorArray, BitReverseTable):
+    '''
+    Xor a uint8 array with the repeating xor mask, and reverse the bits order of each byte
+    '''
+    Whitened = np.zeros(len(Data), dtype=np.uint8)
+    for i in range(len(Data)):
+        Whitened[i] = BitReverseTable[Data[i] ^ XorArray[i % len(XorArray)]]
+    return Whitened
+
+def SyndromesLoop(Codewords, GFMultiply, SyndromePowers):
+    '''
+    Reed-Solomon syndromes of an (N, CodewordLength) uint8 codewords array (Horner's method)
+    '''
+    NumOfCodewords, CodewordLength = Codewords.shape
+    Syndromes = np.zeros((NumOfCodewords, len(SyndromePowers)), dtype=np.uint8)
+    for n in range(NumOfCodewords):
+        for j in range(len(SyndromePowers)):
+            Syndrome = np.uint8(0)
+            for i in range(CodewordLength):
+                Syndrome = GFMultiply[Syndrome, SyndromePowers[j]] ^ Codewords[n, i]
+            Syndromes[n, j] = Syndrome
+    return Syndromes
+
+def ErrorLocatorLoop(Syndromes, GFMultiply, GFInverse):
+    '''
+    Reed-Solomon error locator polynomials of an (N, ECCSymbols) syndromes array, with reedsolo's
+    Berlekamp-Massey iterations. Returns an (N, ECCSymbols + 2) array, lowest degree first
+    '''
+    NumOfCodewords, ECCSymbols = Syndromes.shape
+    ErrorLocators = np.zeros((NumOfCodewords, ECCSymbols + 2), dtype=np.uint8)
+    OldLocator = np.zeros(ECCSymbols + 2, dtype=np.uint8)
+    NewLocator = np.zeros(ECCSymbols + 2, dtype=np.uint8)
+    for n in range(NumOfCodewords):
+        ErrorLocator = ErrorLocators[n]
+        ErrorLocator[0] = 1
+        OldLocator[:] = 0
+        OldLocator[0] = 1
+        ErrorLocatorLength = 1
+        OldLocatorLength = 1
+        for i in range(ECCSymbols):
+            Delta = np.uint8(0)
+            for j in range(i + 1):
+                Delta ^= GFMultiply[ErrorLocator[j], Syndromes[n, i - j]]
+
+            # OldLocator = OldLocator * x
+            for k in range(ECCSymbols + 1, 0, -1):
+                OldLocator[k] = OldLocator[k - 1]
+            OldLocator[0] = 0
+            OldLocatorLength += 1
+
+            if Delta != 0:
+                if OldLocatorLength > ErrorLocatorLength:
+                    for k in range(ECCSymbols + 2):
+                        NewLocator[k] = GFMultiply[OldLocator[k], Delta]
+                        OldLocator[k] = GFMultiply[ErrorLocator[k], GFInverse[Delta]]
+                        ErrorLocator[k] = NewLocator[k]
+                    ErrorLocatorLength, OldLocatorLength = OldLocatorLength, ErrorLocatorLength
+                for k in range(ECCSymbols + 2):
+                    ErrorLocator[k] ^= GFMultiply[OldLocator[k], Delta]
+                ErrorLocatorLength = max(ErrorLocatorLength, OldLocatorLength)
+    return ErrorLocators
+
+# %% Kernels
+###########
+# Kernels #
+###########
+# The compiled kernels, or None when the Numba backend isn't active
+
+CRC16Kernel = JITKernel(CRC16Loop)
+BitStreamKernel = JITKernel(BitStreamLoop)
+WhiteningKernel = JITKernel(WhiteningLoop)
+SyndromesKernel = JITKernel(SyndromesLoop)
+ErrorLocatorKernel = JITKernel(ErrorLocatorLoop)
@@ -20,38 +20,64 @@ RS41 Blocks Read-Write operations
 #############################################
 
 import numpy as np
-from reedsolo import RSCodec
+from RS41Backend import *
+
+# The reedsolo coder is created on first use (see GetReedSolomonCoder), so
+# frame-level tools that only read blocks or check CRCs don't pay for it
+RS_ECCSymbols = 24 # 24 ECC symbols
+RS_Coder = None
+
+# Message byte indexes of the two interleaved Reed-Solomon codewords (132 data bytes + 24 parity bytes each),
+# in codeword order. See DecodeReedSolomon
+RS_CodewordIndexes1 = np.concatenate((np.arange(0x13E, 0x037, -2), np.arange(0x01F, 0x007, -1)))
+RS_CodewordIndexes2 = np.concatenate((np.arange(0x13F, 0x038, -2), np.arange(0x037, 0x01F, -1)))
+RS_CodewordIndexes = np.stack((RS_CodewordIndexes1, RS_CodewordIndexes2))
+
+# CRC-16 (CCITT) lookup table
+CRC16Table = [
+    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7, 0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
+    0x1231, 0x0210, 0x3273, 0x2252, 0x52B5, 0x4294, 0x72F7, 0x62D6, 0x9339, 0x8318, 0xB37B, 0xA35A, 0xD3BD, 0xC39C, 0xF3FF, 0xE3DE,
+    0x2462, 0x3443, 0x0420, 0x1401, 0x64E6, 0x74C7, 0x44A4, 0x5485, 0xA56A, 0xB54B, 0x8528, 0x9509, 0xE5EE, 0xF5CF, 0xC5AC, 0xD58D,
+    0x3653, 0x2672, 0x1611, 0x0630, 0x76D7, 0x66F6, 0x5695, 0x46B4, 0xB75B, 0xA77A, 0x9719, 0x8738, 0xF7DF, 0xE7FE, 0xD79D, 0xC7BC,
+    0x48C4, 0x58E5, 0x6886, 0x78A7, 0x0840, 0x1861, 0x2802, 0x3823, 0xC9CC, 0xD9ED, 0xE98E, 0xF9AF, 0x8948, 0x9969, 0xA90A, 0xB92B,
+    0x5AF5, 0x4AD4, 0x7AB7, 0x6A96, 0x1A71, 0x0A50, 0x3A33, 0x2A12, 0xDBFD, 0xCBDC, 0xFBBF, 0xEB9E, 0x9B79, 0x8B58, 0xBB3B, 0xAB1A,
+    0x6CA6, 0x7C87, 0x4CE4, 0x5CC5, 0x2C22, 0x3C03, 0x0C60, 0x1C41, 0xEDAE, 0xFD8F, 0xCDEC, 0xDDCD, 0xAD2A, 0xBD0B, 0x8D68, 0x9D49,
+    0x7E97, 0x6EB6, 0x5ED5, 0x4EF4, 0x3E13, 0x2E32, 0x1E51, 0x0E70, 0xFF9F, 0xEFBE, 0xDFDD, 0xCFFC, 0xBF1B, 0xAF3A, 0x9F59, 0x8F78,
+    0x9188, 0x81A9, 0xB1CA, 0xA1EB, 0xD10C, 0xC12D, 0xF14E, 0xE16F, 0x1080, 0x00A1, 0x30C2, 0x20E3, 0x5004, 0x4025, 0x7046, 0x6067,
+    0x83B9, 0x9398, 0xA3FB, 0xB3DA, 0xC33D, 0xD31C, 0xE37F, 0xF35E, 0x02B1, 0x1290, 0x22F3, 0x32D2, 0x4235, 0x5214, 0x6277, 0x7256,
+    0xB5EA, 0xA5CB, 0x95A8, 0x8589, 0xF56E, 0xE54F, 0xD52C, 0xC50D, 0x34E2, 0x24C3, 0x14A0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
+    0xA7DB, 0xB7FA, 0x8799, 0x97B8, 0xE75F, 0xF77E, 0xC71D, 0xD73C, 0x26D3, 0x36F2, 0x0691, 0x16B0, 0x6657, 0x7676, 0x4615, 0x5634,
+    0xD94C, 0xC96D, 0xF90E, 0xE92F, 0x99C8, 0x89E9, 0xB98A, 0xA9AB, 0x5844, 0x4865, 0x7806, 0x6827, 0x18C0, 0x08E1, 0x3882, 0x28A3,
+    0xCB7D, 0xDB5C, 0xEB3F, 0xFB1E, 0x8BF9, 0x9BD8, 0xABBB, 0xBB9A, 0x4A75, 0x5A54, 0x6A37, 0x7A16, 0x0AF1, 0x1AD0, 0x2AB3, 0x3A92,
+    0xFD2E, 0xED0F, 0xDD6C, 0xCD4D, 0xBDAA, 0xAD8B, 0x9DE8, 0x8DC9, 0x7C26, 0x6C07, 0x5C64, 0x4C45, 0x3CA2, 0x2C83, 0x1CE0, 0x0CC1,
+    0xEF1F, 0xFF3E, 0xCF5D, 0xDF7C, 0xAF9B, 0xBFBA, 0x8FD9, 0x9FF8, 0x6E17, 0x7E36, 0x4E55, 0x5E74, 0x2E93, 0x3EB2, 0x0ED1, 0x1EF0
+]
+CRC16TableArray = np.uint16(CRC16Table)
 
 # Defined CRC16 calculation function
 def crc16(data: bytes):
     '''
     CRC-16 (CCITT) implemented with a precomputed lookup table
     '''
-    table = [ 
-        0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7, 0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
-        0x1231, 0x0210, 0x3273, 0x2252, 0x52B5, 0x4294, 0x72F7, 0x62D6, 0x9339, 0x8318, 0xB37B, 0xA35A, 0xD3BD, 0xC39C, 0xF3FF, 0xE3DE,
-        0x2462, 0x3443, 0x0420, 0x1401, 0x64E6, 0x74C7, 0x44A4, 0x5485, 0xA56A, 0xB54B, 0x8528, 0x9509, 0xE5EE, 0xF5CF, 0xC5AC, 0xD58D,
-        0x3653, 0x2672, 0x1611, 0x0630, 0x76D7, 0x66F6, 0x5695, 0x46B4, 0xB75B, 0xA77A, 0x9719, 0x8738, 0xF7DF, 0xE7FE, 0xD79D, 0xC7BC,
-        0x48C4, 0x58E5, 0x6886, 0x78A7, 0x0840, 0x1861, 0x2802, 0x3823, 0xC9CC, 0xD9ED, 0xE98E, 0xF9AF, 0x8948, 0x9969, 0xA90A, 0xB92B,
-        0x5AF5, 0x4AD4, 0x7AB7, 0x6A96, 0x1A71, 0x0A50, 0x3A33, 0x2A12, 0xDBFD, 0xCBDC, 0xFBBF, 0xEB9E, 0x9B79, 0x8B58, 0xBB3B, 0xAB1A,
-        0x6CA6, 0x7C87, 0x4CE4, 0x5CC5, 0x2C22, 0x3C03, 0x0C60, 0x1C41, 0xEDAE, 0xFD8F, 0xCDEC, 0xDDCD, 0xAD2A, 0xBD0B, 0x8D68, 0x9D49,
-        0x7E97, 0x6EB6, 0x5ED5, 0x4EF4, 0x3E13, 0x2E32, 0x1E51, 0x0E70, 0xFF9F, 0xEFBE, 0xDFDD, 0xCFFC, 0xBF1B, 0xAF3A, 0x9F59, 0x8F78,
-        0x9188, 0x81A9, 0xB1CA, 0xA1EB, 0xD10C, 0xC12D, 0xF14E, 0xE16F, 0x1080, 0x00A1, 0x30C2, 0x20E3, 0x5004, 0x4025, 0x7046, 0x6067,
-        0x83B9, 0x9398, 0xA3FB, 0xB3DA, 0xC33D, 0xD31C, 0xE37F, 0xF35E, 0x02B1, 0x1290, 0x22F3, 0x32D2, 0x4235, 0x5214, 0x6277, 0x7256,
-        0xB5EA, 0xA5CB, 0x95A8, 0x8589, 0xF56E, 0xE54F, 0xD52C, 0xC50D, 0x34E2, 0x24C3, 0x14A0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-        0xA7DB, 0xB7FA, 0x8799, 0x97B8, 0xE75F, 0xF77E, 0xC71D, 0xD73C, 0x26D3, 0x36F2, 0x0691, 0x16B0, 0x6657, 0x7676, 0x4615, 0x5634,
-        0xD94C, 0xC96D, 0xF90E, 0xE92F, 0x99C8, 0x89E9, 0xB98A, 0xA9AB, 0x5844, 0x4865, 0x7806, 0x6827, 0x18C0, 0x08E1, 0x3882, 0x28A3,
-        0xCB7D, 0xDB5C, 0xEB3F, 0xFB1E, 0x8BF9, 0x9BD8, 0xABBB, 0xBB9A, 0x4A75, 0x5A54, 0x6A37, 0x7A16, 0x0AF1, 0x1AD0, 0x2AB3, 0x3A92,
-        0xFD2E, 0xED0F, 0xDD6C, 0xCD4D, 0xBDAA, 0xAD8B, 0x9DE8, 0x8DC9, 0x7C26, 0x6C07, 0x5C64, 0x4C45, 0x3CA2, 0x2C83, 0x1CE0, 0x0CC1,
-        0xEF1F, 0xFF3E, 0xCF5D, 0xDF7C, 0xAF9B, 0xBFBA, 0x8FD9, 0x9FF8, 0x6E17, 0x7E36, 0x4E55, 0x5E74, 0x2E93, 0x3EB2, 0x0ED1, 0x1EF0
-    ]
-    
+    # Use the JIT-compiled kernel if the Numba backend is active (see RS41Backend)
+    if CRC16Kernel is not None:
+        return CRC16Kernel(np.frombuffer(bytes(data), dtype=np.uint8), CRC16TableArray)
+
     crc = 0xFFFF
     for byte in data:
-        crc = (crc << 8) ^ table[(crc >> 8) ^ byte]
+        crc = (crc << 8) ^ CRC16Table[(crc >> 8) ^ byte]
         crc &= 0xFFFF                                   # important, crc must stay 16bits all the way through
     return crc
 
+def crc16Batch(DataArray):
+    '''
+    CRC-16 (CCITT) of each row of an (N, length) uint8 array. Returns an (N,) uint16 array
+    '''
+    crc = np.full(len(DataArray), 0xFFFF, dtype=np.uint16)
+    for i in range(DataArray.shape[1]):
+        crc = (crc << 8) ^ CRC16TableArray[(crc >> 8) ^ DataArray[:, i]]
+    return crc
+
 
 # %% Build the first part of the RS-41 message
 #############################################
@@ -124,7 +150,7 @@ def GetRadiosondeID(MessageBytes):
     # D = Day of week: 1 = Monday, 2 = Tuesday, 3= Wednesday,
     #                  4 =Thursday, 5 = Friday, 6 =Saturday, 7 =Sunday
     # For example, the first product manufactured on Tuesday during week 14 in 2017 would be referred to as N1420001
-    RadiosondeID = MessageBytes[0x03D:0x045].decode("utf-8")
+    RadiosondeID = bytes(MessageBytes[0x03D:0x045]).decode("utf-8")
     return RadiosondeID
 
 def SetRadiosondeID(RadiosondeID, MessageBytes):
@@ -1035,6 +1061,36 @@ def GetSVsReceptionQualityData(MessageBytes):
         SVsReceptionQualityTable[i][2] = int(PRNandReceptionQualityIndicatorArray[i * 2 + 1] & 0x1F) + 20
     return PRNandReceptionQualityIndicatorArray, SVsReceptionQualityTable
 
+def GetSVsReceptionQualityDataBatch(MessageArray):
+    '''
+    Get RS41 GPS SVs reception quality data from an (N, 320 or more) uint8 array of RS41 message bytes, one message
+    per row. Returns three (N, 12) arrays, one column per slot: SV's PRN number, SV's mesQI and SV's c/N0.
+    The values are the same as the columns of GetSVsReceptionQualityData's table
+    '''
+    # Get bytes 155 to 178 (0x09B to 0x0B2): 24 bytes. 12 slots of (PRN number, Reception Quality Indicator)
+    PRNandReceptionQualityIndicatorArray = MessageArray[:, 0x09B:0x0B3].reshape(-1, 12, 2)
+    PRN = PRNandReceptionQualityIndicatorArray[:, :, 0].astype(np.int32)
+    mesQI = (PRNandReceptionQualityIndicatorArray[:, :, 1] >> 5).astype(np.int32)
+    CN0 = (PRNandReceptionQualityIndicatorArray[:, :, 1] & 0x1F).astype(np.int32) + 20
+    return PRN, mesQI, CN0
+
+def GetSVsSignalStatistics(PRN, CN0):
+    '''
+    Get per-satellite signal statistics from (N, 12) PRN and c/N0 arrays (see GetSVsReceptionQualityDataBatch),
+    e.g. over a whole flight. Empty slots (PRN 0, or 0xFF as filled by the framework) are ignored. Returns the PRN numbers, and for each of them the
+    number of slots it was received in, and its mean, minimal and maximal c/N0
+    '''
+    PRN = PRN.ravel()
+    CN0 = CN0.ravel()
+    Valid = (PRN != 0) & (PRN != 0xFF)
+    PRNs, PRNIndexes, Counts = np.unique(PRN[Valid], return_inverse=True, return_counts=True)
+    MeanCN0 = np.bincount(PRNIndexes, weights=CN0[Valid], minlength=len(PRNs)) / np.maximum(Counts, 1)
+    MinCN0 = np.full(len(PRNs), np.iinfo(np.int32).max)
+    MaxCN0 = np.full(len(PRNs), np.iinfo(np.int32).min)
+    np.minimum.at(MinCN0, PRNIndexes, CN0[Valid])
+    np.maximum.at(MaxCN0, PRNIndexes, CN0[Valid])
+    return PRNs, Counts, MeanCN0, MinCN0, MaxCN0
+
 def SetSVsReceptionQualityData(PRNandReceptionQualityIndicatorArray, MessageBytes):
     '''
     Set RS41 GPS SVs reception quality data in RS41 message byte array
@@ -1160,6 +1216,21 @@ def GetPsaudorangeandVelocityData(MessageBytes):
         SVsReceptionQualityTable[i][1] = int.from_bytes(PsaudorangeandVelocityArray[i*7+4:i*7+7],byteorder='little', signed=True)
     return PsaudorangeandVelocityArray, SVsReceptionQualityTable
 
+def GetPsaudorangeandVelocityDataBatch(MessageArray):
+    '''
+    Get RS41 GPS SV's psaudorange and velocity data from an (N, 320 or more) uint8 array of RS41 message bytes, one
+    message per row. Returns two (N, 12) int32 arrays, one column per satellite: deltaPR from minPR [cm] and
+    Vehicle-SV's relative velocity [cm/sec]. The values are the same as the columns of GetPsaudorangeandVelocityData's table
+    '''
+    # Get bytes 188 to 271 (0x0BC to 0x10F): 84 bytes. 12 records of (deltaPR (int32), velocity (int24))
+    Records = MessageArray[:, 0x0BC:0x110].reshape(-1, 12, 7).astype(np.int32)
+    DeltaPR = (Records[:, :, 0] | (Records[:, :, 1] << 8) | (Records[:, :, 2] << 16) | (Records[:, :, 3] << 24))
+    Velocity = (Records[:, :, 4] | (Records[:, :, 5] << 8) | (Records[:, :, 6] << 16))
+    
+    # Sign extend the int24 velocity
+    Velocity = (Velocity ^ 0x800000) - 0x800000
+    return DeltaPR, Velocity
+
 def SetPsaudorangeandVelocityData(PsaudorangeandVelocityArray, MessageBytes):
     '''
     Set RS41 GPS SV's psaudorange and velocity data in RS41 message byte array
@@ -1512,9 +1583,42 @@ def BuildEMPTYblock(MessageBytes):
 # Add the Reed-Solomon parity bytes to the first part of the message #
 ######################################################################
 
-def DecodeReedSolomon(MessageBytes):
+def GetReedSolomonCoder():
     '''
-    Decode the RS41 message can be decoded using the reed-solomon parity bytes from the RS41 message byte array
+    Get the RS41 reed-solomon coder. The coder is built once, on first use
+    '''
+    global RS_Coder
+    if RS_Coder is None:
+        from reedsolo import RSCodec
+        RS_Coder = RSCodec(RS_ECCSymbols)
+    return RS_Coder
+
+def GetErasurePositions(ByteReliability, CodewordIndexes, ErasureThreshold, MaxErasures):
+    '''
+    Get the erasure positions of a Reed-Solomon codeword: the least reliable bytes, with a reliability below the threshold
+    '''
+    CodewordReliability = np.asarray(ByteReliability)[CodewordIndexes]
+    LeastReliable = np.argsort(CodewordReliability, kind='stable')[:MaxErasures]
+    return [int(Position) for Position in LeastReliable if CodewordReliability[Position] < ErasureThreshold]
+
+def DecodeReedSolomonCodeword(RS_Coder, Codeword, ErasurePositions):
+    '''
+    Decode a Reed-Solomon codeword. If decoding with the erasure positions fails, the codeword is decoded without them
+    '''
+    if ErasurePositions:
+        try:
+            return RS_Coder.decode(Codeword, erase_pos=ErasurePositions)
+        except Exception:
+            pass
+    return RS_Coder.decode(Codeword)
+
+def DecodeReedSolomon(MessageBytes, ByteReliability = None, ErasureThreshold = 0.5, MaxErasures = 12):
+    '''
+    Decode the RS41 message can be decoded using the reed-solomon parity bytes from the RS41 message byte array.
+    If ByteReliability (a reliability score per message byte, 1.0 = reliable, see RS41Demodulator) is given, the
+    least reliable bytes of each codeword (up to MaxErasures, below ErasureThreshold) are decoded as erasures.
+    Each erasure takes one parity symbol instead of two. MaxErasures is kept below 24 (the number of parity
+    symbols), so some parity symbols are left to correct unmarked errors and to detect uncorrectable codewords
     '''
     # Prepare the data for reed-solomon calculation.
     # The basic RS-41 message comprise 320 bytes:
@@ -1532,11 +1636,20 @@ def DecodeReedSolomon(MessageBytes):
     RS_Parity1 = MessageBytes[0x01F:0x007:-1]
     RS_Parity2 = MessageBytes[0x037:0x01F:-1]
     
+    # Messages without errors (all syndromes are zero) need no correction
+    Codewords = np.frombuffer(bytes(MessageBytes[0:0x140]), dtype=np.uint8)[RS_CodewordIndexes]
+    if not(CalculateSyndromesBatch(Codewords).any()):
+        return True
+
     # Check f the data can be decoded sucessfuly
-    RS_ECCSymbols = 24 # 24 ECC symbols
-    RS_Coder = RSCodec(RS_ECCSymbols)
-    rmes1, rmesecc1, errata_pos1 = RS_Coder.decode(RS_ReversedInterlevedData1 + RS_Parity1)
-    rmes2, rmesecc2, errata_pos2 = RS_Coder.decode(RS_ReversedInterlevedData2 + RS_Parity2)
+    RS_Coder = GetReedSolomonCoder()
+    ErasurePositions1 = []
+    ErasurePositions2 = []
+    if ByteReliability is not None:
+        ErasurePositions1 = GetErasurePositions(ByteReliability, RS_CodewordIndexes1, ErasureThreshold, MaxErasures)
+        ErasurePositions2 = GetErasurePositions(ByteReliability, RS_CodewordIndexes2, ErasureThreshold, MaxErasures)
+    rmes1, rmesecc1, errata_pos1 = DecodeReedSolomonCodeword(RS_Coder, bytearray(RS_ReversedInterlevedData1) + bytearray(RS_Parity1), ErasurePositions1)
+    rmes2, rmesecc2, errata_pos2 = DecodeReedSolomonCodeword(RS_Coder, bytearray(RS_ReversedInterlevedData2) + bytearray(RS_Parity2), ErasurePositions2)
     RS1_Recoverable = RS_Coder.check(rmesecc1)[0]
     RS2_Recoverable = RS_Coder.check(rmesecc2)[0]
     
@@ -1563,8 +1676,7 @@ def SetReedSolomon(MessageBytes):
     RS_ReversedInterlevedData2 = MessageBytes[0x13F:0x038:-2]
     
     # Calculate the Reed-Solomon parity bytes
-    RS_ECCSymbols = 24 # 24 ECC symbols
-    RS_Coder = RSCodec(RS_ECCSymbols)
+    RS_Coder = GetReedSolomonCoder()
     RS_ReversedParity1 = RS_Coder.encode(RS_ReversedInterlevedData1)
     RS_ReversedParity2 = RS_Coder.encode(RS_ReversedInterlevedData2)
     
@@ -1573,4 +1685,307 @@ def SetReedSolomon(MessageBytes):
     # Each encoded message comprise the 132 data bytes and 24 parity bytes
     # The 24 parity bytes are in reverse order (little endian)
     MessageBytes[0x008:0x020] = RS_ReversedParity1[132+RS_ECCSymbols:131:-1]
-    MessageBytes[0x020:0x038] = RS_ReversedParity2[132+RS_ECCSymbols:131:-1]
\ No newline at end of file
+    MessageBytes[0x020:0x038] = RS_ReversedParity2[132+RS_ECCSymbols:131:-1]
+
+# %% Batch Reed-Solomon decoding with NumPy
+###########################################
+# Batch Reed-Solomon decoding with NumPy #
+###########################################
+# The same code as the reedsolo coder used above: GF(256) with the primitive polynomial 0x11D, generator 2,
+# first consecutive root 0 and 24 parity symbols. Each codeword is 156 bytes (132 data bytes + 24 parity bytes).
+# The decoding steps follow reedsolo's (syndromes, Berlekamp-Massey, Chien search, Forney), but each step
+# processes all of the codewords of a batch at once, using log/antilog table lookups
+
+RS_CodewordLength = 132 + RS_ECCSymbols
+
+def BuildGaloisFieldTables(Primitive = 0x11D):
+    '''
+    Build the GF(256) tables: antilog (exponent) table, log table and 256x256 multiplication table
+    '''
+    GF_Exp = np.zeros(512, dtype=np.uint8)
+    GF_Log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        GF_Exp[i] = x
+        GF_Log[x] = i
+        x = x << 1
+        if x & 0x100:
+            x = x ^ Primitive
+    GF_Exp[255:510] = GF_Exp[0:255]
+    Values = np.arange(256)
+    GF_Multiply = np.where((Values[:, None] != 0) & (Values[None, :] != 0),
+                           GF_Exp[GF_Log[Values][:, None] + GF_Log[Values][None, :]], 0).astype(np.uint8)
+    return GF_Exp, GF_Log, GF_Multiply
+
+RS_GFExp, RS_GFLog, RS_GFMultiply = BuildGaloisFieldTables()
+RS_GFInverse = RS_GFExp[(255 - RS_GFLog) % 255] # RS_GFInverse[0] is not used
+
+# Powers of the generator: RS_SyndromePowers[j] = 2^j, for the syndromes evaluation (Horner's method, see RS41Backend)
+RS_SyndromePowers = RS_GFExp[np.arange(RS_ECCSymbols)]
+
+# Codeword position p holds the coefficient of degree 155-p. Its error locator is X = 2^(155-p).
+# RS_LocatorPowers[k, p] = X^-k, for evaluating polynomials at X^-1 (Chien search and Forney algorithm)
+RS_LocatorDegrees = RS_CodewordLength - 1 - np.arange(RS_CodewordLength)
+RS_LocatorPowers = RS_GFExp[(-np.arange(RS_ECCSymbols + 2)[:, None] * RS_LocatorDegrees[None, :]) % 255]
+RS_Locators = RS_GFExp[RS_LocatorDegrees % 255]
+
+# RS_SyndromeMatrix[p, j] = (2^j)^(155-p): Syndrome j = XOR of Codeword[p] * RS_SyndromeMatrix[p, j]
+RS_SyndromeMatrix = RS_GFExp[(RS_LocatorDegrees[:, None] * np.arange(RS_ECCSymbols)[None, :]) % 255]
+RS_SyndromeBatchSize = 512 # Codewords per (BatchSize, 156, 24) products array
+
+def CalculateSyndromesBatch(Codewords):
+    '''
+    Calculate the Reed-Solomon syndromes of an (N, 156) codewords array. Returns an (N, 24) array
+    '''
+    if SyndromesKernel is not None:
+        return SyndromesKernel(np.ascontiguousarray(Codewords), RS_GFMultiply, RS_SyndromePowers)
+    Syndromes = np.zeros((len(Codewords), RS_ECCSymbols), dtype=np.uint8)
+    for Start in range(0, len(Codewords), RS_SyndromeBatchSize):
+        Batch = Codewords[Start:Start + RS_SyndromeBatchSize]
+        Syndromes[Start:Start + len(Batch)] = np.bitwise_xor.reduce(RS_GFMultiply[Batch[:, :, None], RS_SyndromeMatrix], axis=1)
+    return Syndromes
+
+def FindErrorLocatorBatch(Syndromes):
+    '''
+    Find the error locator polynomials of an (N, 24) syndromes array, with reedsolo's Berlekamp-Massey iterations.
+    Returns an (N, 26) array of polynomial coefficients, lowest degree first
+    '''
+    if ErrorLocatorKernel is not None:
+        return ErrorLocatorKernel(np.ascontiguousarray(Syndromes), RS_GFMultiply, RS_GFInverse)
+    NumOfCodewords = len(Syndromes)
+    ErrorLocator = np.zeros((NumOfCodewords, RS_ECCSymbols + 2), dtype=np.uint8)
+    OldLocator = np.zeros((NumOfCodewords, RS_ECCSymbols + 2), dtype=np.uint8)
+    ErrorLocator[:, 0] = 1
+    OldLocator[:, 0] = 1
+    # reedsolo keeps the polynomials as lists, and compares their lengths (including leading zeros)
+    ErrorLocatorLength = np.ones(NumOfCodewords, dtype=np.int32)
+    OldLocatorLength = np.ones(NumOfCodewords, dtype=np.int32)
+    for i in range(RS_ECCSymbols):
+        # Discrepancy: the coefficient of degree i of ErrorLocator * Syndromes
+        Delta = np.bitwise_xor.reduce(RS_GFMultiply[ErrorLocator[:, 0:i+1], Syndromes[:, i::-1]], axis=1)
+
+        # OldLocator = OldLocator * x
+        OldLocator[:, 1:] = OldLocator[:, :-1].copy()
+        OldLocator[:, 0] = 0
+        OldLocatorLength = OldLocatorLength + 1
+
+        # Swap the polynomials where the old locator is longer (reedsolo's rule B)
+        Update = Delta != 0
+        Swap = Update & (OldLocatorLength > ErrorLocatorLength)
+        if Swap.any():
+            NewLocator = RS_GFMultiply[OldLocator[Swap], Delta[Swap, None]]
+            OldLocator[Swap] = RS_GFMultiply[ErrorLocator[Swap], RS_GFInverse[Delta[Swap, None]]]
+            ErrorLocator[Swap] = NewLocator
+            ErrorLocatorLength[Swap], OldLocatorLength[Swap] = OldLocatorLength[Swap], ErrorLocatorLength[Swap]
+
+        # ErrorLocator = ErrorLocator + OldLocator * Delta
+        ErrorLocator[Update] ^= RS_GFMultiply[OldLocator[Update], Delta[Update, None]]
+        ErrorLocatorLength[Update] = np.maximum(ErrorLocatorLength[Update], OldLocatorLength[Update])
+    return ErrorLocator
+
+def DecodeReedSolomonCodewordsBatch(Codewords):
+    '''
+    Decode an (N, 156) array of Reed-Solomon codewords. Returns the corrected codewords and an (N,) boolean array
+    of the successfully decoded codewords. The codewords that can't be decoded are returned unchanged
+    '''
+    Codewords = np.asarray(Codewords, dtype=np.uint8)
+    Corrected = Codewords.copy()
+    Syndromes = CalculateSyndromesBatch(Codewords)
+    Errored = np.flatnonzero(Syndromes.any(axis=1))
+    Success = np.ones(len(Codewords), dtype=bool)
+    if len(Errored) == 0:
+        return Corrected, Success
+    Syndromes = Syndromes[Errored]
+
+    # Error locator polynomials and the number of errors (the polynomials degrees)
+    ErrorLocator = FindErrorLocatorBatch(Syndromes)
+    NumOfErrors = (RS_ECCSymbols + 1) - np.argmax(ErrorLocator[:, ::-1] != 0, axis=1)
+    Correctable = 2 * NumOfErrors <= RS_ECCSymbols
+    ErrorLocator = ErrorLocator[:, 0:(RS_ECCSymbols // 2) + 1] # The degree of a correctable error locator is 12 or less
+
+    # Chien search: the error positions are the roots of the error locator, at X^-1
+    LocatorValues = np.zeros((len(Errored), RS_CodewordLength), dtype=np.uint8)
+    for k in range(ErrorLocator.shape[1]):
+        LocatorValues ^= RS_GFMultiply[ErrorLocator[:, k:k+1], RS_LocatorPowers[k]]
+    ErrorPositions = LocatorValues == 0
+    Correctable &= ErrorPositions.sum(axis=1) == NumOfErrors
+
+    # Forney algorithm: Error magnitude = X * Omega(X^-1) / Lambda'(X^-1), where Omega = Syndromes * Lambda mod x^24
+    ErrorEvaluator = np.zeros((len(Errored), RS_ECCSymbols), dtype=np.uint8)
+    for k in range(ErrorLocator.shape[1]):
+        ErrorEvaluator[:, k:] ^= RS_GFMultiply[ErrorLocator[:, k:k+1], Syndromes[:, 0:RS_ECCSymbols-k]]
+    EvaluatorValues = np.zeros((len(Errored), RS_CodewordLength), dtype=np.uint8)
+    for k in range(RS_ECCSymbols):
+        EvaluatorValues ^= RS_GFMultiply[ErrorEvaluator[:, k:k+1], RS_LocatorPowers[k]]
+    DerivativeValues = np.zeros((len(Errored), RS_CodewordLength), dtype=np.uint8)
+    for k in range(1, ErrorLocator.shape[1], 2):
+        DerivativeValues ^= RS_GFMultiply[ErrorLocator[:, k:k+1], RS_LocatorPowers[k-1]]
+    Correctable &= ~(ErrorPositions & (DerivativeValues == 0)).any(axis=1)
+    Magnitudes = RS_GFMultiply[RS_GFMultiply[EvaluatorValues, RS_Locators], RS_GFInverse[DerivativeValues]]
+    Magnitudes[~ErrorPositions] = 0
+
+    # Correct the errors, and check that the results are codewords
+    ErroredCorrected = Codewords[Errored] ^ Magnitudes
+    Correctable &= ~CalculateSyndromesBatch(ErroredCorrected).any(axis=1)
+    Corrected[Errored[Correctable]] = ErroredCorrected[Correctable]
+    Success[Errored] = Correctable
+    return Corrected, Success
+
+def DecodeReedSolomonBatch(MessageArray):
+    '''
+    Decode RS41 messages using the reed-solomon parity bytes, for an (N, 320 or more) uint8 array of RS41 message
+    bytes, one message per row. The messages are corrected in place. Returns an (N,) boolean array of the
+    successfully decoded messages. As with DecodeReedSolomon, a message is corrected only if both of its
+    codewords are decoded successfully, and the results are identical to DecodeReedSolomon's
+    '''
+    # Build both codewords of each message (see DecodeReedSolomon), as rows of a single (2N, 156) array
+    NumOfMessages = len(MessageArray)
+    Codewords = np.concatenate((MessageArray[:, RS_CodewordIndexes1], MessageArray[:, RS_CodewordIndexes2]))
+    Corrected, Success = DecodeReedSolomonCodewordsBatch(Codewords)
+    Recoverable = Success[:NumOfMessages] & Success[NumOfMessages:]
+
+    # Place the corrected codewords back in the messages
+    Recovered = np.flatnonzero(Recoverable)
+    MessageArray[Recovered[:, None], RS_CodewordIndexes1[None, :]] = Corrected[Recovered]
+    MessageArray[Recovered[:, None], RS_CodewordIndexes2[None, :]] = Corrected[NumOfMessages + Recovered]
+    return Recoverable
+
+def BuildGeneratorPolynomial():
+    '''
+    Build the Reed-Solomon generator polynomial (highest degree first): the product of (x - 2^i), i = 0 to 23
+    '''
+    Generator = np.ones(1, dtype=np.uint8)
+    for i in range(RS_ECCSymbols):
+        Product = np.zeros(len(Generator) + 1, dtype=np.uint8)
+        Product[:-1] = Generator
+        Product[1:] ^= RS_GFMultiply[Generator, RS_GFExp[i]]
+        Generator = Product
+    return Generator
+
+RS_Generator = BuildGeneratorPolynomial()
+
+def SetReedSolomonBatch(MessageArray):
+    '''
+    Set the reed-solomon parity bytes of RS41 messages, for an (N, 320 or more) uint8 array of RS41 message bytes,
+    one message per row, in place. The results are identical to SetReedSolomon's
+    '''
+    # Both codewords of each message, as rows of a single (2N, 156) array. The parity is the remainder of the
+    # data polynomial (times x^24) divided by the generator polynomial, by synthetic division of all rows at once
+    NumOfMessages = len(MessageArray)
+    Codewords = np.concatenate((MessageArray[:, RS_CodewordIndexes1], MessageArray[:, RS_CodewordIndexes2]))
+    Remainders = np.zeros((len(Codewords), RS_ECCSymbols + 1), dtype=np.uint8)
+    for i in range(RS_CodewordLength - RS_ECCSymbols):
+        Remainders[:, 0:RS_ECCSymbols] = Remainders[:, 1:] ^ RS_GFMultiply[Remainders[:, 0:1] ^ Codewords[:, i:i+1], RS_Generator[None, 1:]]
+    MessageArray[:, RS_CodewordIndexes1[RS_CodewordLength - RS_ECCSymbols:]] = Remainders[:NumOfMessages, 0:RS_ECCSymbols]
+    MessageArray[:, RS_CodewordIndexes2[RS_CodewordLength - RS_ECCSymbols:]] = Remainders[NumOfMessages:, 0:RS_ECCSymbols]
+
+# %% Walk the message blocks
+#############################
+# Walk the message blocks #
+#############################
+# The blocks following the frame type byte are ID/length pairs: Block ID (1 byte), block length (1 byte),
+# block data (length bytes) and the block data CRC (2 bytes, little endian). The walker below follows these
+# pairs from 0x039 to the end of the frame, so the blocks are found wherever they are: in regular (0x0F)
+# frames, in extended (0xF0) frames and in the RS41-SGM layouts (7F-MEASSHORT, 80-CRYPTO).
+# The Read*block functions above read fixed offsets. A block found at its regular frame offset is read in
+# place. A block found elsewhere is copied to its regular frame offset in a scratch message first
+
+RegularFrameLength = 0x140  # 320 bytes per RS41 regular frame message
+ExtendedFrameLength = 0x206 # 518 bytes per RS41 extended frame message
+FirstBlockOffset = 0x039
+
+def ReadRAWblock(MessageBytes, BlockOffset, BlockLength):
+    '''
+    Get the data bytes of a block with no decoder (EMPTY, MEASSHORT, CRYPTO), from RS41 message byte array
+    '''
+    return bytes(MessageBytes[BlockOffset+2:BlockOffset+2+BlockLength])
+
+# Block decoders: Block ID -> (Block name, Regular frame block offset, Block length, Read function).
+# Read functions with a regular frame block offset get a message byte array with the block at that offset,
+# and only read blocks of the given length (the block ID isn't covered by the block CRC, so a corrupted
+# block ID would otherwise be read with the wrong layout).
+# Read functions without one (None) get the message byte array, the block offset and the block length
+BlockDecoders = {
+    0x79: ('STATUS',    0x039, 0x28, ReadSTATUSblock),
+    0x7A: ('MEAS',      0x065, 0x2A, ReadMEASblock),
+    0x7C: ('GPSINFO',   0x093, 0x1E, ReadGPSINFOblock),
+    0x7D: ('GPSRAW',    0x0B5, 0x59, ReadGPSRAWblock),
+    0x7B: ('GPSPOS',    0x112, 0x15, ReadGPSPOSblock),
+    0x76: ('EMPTY',     None,  None, ReadRAWblock),
+    0x7F: ('MEASSHORT', None,  None, ReadRAWblock),
+    0x80: ('CRYPTO',    None,  None, ReadRAWblock),
+}
+
+def GetFrameLength(MessageBytes):
+    '''
+    Get RS41 frame length from RS41 message byte array: 518 bytes for an extended frame (0xF0), 320 bytes otherwise
+    '''
+    if (len(MessageBytes) >= ExtendedFrameLength) and (GetFrameType(MessageBytes) == 0xF0):
+        return ExtendedFrameLength
+    return RegularFrameLength
+
+def FitFrameLength(MessageBytes):
+    '''
+    Fit a RS41 message byte array (e.g. a log record or a received frame) to its frame length (see GetFrameLength):
+    the bytes past the frame are cut, and a short frame is padded with zero bytes. Returns a new byte array
+    '''
+    MessageBytes = bytearray(MessageBytes[0:ExtendedFrameLength]) + bytearray(max(0, ExtendedFrameLength - len(MessageBytes)))
+    return MessageBytes[0:GetFrameLength(MessageBytes)]
+
+def WalkMessageBlocks(MessageBytes, FrameLength = None):
+    '''
+    Walk the blocks of RS41 message byte array. Returns a list of (BlockID, BlockOffset, BlockLength, CRCOK)
+    in transmission order. The walk stops at the end of the frame, or at a block length that overruns it.
+    A known block with a corrupted length byte is walked over with its regular length, if its CRC checks with it.
+    Default frame length: by the frame type (see GetFrameLength)
+    '''
+    if FrameLength is None:
+        FrameLength = GetFrameLength(MessageBytes)
+    Blocks = []
+    BlockOffset = FirstBlockOffset
+    while BlockOffset + 4 <= FrameLength:
+        BlockID = MessageBytes[BlockOffset]
+        BlockLength = MessageBytes[BlockOffset+1]
+        CRCOffset = BlockOffset + 2 + BlockLength
+        if CRCOffset + 2 > FrameLength:
+            break # Corrupted block length
+        CRCOK = (MessageBytes[CRCOffset] | (MessageBytes[CRCOffset+1] << 8)) == crc16(MessageBytes[BlockOffset+2:CRCOffset])
+        if not(CRCOK) and (BlockID in BlockDecoders):
+            RegularBlockLength = BlockDecoders[BlockID][2]
+            if (RegularBlockLength is not None) and (RegularBlockLength != BlockLength) \
+               and (BlockOffset + 4 + RegularBlockLength <= FrameLength):
+                RegularCRCOffset = BlockOffset + 2 + RegularBlockLength
+                if (MessageBytes[RegularCRCOffset] | (MessageBytes[RegularCRCOffset+1] << 8)) \
+                   == crc16(MessageBytes[BlockOffset+2:RegularCRCOffset]):
+                    BlockLength, CRCOffset, CRCOK = RegularBlockLength, RegularCRCOffset, True
+        Blocks.append((BlockID, BlockOffset, BlockLength, CRCOK))
+        BlockOffset = CRCOffset + 2
+    return Blocks
+
+def ParseMessageBlocks(MessageBytes, FrameLength = None, SkipBadCRC = True):
+    '''
+    Parse the blocks of RS41 message byte array, by walking the block ID/length pairs and dispatching each
+    block to its decoder in BlockDecoders. Returns a dictionary: Block name -> the block's Read function results.
+    Unknown blocks and (by default) blocks with a bad CRC are skipped. Default frame length: by the frame type.
+    Correct the message with DecodeReedSolomon first: a corrupted block length byte derails the walk
+    '''
+    Parsed = {}
+    ScratchMessageBytes = None
+    for BlockID, BlockOffset, BlockLength, CRCOK in WalkMessageBlocks(MessageBytes, FrameLength):
+        Decoder = BlockDecoders.get(BlockID)
+        if (Decoder is None) or (SkipBadCRC and not(CRCOK)):
+            continue
+        BlockName, RegularBlockOffset, RegularBlockLength, ReadFunction = Decoder
+        if RegularBlockOffset is None:
+            Parsed[BlockName] = ReadFunction(MessageBytes, BlockOffset, BlockLength)
+        elif BlockLength != RegularBlockLength:
+            continue
+        elif BlockOffset == RegularBlockOffset:
+            Parsed[BlockName] = ReadFunction(MessageBytes)
+        else:
+            # Move the block to its regular frame offset
+            if ScratchMessageBytes is None:
+                ScratchMessageBytes = bytearray(RegularFrameLength)
+            ScratchMessageBytes[RegularBlockOffset:RegularBlockOffset+BlockLength+4] = MessageBytes[BlockOffset:BlockOffset+BlockLength+4]
+            Parsed[BlockName] = ReadFunction(ScratchMessageBytes)
+    return Parsed
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 incremental calibration reassembly
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions reassemble the subframes    #
+# array frame by frame, for a live receive  #
+# display.                                  #
+#                                           #
+# The calibration coefficients are spread   #
+# over 51 subframes, one subframe per       #
+# frame. Rather than waiting for the whole  #
+# cycle (see LoadSubframeDataFromLog), each #
+# measurement is published as soon as the   #
+# subframes holding its coefficients were   #
+# received:                                 #
+# - Temperature: subframes 0x03 to 0x06     #
+# - Heater temperature: 0x03 to 0x04 and    #
+#   0x12 to 0x13                            #
+# - Pressure: 0x25 to 0x2A                  #
+# - Relative humidity: its coefficients,    #
+#   the RS41 model, and the temperature,    #
+#   heater temperature and (RS41-SGP)       #
+#   pressure coefficients                   #
+#############################################
+
+import numpy as np
+from RS41Functions import *
+
+# Calibration groups: group name -> the subframes array regions the group's Get functions read,
+# as (start address, end address + 1)
+CalibrationGroups = {
+    'Temperature':       [(0x03D, 0x045), (0x04D, 0x065)], # TempRefRes, TempPolCoeff, TempCalCoeff
+    'HeaterTemperature': [(0x03D, 0x045), (0x125, 0x13D)], # TempRefRes, HeaterTempPolCoeff, HeaterTempCalCoeff
+    'Pressure':          [(0x25E, 0x2A6)],                 # PressureCalCoeff
+    'RelativeHumidity':  [(0x045, 0x04D), (0x075, 0x125),  # RHCapCoeff, HumidCalCoeff, HumHeaterTempCalCoeff
+                          (0x218, 0x222),                  # RS41Model
+                          (0x2A6, 0x2B2), (0x2BA, 0x2EA)], # HumCPressureCalCoeff, HumCPressureTempCalCoeff
+}
+
+def GetCalibrationGroupSubframes(Regions):
+    '''
+    Get the numbers of the subframes holding a list of subframes array regions
+    '''
+    Subframes = set()
+    for Start, End in Regions:
+        Subframes.update(range(Start // 16, ((End - 1) // 16) + 1))
+    return sorted(Subframes)
+
+# Calibration group subframes: group name -> the subframe numbers of the group
+CalibrationGroupSubframes = {Group: GetCalibrationGroupSubframes(Regions) for Group, Regions in CalibrationGroups.items()}
+
+# %% Reassembly functions
+#########################
+# Reassembly functions #
+#########################
+
+def NewCalibrationReassembler(TotalSubframes = 51):
+    '''
+    Create the state of a calibration reassembly: the subframes array, the received subframes and the complete groups
+    '''
+    return {'TotalSubframes': TotalSubframes,
+            'SubFrameArray': bytearray(TotalSubframes*16),
+            'SubFrameTrack': np.zeros(TotalSubframes, dtype=bool),
+            'CompleteGroups': set(),
+            'RadiosondeID': None}
+
+def ResetCalibrationReassembler(Reassembler):
+    '''
+    Clear a calibration reassembly, e.g. when a new radiosonde is received
+    '''
+    Reassembler['SubFrameArray'][:] = bytes(len(Reassembler['SubFrameArray']))
+    Reassembler['SubFrameTrack'][:] = False
+    Reassembler['CompleteGroups'].clear()
+    Reassembler['RadiosondeID'] = None
+
+def AddFrameToCalibrationReassembler(Reassembler, MessageBytes):
+    '''
+    Add the subframe of a RS41 message byte array (after Reed-Solomon correction) to a calibration reassembly.
+    A frame of another radiosonde restarts the reassembly. Returns a list of the groups completed by the frame
+    '''
+    if not(CheckSTATUSblockCRC(MessageBytes)):
+        return []
+
+    # A new radiosonde ID: the subframes received so far belong to another radiosonde
+    RadiosondeID = GetRadiosondeID(MessageBytes)
+    if RadiosondeID != Reassembler['RadiosondeID']:
+        ResetCalibrationReassembler(Reassembler)
+        Reassembler['RadiosondeID'] = RadiosondeID
+
+    Subframe = GetSubframe(MessageBytes)
+    if Subframe >= Reassembler['TotalSubframes']:
+        return []
+    LoadSubFrameBytes(Subframe, Reassembler['SubFrameArray'], MessageBytes)
+    if Reassembler['SubFrameTrack'][Subframe]:
+        return [] # Already received: no new groups
+    Reassembler['SubFrameTrack'][Subframe] = True
+
+    # Check the groups that hold this subframe
+    CompletedGroups = []
+    for Group, Subframes in CalibrationGroupSubframes.items():
+        if (Group not in Reassembler['CompleteGroups']) and (Subframe in Subframes) \
+           and Reassembler['SubFrameTrack'][Subframes].all():
+            Reassembler['CompleteGroups'].add(Group)
+            CompletedGroups.append(Group)
+    return CompletedGroups
+
+def IsCalibrationReassembled(Reassembler):
+    '''
+    Check if all of the subframes of a calibration reassembly were received
+    '''
+    return bool(Reassembler['SubFrameTrack'].all())
+
+def GetAvailableMeasurements(Reassembler, MessageBytes, GPSAltitude = None):
+    '''
+    Calculate the measurements of a RS41 message byte array (after Reed-Solomon correction) whose calibration
+    groups are complete. Returns a dictionary: measurement name -> value, with the measurements from:
+    'Temperature'       = Ambient temperature [Degrees Celsius]
+    'HeaterTemperature' = Humidity sensor heater temperature [Degrees Celsius]
+    'Pressure'          = Ambient pressure [hPa]
+    'RelativeHumidity'  = Relative humidity [%]. RS41-SGP: needs the pressure. Other models: needs GPSAltitude [m]
+    '''
+    Measurements = {}
+    if not(CheckMEASblockCRC(MessageBytes)):
+        return Measurements
+    CompleteGroups = Reassembler['CompleteGroups']
+    SubFrameArray = Reassembler['SubFrameArray']
+
+    if 'Temperature' in CompleteGroups:
+        Measurements['Temperature'] = GetAmbientTemperature(SubFrameArray, MessageBytes)
+    if 'HeaterTemperature' in CompleteGroups:
+        Measurements['HeaterTemperature'] = GetHeaterTemperature(SubFrameArray, MessageBytes)
+    if 'Pressure' in CompleteGroups:
+        Measurements['Pressure'] = GetPressure(SubFrameArray, MessageBytes)
+
+    # The relative humidity is corrected by the temperatures and by the pressure (or the GPS altitude)
+    if ('RelativeHumidity' in CompleteGroups) and ('Temperature' in Measurements) and ('HeaterTemperature' in Measurements):
+        RS41Model = GetRS41Model(SubFrameArray).rstrip('\x00')
+        if (RS41Model == "RS41-SGP") and ('Pressure' in Measurements):
+            Measurements['RelativeHumidity'] = GetRelativeHumidity(RS41Model, Measurements['Pressure'], 0,
+                                                                   Measurements['Temperature'], Measurements['HeaterTemperature'],
+                                                                   SubFrameArray, MessageBytes)
+        elif (RS41Model != "RS41-SGP") and (GPSAltitude is not None):
+            Measurements['RelativeHumidity'] = GetRelativeHumidity(RS41Model, 0, GPSAltitude,
+                                                                   Measurements['Temperature'], Measurements['HeaterTemperature'],
+                                                                   SubFrameArray, MessageBytes)
+    return Measurements
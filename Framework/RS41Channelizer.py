@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 wideband IQ channelizer
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions decode all of the           #
+# radiosondes in a wideband IQ recording    #
+# (e.g. a 6 MHz capture of the 400-406 MHz  #
+# band) in a single streaming pass:         #
+# 1. The IQ file is memory mapped and read  #
+#    block by block                         #
+# 2. A polyphase FFT filter bank splits the #
+#    band into the 10 kHz RS41 channel      #
+#    raster. The channels are 2x            #
+#    oversampled (20 kHz for a 10 kHz       #
+#    raster), so the RS41 signal isn't      #
+#    aliased at the channel edges           #
+# 3. The active channels are detected in    #
+#    the averaged channel power spectrum,   #
+#    and re-detected as the recording goes. #
+#    A channel that is not detected for a   #
+#    while is flushed and retired           #
+# 4. Each active channel is FM demodulated  #
+#    and fed to a frame demodulator, in a   #
+#    pool of worker processes               #
+#############################################
+
+import multiprocessing
+import queue
+import numpy as np
+from RS41Demodulator import *
+
+ChannelSpacing = 10e3 # [Hz] RS41 channel raster
+
+# IQ file formats: format name -> (file dtype, scale)
+IQFormats = {
+    'cu8':  (np.uint8, 1 / 127.5),    # Interleaved unsigned 8 bit I/Q (rtl_sdr)
+    'cs8':  (np.int8, 1 / 128.0),     # Interleaved signed 8 bit I/Q (hackrf_transfer)
+    'cs16': (np.int16, 1 / 32768.0),  # Interleaved signed 16 bit I/Q
+    'cf32': (np.complex64, 1.0),      # Complex 32 bit float (GNU Radio)
+}
+
+# %% Input functions
+###################
+# Input functions #
+###################
+
+def ReadIQFile(IQFileName, Format = 'cu8'):
+    '''
+    Memory map an IQ file. Returns the raw file array (see IQFormats) and the number of IQ samples
+    '''
+    FileDtype = IQFormats[Format][0]
+    Raw = np.memmap(IQFileName, dtype=FileDtype, mode='r')
+    NumOfSamples = len(Raw) if FileDtype == np.complex64 else len(Raw) // 2
+    return Raw, NumOfSamples
+
+def GetIQSamples(Raw, Format, Start, End):
+    '''
+    Get IQ samples [Start:End] of a memory mapped IQ file, as a complex64 array
+    '''
+    FileDtype, Scale = IQFormats[Format]
+    if FileDtype == np.complex64:
+        return np.array(Raw[Start:End], dtype=np.complex64)
+    Interleaved = np.asarray(Raw[2*Start:2*End], dtype=np.float32)
+    if FileDtype == np.uint8:
+        Interleaved = Interleaved - 127.5
+    Samples = Interleaved.view(np.complex64)
+    Samples *= Scale
+    return Samples
+
+# %% Polyphase filter bank
+##########################
+# Polyphase filter bank #
+##########################
+# A weighted overlap-add FFT filter bank with NumOfChannels channels and a decimation of NumOfChannels / 2.
+# Output n of channel k is the FFT of the windowed input segment [n*D : n*D + L*M], folded to M samples.
+# The FFT is relative to the segment start, so each output is rotated by exp(-2j*pi*k*n*D/M) = (-1)^(k*n)
+
+def NewChannelizerState(SampleRate, ChannelSpacing = ChannelSpacing, TapsPerPhase = 8, ChannelBandwidth = 12e3,
+                        OutputBatchSize = 256):
+    '''
+    Create the state of a polyphase FFT channelizer. The sample rate must be an even multiple of the channel spacing.
+    ChannelBandwidth = The prototype low pass filter bandwidth (the RS41 signal is about 12 kHz wide)
+    '''
+    import scipy.signal as signal
+    NumOfChannels = int(round(SampleRate / ChannelSpacing))
+    if (NumOfChannels % 2) or (abs(NumOfChannels * ChannelSpacing - SampleRate) > 1e-6 * SampleRate):
+        raise ValueError('The sample rate must be an even multiple of the channel spacing')
+    FilterLength = TapsPerPhase * NumOfChannels
+    Filter = signal.firwin(FilterLength, ChannelBandwidth / 2, window=('kaiser', 8.0), fs=SampleRate)
+    return {'NumOfChannels': NumOfChannels,
+            'Decimation': NumOfChannels // 2,
+            'ChannelSampleRate': 2 * SampleRate / NumOfChannels,
+            'Filter': Filter.astype(np.float32),
+            'OutputBatchSize': OutputBatchSize,
+            'History': np.zeros(FilterLength - NumOfChannels // 2, dtype=np.complex64),
+            'OutputIndex': 0}
+
+def ChannelizeBlock(ChannelizerState, Samples):
+    '''
+    Channelize the next block of IQ samples. Returns a (K, NumOfChannels) complex64 array of channel samples.
+    Channel k is at the center frequency + k * channel spacing (k < NumOfChannels / 2), or
+    + (k - NumOfChannels) * channel spacing
+    '''
+    State = ChannelizerState
+    M = State['NumOfChannels']
+    D = State['Decimation']
+    Filter = State['Filter']
+    Buffer = np.concatenate((State['History'], np.asarray(Samples, dtype=np.complex64)))
+    NumOfOutputs = max(0, (len(Buffer) - len(Filter)) // D + 1)
+    Outputs = np.zeros((NumOfOutputs, M), dtype=np.complex64)
+
+    # The segments are strided views of the buffer, processed in batches to bound the memory use
+    Segments = np.lib.stride_tricks.sliding_window_view(Buffer, len(Filter))[::D]
+    for Start in range(0, NumOfOutputs, State['OutputBatchSize']):
+        Batch = Segments[Start:Start + State['OutputBatchSize']] * Filter
+        Folded = Batch.reshape(len(Batch), -1, M).sum(axis=1)
+        Outputs[Start:Start + len(Batch)] = np.fft.fft(Folded, axis=1)
+
+    # Rotate the odd channels of the odd outputs
+    OddOutputs = (np.arange(State['OutputIndex'], State['OutputIndex'] + NumOfOutputs) % 2) == 1
+    Outputs[np.ix_(OddOutputs, np.arange(1, M, 2))] *= -1
+    State['OutputIndex'] += NumOfOutputs
+    State['History'] = Buffer[NumOfOutputs * D:]
+    return Outputs
+
+def GetChannelFrequencies(ChannelizerState, CenterFrequency):
+    '''
+    Get the center frequency of each channel in [Hz]
+    '''
+    M = ChannelizerState['NumOfChannels']
+    Spacing = ChannelizerState['ChannelSampleRate'] / 2
+    ChannelNumbers = np.arange(M)
+    return CenterFrequency + np.where(ChannelNumbers < M // 2, ChannelNumbers, ChannelNumbers - M) * Spacing
+
+def DetectActiveChannels(ChannelPower, ThresholdDB = 10.0):
+    '''
+    Detect the active channels in an averaged channel power spectrum: the local maxima that are ThresholdDB above
+    the noise floor (the median channel power). Returns a list of channel numbers
+    '''
+    NoiseFloor = max(np.median(ChannelPower), 1e-30)
+    LocalMaxima = (ChannelPower >= np.roll(ChannelPower, 1)) & (ChannelPower >= np.roll(ChannelPower, -1))
+    return [int(Channel) for Channel in np.flatnonzero(LocalMaxima & (ChannelPower > NoiseFloor * 10**(ThresholdDB / 10)))]
+
+# %% Channel demodulation
+#########################
+# Channel demodulation #
+#########################
+
+def NewChannelDemodulator(ChannelSampleRate, MaxHeaderBitErrors = 4, StartSampleIndex = 0):
+    '''
+    Create the state of a channel demodulator: an FM discriminator followed by a frame demodulator.
+    StartSampleIndex = The channel sample index of the first block (the bit clock starts there, see DemodulateBlock)
+    '''
+    DemodulatorState = NewDemodulatorState(ChannelSampleRate, DataRate, MaxHeaderBitErrors)
+    DemodulatorState['BlockStart'] = StartSampleIndex
+    return {'PrevSample': np.complex64(0),
+            'DemodulatorState': DemodulatorState}
+
+def DemodulateChannelBlock(ChannelDemodulator, ChannelSamples, FinalBlock = False):
+    '''
+    FM demodulate the next block of channel samples and demodulate its frames (see DemodulateBlock)
+    '''
+    Samples = np.concatenate(([ChannelDemodulator['PrevSample']], ChannelSamples))
+    if len(ChannelSamples):
+        ChannelDemodulator['PrevSample'] = ChannelSamples[-1]
+    Audio = np.angle(Samples[1:] * np.conj(Samples[:-1]))
+    return DemodulateBlock(ChannelDemodulator['DemodulatorState'], Audio, FinalBlock)
+
+def ChannelWorker(InputQueue, OutputQueue, ChannelSampleRate, MaxHeaderBitErrors):
+    '''
+    Worker process: demodulate the channel blocks of InputQueue, (channel number, channel sample index of the block,
+    channel samples, final block), until None. Puts (channel number, FrameSampleIndex, MessageBytes, SyncScore, ByteReliability) in OutputQueue
+    for each frame, and None when done. A channel's demodulator is deleted after its final block
+    '''
+    ChannelDemodulators = {}
+    while True:
+        Item = InputQueue.get()
+        if Item is None:
+            break
+        Channel, BlockStart, ChannelSamples, FinalBlock = Item
+        if Channel not in ChannelDemodulators:
+            ChannelDemodulators[Channel] = NewChannelDemodulator(ChannelSampleRate, MaxHeaderBitErrors, BlockStart)
+        for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in DemodulateChannelBlock(ChannelDemodulators[Channel],
+                                                                                                ChannelSamples, FinalBlock):
+            OutputQueue.put((Channel, FrameSampleIndex, bytes(MessageBytes), SyncScore, ByteReliability))
+        if FinalBlock:
+            del ChannelDemodulators[Channel]
+    OutputQueue.put(None)
+
+# %% IQ file decoding
+#####################
+# IQ file decoding #
+#####################
+
+def DecodeIQFile(IQFileName, SampleRate, CenterFrequency, Format = 'cu8', NumOfWorkers = None, BlockLength = 1 << 18,
+                 DetectionSeconds = 1.0, ThresholdDB = 10.0, Channels = None, MaxHeaderBitErrors = 4, MaxQueuedBlocks = 16,
+                 ChannelIdleSeconds = 10.0):
+    '''
+    Decode the RS41 frames of all of the active channels of a wideband IQ recording, in a single streaming pass.
+    Yields (ChannelFrequency [Hz], IQSampleIndex, MessageBytes, SyncScore, ByteReliability) for each frame found,
+    where IQSampleIndex is the frame's approximate sample index in the recording (see DemodulateFrames).
+    The active channels are detected in the channel power averaged over DetectionSeconds, and re-detected every
+    DetectionSeconds. A detected channel that isn't re-detected for ChannelIdleSeconds (None: never) is flushed
+    and retired. Channels = a list of channel frequencies [Hz] to decode, instead of detecting them.
+    NumOfWorkers = The number of worker processes (default: the number of CPUs). 0 = demodulate in this process
+    '''
+    Raw, NumOfSamples = ReadIQFile(IQFileName, Format)
+    Channelizer = NewChannelizerState(SampleRate)
+    ChannelSampleRate = Channelizer['ChannelSampleRate']
+    Decimation = Channelizer['Decimation']
+    Frequencies = GetChannelFrequencies(Channelizer, CenterFrequency)
+    FixedChannels = None
+    if Channels is not None:
+        FixedChannels = [int(np.argmin(np.abs(Frequencies - Frequency))) for Frequency in Channels]
+
+    if NumOfWorkers is None:
+        NumOfWorkers = multiprocessing.cpu_count()
+    Workers = []
+    if NumOfWorkers > 0:
+        OutputQueue = multiprocessing.Queue()
+        for i in range(NumOfWorkers):
+            InputQueue = multiprocessing.Queue(MaxQueuedBlocks)
+            Worker = multiprocessing.Process(target=ChannelWorker, args=(InputQueue, OutputQueue, ChannelSampleRate, MaxHeaderBitErrors),
+                                             daemon=True)
+            Worker.start()
+            Workers.append((Worker, InputQueue))
+    LocalDemodulators = {}
+
+    def FrameResult(Channel, FrameSampleIndex, MessageBytes, SyncScore, ByteReliability):
+        # The channel sample index is in the channel sample rate: Decimation IQ samples per channel sample
+        return (float(Frequencies[Channel]), FrameSampleIndex * Decimation, MessageBytes, SyncScore, ByteReliability)
+
+    def DrainOutputQueue(Block = False):
+        Results = []
+        while True:
+            try:
+                Item = OutputQueue.get(Block)
+            except queue.Empty:
+                return Results, False
+            if Item is None:
+                return Results, True
+            Results.append(FrameResult(*Item))
+
+    def SendChannelBlock(Channel, BlockStart, ChannelSamples, FinalBlock):
+        if NumOfWorkers > 0:
+            Workers[Channel % NumOfWorkers][1].put((Channel, BlockStart, ChannelSamples, FinalBlock))
+            return []
+        if Channel not in LocalDemodulators:
+            LocalDemodulators[Channel] = NewChannelDemodulator(ChannelSampleRate, MaxHeaderBitErrors, BlockStart)
+        Results = [FrameResult(Channel, *Frame[0:1], bytes(Frame[1]), *Frame[2:])
+                   for Frame in DemodulateChannelBlock(LocalDemodulators[Channel], ChannelSamples, FinalBlock)]
+        if FinalBlock:
+            del LocalDemodulators[Channel]
+        return Results
+
+    # Initial detection: the averaged power of the first DetectionSeconds of the recording
+    DetectionLength = int(DetectionSeconds * SampleRate)
+    ActiveChannels = set(FixedChannels) if FixedChannels is not None else set()
+    if FixedChannels is None:
+        DetectionChannelizer = NewChannelizerState(SampleRate)
+        ChannelPower = np.zeros(Channelizer['NumOfChannels'])
+        for Start in range(0, min(DetectionLength, NumOfSamples), BlockLength):
+            Outputs = ChannelizeBlock(DetectionChannelizer, GetIQSamples(Raw, Format, Start, min(Start + BlockLength, DetectionLength, NumOfSamples)))
+            ChannelPower += (np.abs(Outputs)**2).sum(axis=0)
+        ActiveChannels.update(DetectActiveChannels(ChannelPower, ThresholdDB))
+    # The IQ sample index each active channel was last detected at
+    LastDetected = {Channel: 0 for Channel in ActiveChannels}
+
+    # The streaming pass
+    ChannelPower = np.zeros(Channelizer['NumOfChannels'])
+    PowerSamples = 0
+    try:
+        for Start in range(0, NumOfSamples, BlockLength):
+            End = min(Start + BlockLength, NumOfSamples)
+            BlockStart = Channelizer['OutputIndex']
+            Outputs = ChannelizeBlock(Channelizer, GetIQSamples(Raw, Format, Start, End))
+
+            # Re-detect the active channels. A new channel starts demodulating from here, and an idle channel
+            # ends with this block
+            RetiredChannels = set()
+            if FixedChannels is None:
+                ChannelPower += (np.abs(Outputs)**2).sum(axis=0)
+                PowerSamples += End - Start
+                if PowerSamples >= DetectionLength:
+                    for Channel in DetectActiveChannels(ChannelPower, ThresholdDB):
+                        ActiveChannels.add(Channel)
+                        LastDetected[Channel] = End
+                    if ChannelIdleSeconds is not None:
+                        RetiredChannels = {Channel for Channel in ActiveChannels
+                                           if End - LastDetected[Channel] > ChannelIdleSeconds * SampleRate}
+                    ChannelPower[:] = 0
+                    PowerSamples = 0
+
+            for Channel in sorted(ActiveChannels):
+                for Result in SendChannelBlock(Channel, BlockStart, np.ascontiguousarray(Outputs[:, Channel]),
+                                               (End == NumOfSamples) or (Channel in RetiredChannels)):
+                    yield Result
+            for Channel in RetiredChannels:
+                ActiveChannels.discard(Channel)
+                del LastDetected[Channel]
+            if NumOfWorkers > 0:
+                for Result in DrainOutputQueue()[0]:
+                    yield Result
+
+        # Wait for the workers to finish
+        for Worker, InputQueue in Workers:
+            InputQueue.put(None)
+        FinishedWorkers = 0
+        while FinishedWorkers < len(Workers):
+            Results, Finished = DrainOutputQueue(True)
+            FinishedWorkers += Finished
+            for Result in Results:
+                yield Result
+    finally:
+        for Worker, InputQueue in Workers:
+            Worker.join(timeout=1)
+            if Worker.is_alive():
+                Worker.terminate()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 decoded flight cache
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions keep the decoded columns of #
+# flight logs (see DecodeFlight) on disk,   #
+# so an unchanged log is decoded only once. #
+#                                           #
+# The cache is content addressed: an entry  #
+# key is a hash of                          #
+# - The log file contents                   #
+# - The framework version: a hash of the    #
+#   framework source files, so a changed    #
+#   decoder never returns stale results     #
+# - The calibration options                 #
+#                                           #
+# The log file hash is kept by the file's   #
+# (size, modification time, inode), so a    #
+# cache hit of an unchanged log file reads  #
+# only the cache entry.                     #
+#                                           #
+# The cache size is bounded: the least      #
+# recently used entries are evicted.        #
+#############################################
+
+import os
+import json
+import hashlib
+import numpy as np
+from RS41FlightDecoder import *
+
+FrameworkPath = os.path.dirname(os.path.abspath(__file__))
+DecodeCacheEntrySuffix = '.npz'
+DecodeCacheFileHashesName = 'FileHashes.json'
+
+# %% Cache keys
+##############
+# Cache keys #
+##############
+
+FrameworkVersion = None
+
+def GetFrameworkVersion():
+    '''
+    Get the framework version: a hash of the framework source files. Calculated once
+    '''
+    global FrameworkVersion
+    if FrameworkVersion is None:
+        Hash = hashlib.sha256()
+        for FileName in sorted(os.listdir(FrameworkPath)):
+            if FileName.endswith('.py'):
+                Hash.update(FileName.encode('utf-8'))
+                with open(os.path.join(FrameworkPath, FileName), 'rb') as File:
+                    Hash.update(File.read())
+        FrameworkVersion = Hash.hexdigest()
+    return FrameworkVersion
+
+def GetFileHash(FileName, BlockLength = 1 << 20):
+    '''
+    Get the SHA-256 hash of a file's contents
+    '''
+    Hash = hashlib.sha256()
+    with open(FileName, 'rb') as File:
+        for Block in iter(lambda: File.read(BlockLength), b''):
+            Hash.update(Block)
+    return Hash.hexdigest()
+
+def GetDecodeCacheKey(FileHash, CalibrationOptions = None):
+    '''
+    Get the cache key of a decoded flight: a hash of the log file hash, the framework version
+    and the full calibration options
+    '''
+    Options = json.dumps(GetCalibrationOptions(CalibrationOptions), sort_keys=True)
+    return hashlib.sha256('\n'.join([FileHash, GetFrameworkVersion(), Options]).encode('utf-8')).hexdigest()
+
+# %% Cache functions
+###################
+# Cache functions #
+###################
+
+def NewDecodeCache(CacheDirectory = None, MaxCacheBytes = 1 << 30):
+    '''
+    Create (or open) a decoded flight cache. CacheDirectory defaults to the RS41_CACHE_DIR environment variable,
+    or to ~/.cache/rs41. The least recently used entries are evicted to keep the cache under MaxCacheBytes
+    '''
+    if CacheDirectory is None:
+        CacheDirectory = os.environ.get('RS41_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'rs41'))
+    os.makedirs(CacheDirectory, exist_ok=True)
+    Cache = {'CacheDirectory': CacheDirectory,
+             'MaxCacheBytes': MaxCacheBytes,
+             'FileHashes': {},
+             'Hits': 0,
+             'Misses': 0}
+    try:
+        with open(os.path.join(CacheDirectory, DecodeCacheFileHashesName)) as File:
+            Cache['FileHashes'] = json.load(File)
+    except (OSError, ValueError):
+        pass
+    return Cache
+
+def WriteFileAtomically(FileName, WriteFunction):
+    '''
+    Write a file through a temporary file and a rename, so readers never see a partial file
+    '''
+    TempFileName = FileName + '.%d.tmp' % os.getpid()
+    try:
+        with open(TempFileName, 'wb') as File:
+            WriteFunction(File)
+        os.replace(TempFileName, FileName)
+    finally:
+        if os.path.exists(TempFileName):
+            os.remove(TempFileName)
+
+def GetCachedFileHash(Cache, FileName):
+    '''
+    Get the hash of a log file. The hash is recalculated only if the file's size, modification time
+    or inode changed
+    '''
+    FileStatus = os.stat(FileName)
+    Identity = [FileStatus.st_size, FileStatus.st_mtime_ns, FileStatus.st_ino]
+    AbsoluteFileName = os.path.abspath(FileName)
+    Entry = Cache['FileHashes'].get(AbsoluteFileName)
+    if (Entry is not None) and (Entry[0] == Identity):
+        return Entry[1]
+    FileHash = GetFileHash(FileName)
+    Cache['FileHashes'][AbsoluteFileName] = [Identity, FileHash]
+    WriteFileAtomically(os.path.join(Cache['CacheDirectory'], DecodeCacheFileHashesName),
+                        lambda File: File.write(json.dumps(Cache['FileHashes']).encode('utf-8')))
+    return FileHash
+
+def GetDecodeCacheEntryName(Cache, Key):
+    '''
+    Get the file name of a cache entry
+    '''
+    return os.path.join(Cache['CacheDirectory'], Key + DecodeCacheEntrySuffix)
+
+def LoadDecodeCacheEntry(Cache, Key):
+    '''
+    Load the columns of a cache entry. Returns None if the entry is not in the cache (or unreadable)
+    '''
+    EntryName = GetDecodeCacheEntryName(Cache, Key)
+    try:
+        with np.load(EntryName, allow_pickle=False) as Entry:
+            Columns = {Name: Entry[Name] for Name in Entry.files}
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        os.utime(EntryName) # The modification time is the last use time, for the eviction
+    except OSError:
+        pass
+    return Columns
+
+def StoreDecodeCacheEntry(Cache, Key, Columns):
+    '''
+    Store the columns of a decoded flight in the cache, and evict the least recently used entries
+    '''
+    WriteFileAtomically(GetDecodeCacheEntryName(Cache, Key), lambda File: np.savez(File, **Columns))
+    EvictDecodeCache(Cache)
+
+def EvictDecodeCache(Cache):
+    '''
+    Remove the least recently used cache entries, until the cache is under MaxCacheBytes
+    '''
+    Entries = []
+    for FileName in os.listdir(Cache['CacheDirectory']):
+        if FileName.endswith(DecodeCacheEntrySuffix):
+            try:
+                FileStatus = os.stat(os.path.join(Cache['CacheDirectory'], FileName))
+            except OSError:
+                continue
+            Entries.append((FileStatus.st_mtime_ns, FileStatus.st_size, FileName))
+    Entries.sort()
+    CacheBytes = sum(Entry[1] for Entry in Entries)
+    for MTime, Size, FileName in Entries:
+        if CacheBytes <= Cache['MaxCacheBytes']:
+            break
+        try:
+            os.remove(os.path.join(Cache['CacheDirectory'], FileName))
+        except OSError:
+            pass
+        CacheBytes = CacheBytes - Size
+
+def CachedDecodeFlightFile(Cache, LogFileName, CalibrationOptions = None):
+    '''
+    Decode a flight log file into columns (see DecodeFlightFile), through the cache
+    '''
+    Key = GetDecodeCacheKey(GetCachedFileHash(Cache, LogFileName), CalibrationOptions)
+    Columns = LoadDecodeCacheEntry(Cache, Key)
+    if Columns is not None:
+        Cache['Hits'] = Cache['Hits'] + 1
+        return Columns
+    Cache['Misses'] = Cache['Misses'] + 1
+    Columns = DecodeFlightFile(LogFileName, CalibrationOptions)
+    StoreDecodeCacheEntry(Cache, Key, Columns)
+    return Columns
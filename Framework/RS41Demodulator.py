@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 FSK demodulation functions
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions are receive-direction       #
+# functions: they turn baseband audio (the  #
+# output of an FM receiver, or the output   #
+# of BuildAudioStream) back into RS41       #
+# message byte arrays.                      #
+#                                           #
+# The samples are processed block by block  #
+# with NumPy/SciPy filtering:               #
+# 1. Matched filter (bit-long moving sum)   #
+# 2. Symbol clock recovery (Oerder & Meyr   #
+#    squared-signal timing estimation,      #
+#    averaged over a sliding window)        #
+# 3. Header correlation, in both polarities #
+# 4. Bit packing and data de-whitening      #
+# 5. Soft-decision byte reliability scores  #
+#############################################
+
+import numpy as np
+from RS41Functions import *
+
+DataRate = 4800 # [BAUD]
+
+# %% Frame header bits
+#####################
+# Frame header bits #
+#####################
+
+def GetTransmittedHeaderBits():
+    '''
+    Get the RS41 frame header bits, as transmitted (whitened, in transmission order)
+    '''
+    # The header bytes are xor-ed with the whitening mask, and sent LSB first. DataWhitening isn't used,
+    # so that importing this module doesn't compile its JIT kernel (see RS41Backend)
+    HeaderBytes = bytearray(8)
+    SetFrameHeader(HeaderBytes)
+    WhitenedHeaderBytes = np.bitwise_xor(np.frombuffer(bytes(HeaderBytes), dtype=np.uint8), XorArray[0:8])
+    return np.unpackbits(WhitenedHeaderBytes, bitorder='little')
+
+# The transmitted header bits as a +1/-1 correlation pattern
+HeaderBits = GetTransmittedHeaderBits()
+HeaderPattern = 2.0 * HeaderBits - 1.0
+HeaderLength = len(HeaderBits) # 64 bits
+
+# %% Input functions
+###################
+# Input functions #
+###################
+
+def ReadWaveFile(WaveFileName):
+    '''
+    Read a WAV file. The file is memory mapped, and only the first channel is used
+    '''
+    from scipy.io import wavfile
+    SampleRate, Samples = wavfile.read(WaveFileName, mmap=True)
+    if Samples.ndim > 1:
+        Samples = Samples[:, 0]
+    return SampleRate, Samples
+
+# %% Demodulation functions
+##########################
+# Demodulation functions #
+##########################
+
+def ExtractFramesFromBits(SoftBits, BitTimes, MaxHeaderBitErrors, FinalBlock):
+    '''
+    Search the RS41 frame header in a soft bits array and extract the complete frames following it.
+    Returns a list of (FrameSampleIndex, MessageBytes, SyncScore, ByteReliability) and the number of consumed bits
+    '''
+    Frames = []
+    NumOfBits = len(SoftBits)
+    if NumOfBits < HeaderLength:
+        return Frames, 0
+
+    # Correlate the hard bits with the header pattern. A negative correlation is an inverted signal
+    HardBits = np.where(SoftBits > 0, 1.0, -1.0)
+    Correlation = np.correlate(HardBits, HeaderPattern, mode='valid')
+    SyncThreshold = HeaderLength - 2 * MaxHeaderBitErrors
+    Candidates = np.flatnonzero(np.abs(Correlation) >= SyncThreshold)
+
+    ConsumedBits = max(0, NumOfBits - HeaderLength + 1)
+    Position = 0
+    for Candidate in Candidates:
+        if Candidate < Position:
+            continue # Inside the previous frame
+
+        # Wait for the frame type byte, and then for the complete frame
+        FrameLength = RegularFrameLength
+        if Candidate + (0x039 * 8) <= NumOfBits:
+            Polarity = 1.0 if Correlation[Candidate] > 0 else -1.0
+            FrameTypeBits = (SoftBits[Candidate:Candidate + (0x039 * 8)] * Polarity) > 0
+            if DataDewhitening(0x039, np.packbits(FrameTypeBits))[0x038] == 0xF0:
+                FrameLength = ExtendedFrameLength
+        if Candidate + (FrameLength * 8) > NumOfBits:
+            if not(FinalBlock):
+                ConsumedBits = Candidate
+            break
+
+        # Pack the frame bits to bytes and reverse the data whitening
+        FrameSoftBits = SoftBits[Candidate:Candidate + (FrameLength * 8)] * Polarity
+        MessageBytes = DataDewhitening(FrameLength, np.packbits(FrameSoftBits > 0))
+
+        # The reliability of a byte is the magnitude of its weakest bit, relative to the frame's median bit magnitude
+        BitMagnitudes = np.abs(FrameSoftBits)
+        ByteReliability = np.minimum(BitMagnitudes.reshape(FrameLength, 8).min(axis=1) / max(np.median(BitMagnitudes), 1e-30), 1.0)
+
+        Frames.append((int(BitTimes[Candidate]), MessageBytes, float(abs(Correlation[Candidate]) / HeaderLength),
+                       ByteReliability.astype(np.float32)))
+        Position = Candidate + (FrameLength * 8)
+        ConsumedBits = max(Position, ConsumedBits)
+    return Frames, ConsumedBits
+
+def NewDemodulatorState(SampleRate, DataRate = DataRate, MaxHeaderBitErrors = 4, TimingWindowBits = 32,
+                        DCWindowBits = 1024):
+    '''
+    Create the state of a block by block demodulation (see DemodulateBlock)
+    '''
+    # Matched filter: a bit-long moving average
+    SamplesPerBit = SampleRate / DataRate
+    FilterLength = max(1, int(round(SamplesPerBit)))
+
+    # Symbol timing: the squared matched filter output has a spectral line at the data rate.
+    # Its phase, averaged over the last TimingWindowBits bits, is the local bit clock phase.
+    # DC (e.g. a frequency offset): the samples average over the last DCWindowBits bits, across blocks
+    return {'SamplesPerBit': SamplesPerBit,
+            'MaxHeaderBitErrors': MaxHeaderBitErrors,
+            'FilterTaps': np.ones(FilterLength) / FilterLength,
+            'FilterState': np.zeros(FilterLength - 1),
+            'TimingSmoothing': 1.0 / (TimingWindowBits * SamplesPerBit),
+            'TimingState': np.zeros(1, dtype=np.complex128),
+            'PrevTimingPhase': 0.0,                   # Last unwrapped timing phase of the previous block [rad]
+            'DCSmoothing': 1.0 / (DCWindowBits * SamplesPerBit),
+            'DCState': np.zeros(1),
+            'PrevBitClock': -1.0 / SamplesPerBit,     # Bit clock at the last sample of the previous block [bits]
+            'PrevFiltered': 0.0,                      # Last filtered sample of the previous block
+            'BlockStart': 0,                          # Sample index of the next block
+            'FirstBlock': True,
+            'PadLength': FilterLength + int(np.ceil(SamplesPerBit)), # Zero samples before the first and after the final block
+            'SoftBits': np.zeros(0),
+            'BitTimes': np.zeros(0)}
+
+def DemodulateBlock(DemodulatorState, Block, FinalBlock = False):
+    '''
+    Demodulate the next block of baseband audio samples. Returns a list of (FrameSampleIndex, MessageBytes,
+    SyncScore, ByteReliability) for the frames completed by the block (see DemodulateFrames)
+    '''
+    import scipy.signal as signal
+    State = DemodulatorState
+    SamplesPerBit = State['SamplesPerBit']
+    BlockStart = State['BlockStart']
+    State['BlockStart'] = BlockStart + len(Block)
+    if (len(Block) == 0) and not(FinalBlock):
+        Frames, ConsumedBits = ExtractFramesFromBits(State['SoftBits'], State['BitTimes'], State['MaxHeaderBitErrors'], FinalBlock)
+        return Frames
+
+    # Remove the running DC estimate. It starts at the average of the first DC window, instead of zero
+    Block = np.asarray(Block, dtype=np.float64)
+    FirstBlock = State['FirstBlock']
+    State['FirstBlock'] = False
+    DCSmoothing = State['DCSmoothing']
+    if FirstBlock and (len(Block) > 0):
+        WindowLength = max(1, int(round(1.0 / DCSmoothing)))
+        State['DCState'] = (1.0 - DCSmoothing) * Block[0:WindowLength].mean(keepdims=True)
+    DC, State['DCState'] = signal.lfilter([DCSmoothing], [1.0, DCSmoothing - 1.0], Block, zi=State['DCState'])
+    Block = Block - DC
+
+    # A stream can start and end in the middle of a frame: zero samples are added before the first block and after the
+    # final block, so the first and the last bits get a complete matched filter output and a bit clock crossing
+    if FirstBlock:
+        Block = np.concatenate((np.zeros(State['PadLength']), Block))
+        BlockStart = BlockStart - State['PadLength']
+        State['PrevBitClock'] = (BlockStart - 1) / SamplesPerBit
+    if FinalBlock:
+        Block = np.concatenate((Block, np.zeros(State['PadLength'])))
+    BlockEnd = BlockStart + len(Block)
+    Filtered, State['FilterState'] = signal.lfilter(State['FilterTaps'], 1.0, Block, zi=State['FilterState'])
+
+    # Estimate the local bit clock phase (Oerder & Meyr)
+    SampleIndexes = np.arange(BlockStart - 1, BlockEnd)
+    TimingVector = (Filtered * Filtered) * np.exp(-2j * np.pi * SampleIndexes[1:] / SamplesPerBit)
+    TimingSmoothing = State['TimingSmoothing']
+    if FirstBlock:
+        # No lead-in: the timing average starts at the average of the first timing window, instead of zero
+        WindowLength = max(1, int(round(1.0 / TimingSmoothing)))
+        State['TimingState'] = (1.0 - TimingSmoothing) * TimingVector[0:WindowLength].mean(keepdims=True)
+        State['PrevTimingPhase'] = np.angle(State['TimingState'][0]) if len(TimingVector) > 0 else 0.0
+    TimingVector, State['TimingState'] = signal.lfilter([TimingSmoothing], [1.0, TimingSmoothing - 1.0], TimingVector,
+                                                        zi=State['TimingState'])
+    TimingPhase = np.unwrap(np.concatenate(([State['PrevTimingPhase']], np.angle(TimingVector))))
+    State['PrevTimingPhase'] = TimingPhase[-1]
+
+    # The bit clock counts bits. The bits are sampled where it crosses an integer value
+    BitClock = SampleIndexes / SamplesPerBit + TimingPhase / (2 * np.pi)
+    BitClock[0] = State['PrevBitClock']
+    BitClock = np.maximum.accumulate(BitClock)
+    State['PrevBitClock'] = BitClock[-1]
+    BitNumbers = np.arange(np.floor(BitClock[0]) + 1, np.floor(BitClock[-1]) + 1)
+
+    # Sample the matched filter output at the bit times
+    BlockBitTimes = np.interp(BitNumbers, BitClock, SampleIndexes)
+    BlockSoftBits = np.interp(BlockBitTimes, SampleIndexes, np.concatenate(([State['PrevFiltered']], Filtered)))
+    State['PrevFiltered'] = Filtered[-1]
+    SoftBits = np.concatenate((State['SoftBits'], BlockSoftBits))
+    BitTimes = np.concatenate((State['BitTimes'], BlockBitTimes))
+
+    # Extract the complete frames and drop the consumed bits
+    Frames, ConsumedBits = ExtractFramesFromBits(SoftBits, BitTimes, State['MaxHeaderBitErrors'], FinalBlock)
+    State['SoftBits'] = SoftBits[ConsumedBits:]
+    State['BitTimes'] = BitTimes[ConsumedBits:]
+    return Frames
+
+def DemodulateFrames(Samples, SampleRate, DataRate = DataRate, MaxHeaderBitErrors = 4, BlockLength = 65536,
+                     TimingWindowBits = 32):
+    '''
+    Demodulate RS41 frames from baseband audio samples (a NumPy array, or a memory mapped WAV file).
+    Yields (FrameSampleIndex, MessageBytes, SyncScore, ByteReliability) for each frame found:
+    FrameSampleIndex = The sample index of the first header bit
+    MessageBytes     = The de-whitened frame bytes (320 or 518 bytes)
+    SyncScore        = The fraction of header bits that matched (1.0 = perfect match)
+    ByteReliability  = A soft-decision reliability score per byte, in [0:1]. 1.0 = reliable.
+                       Pass it to DecodeReedSolomon to decode the least reliable bytes as erasures
+    '''
+    DemodulatorState = NewDemodulatorState(SampleRate, DataRate, MaxHeaderBitErrors, TimingWindowBits)
+    NumOfSamples = len(Samples)
+    for BlockStart in range(0, NumOfSamples, BlockLength):
+        BlockEnd = min(BlockStart + BlockLength, NumOfSamples)
+        for Frame in DemodulateBlock(DemodulatorState, Samples[BlockStart:BlockEnd], BlockEnd == NumOfSamples):
+            yield Frame
+
+def DemodulateWaveFile(WaveFileName, DataRate = DataRate, MaxHeaderBitErrors = 4, BlockLength = 65536,
+                       TimingWindowBits = 32):
+    '''
+    Demodulate RS41 frames from a WAV file. Yields (FrameSampleIndex, MessageBytes, SyncScore, ByteReliability)
+    for each frame found
+    '''
+    SampleRate, Samples = ReadWaveFile(WaveFileName)
+    for Frame in DemodulateFrames(Samples, SampleRate, DataRate, MaxHeaderBitErrors, BlockLength,
+                                  TimingWindowBits):
+        yield Frame
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 multi-station diversity combining
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions merge the logs of several   #
+# receive sites, which received the same    #
+# radiosonde, into one best-copy stream.    #
+#                                           #
+# 1. Each station log is indexed by         #
+#    (radiosonde ID, frame number), with a  #
+#    single pass over the log               #
+# 2. The indexes are hash-joined on the     #
+#    same key                               #
+# 3. Per frame, the first copy that passes  #
+#    DecodeReedSolomon is used. If no copy  #
+#    passes, the copies are combined:       #
+#    - Byte-wise majority voting            #
+#    - Erasure combining: the bytes the     #
+#      copies disagree on are decoded as    #
+#      Reed-Solomon erasures                #
+#    A combined frame is accepted only if   #
+#    all of its block CRCs check, as the    #
+#    Reed-Solomon decoder can miscorrect    #
+#    copies with many errors                #
+#############################################
+
+import numpy as np
+from RS41SimFunctions import *
+
+# Combining results, per frame
+DiversityDecoded = 'Decoded'   # A station's copy passed DecodeReedSolomon and the block CRCs on its own
+DiversityVoted = 'Voted'       # The byte-wise majority vote of the copies passed DecodeReedSolomon and the block CRCs
+DiversityErasures = 'Erasures' # The majority vote passed DecodeReedSolomon, with the disagreeing bytes as erasures,
+                               # and the block CRCs
+DiversityFailed = 'Failed'     # No combination was decoded. The majority vote is given, uncorrected
+
+# %% Station log indexing
+#########################
+# Station log indexing #
+#########################
+
+def GetDiversityKey(MessageBytes):
+    '''
+    Get the join key of a RS41 message byte array: (radiosonde ID bytes, frame number)
+    '''
+    # The raw ID bytes are used, as the ID of an uncorrected frame may not be valid UTF-8
+    return (bytes(MessageBytes[0x03D:0x045]), GetFrameNumber(MessageBytes))
+
+def TryDecodeReedSolomon(MessageBytes, ByteReliability = None, MaxErasures = 12):
+    '''
+    Decode a RS41 message byte array with DecodeReedSolomon. Returns False instead of raising, for uncorrectable messages
+    '''
+    try:
+        return bool(DecodeReedSolomon(MessageBytes, ByteReliability, MaxErasures = MaxErasures))
+    except Exception:
+        return False
+
+def CheckMessageBlocksCRC(MessageBytes):
+    '''
+    Check the blocks of RS41 message byte array: True if the blocks walk (see WalkMessageBlocks) reaches the end of
+    the frame and all of the block CRCs check
+    '''
+    FrameLength = GetFrameLength(MessageBytes)
+    Blocks = WalkMessageBlocks(MessageBytes, FrameLength)
+    if not(Blocks):
+        return False
+    BlockID, BlockOffset, BlockLength, CRCOK = Blocks[-1]
+    return (BlockOffset + BlockLength + 4 == FrameLength) and all(CRCOK for BlockID, BlockOffset, BlockLength, CRCOK in Blocks)
+
+def IndexStationLog(LoggedMessagesLength, LoggedMessages, FrameLength = 0x140):
+    '''
+    Index a station log (see ReadLogFile). The records are Reed-Solomon corrected (when possible, with
+    DecodeReedSolomonBatch) and keyed by GetDiversityKey. Returns a dictionary: key -> (MessageBytes, Decoded).
+    For repeated keys, the first decoded copy is kept
+    '''
+    # Decode the records. The key of a record is reliable if the record was decoded or its STATUS block CRC is OK
+    MessageArray = np.zeros((LoggedMessagesLength, FrameLength), dtype=np.uint8)
+    MessageBytes = bytearray(1024)
+    for i in range(LoggedMessagesLength):
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        MessageArray[i] = np.frombuffer(MessageBytes, dtype=np.uint8, count=FrameLength)
+    DecodedArray = DecodeReedSolomonBatch(MessageArray)
+    Records = []
+    for i in range(LoggedMessagesLength):
+        MessageBytes = bytearray(MessageArray[i].tobytes())
+        Decoded = bool(DecodedArray[i])
+        KeyOK = Decoded or CheckSTATUSblockCRC(MessageBytes)
+        Records.append((MessageBytes, Decoded, KeyOK, GetDiversityKey(MessageBytes)))
+
+    # A key that follows (or is followed by) the next record's key is reliable too: two corrupted keys are unlikely to agree
+    for i in range(len(Records) - 1):
+        (Bytes1, Decoded1, KeyOK1, (ID1, FrameNumber1)), (Bytes2, Decoded2, KeyOK2, (ID2, FrameNumber2)) = Records[i], Records[i+1]
+        if (ID1 == ID2) and (FrameNumber2 == ((FrameNumber1 + 1) & 0xFFFF)):
+            Records[i] = (Bytes1, Decoded1, True, (ID1, FrameNumber1))
+            Records[i+1] = (Bytes2, Decoded2, True, (ID2, FrameNumber2))
+
+    # The key of a record with a corrupted STATUS block is inferred from the nearest reliable keys before and
+    # after it: by the records count, if the frame numbers between them advance with the records (no lost frames)
+    PreviousKeys = [None] * len(Records)
+    Previous = None
+    for i, (MessageBytes, Decoded, KeyOK, Key) in enumerate(Records):
+        if KeyOK:
+            Previous = (i, Key)
+        PreviousKeys[i] = Previous
+    Next = None
+    StationIndex = {}
+    for i in range(len(Records) - 1, -1, -1):
+        MessageBytes, Decoded, KeyOK, Key = Records[i]
+        if KeyOK:
+            Next = (i, Key)
+        else:
+            Key = InferDiversityKey(i, PreviousKeys[i], Next, Key)
+            if Key is None:
+                continue
+        if (Key not in StationIndex) or (Decoded and not(StationIndex[Key][1])):
+            StationIndex[Key] = (MessageBytes, Decoded)
+    return StationIndex
+
+def InferDiversityKey(RecordIndex, Previous, Next, RawKey):
+    '''
+    Infer the key of a log record from the nearest reliable (record index, key) before and after it (or None),
+    and from the record's own (unreliable) key. Returns None if no key fits
+    '''
+    Keys = []
+    for Neighbour in (Previous, Next):
+        if Neighbour is not None:
+            NeighbourIndex, (RadiosondeIDBytes, FrameNumber) = Neighbour
+            Keys.append((RadiosondeIDBytes, (FrameNumber + RecordIndex - NeighbourIndex) & 0xFFFF))
+    if len(Keys) == 0:
+        return None
+    if Keys[-1] == Keys[0]:
+        return Keys[0]
+
+    # Frames were lost between the neighbours: the record's own key is used, if it is between them
+    RadiosondeIDBytes, FrameNumber = RawKey
+    if (RadiosondeIDBytes == Previous[1][0]) and (RadiosondeIDBytes == Next[1][0]) \
+       and (0 < ((FrameNumber - Previous[1][1]) & 0xFFFF) < ((Next[1][1] - Previous[1][1]) & 0xFFFF)):
+        return RawKey
+    return None
+
+def JoinStationIndexes(StationIndexes):
+    '''
+    Hash-join station indexes (a dictionary: station name -> IndexStationLog result) on their keys.
+    Returns a dictionary: key -> list of (station name, MessageBytes, Decoded)
+    '''
+    Joined = {}
+    for StationName, StationIndex in StationIndexes.items():
+        for Key, (MessageBytes, Decoded) in StationIndex.items():
+            Joined.setdefault(Key, []).append((StationName, MessageBytes, Decoded))
+    return Joined
+
+# %% Combining functions
+########################
+# Combining functions #
+########################
+
+def MajorityVote(Copies):
+    '''
+    Byte-wise majority vote of RS41 message byte arrays of the same frame. Returns the voted message bytes and
+    a reliability per byte: the fraction of the other copies that agree with the voted byte (1.0 = all agree)
+    '''
+    CopyArray = np.array([np.frombuffer(bytes(MessageBytes), dtype=np.uint8) for MessageBytes in Copies])
+    NumOfCopies = len(CopyArray)
+    if NumOfCopies == 1:
+        return bytearray(CopyArray[0].tobytes()), np.ones(CopyArray.shape[1], dtype=np.float32)
+
+    # Agreement[i, b] = the number of copies with copy i's value at byte b (including copy i).
+    # Ties go to the first station's copy
+    Agreement = (CopyArray[:, None, :] == CopyArray[None, :, :]).sum(axis=1)
+    Best = np.argmax(Agreement, axis=0)
+    ByteIndexes = np.arange(CopyArray.shape[1])
+    Voted = CopyArray[Best, ByteIndexes]
+    ByteReliability = (Agreement[Best, ByteIndexes] - 1) / (NumOfCopies - 1)
+    return bytearray(Voted.tobytes()), ByteReliability.astype(np.float32)
+
+def CombineFrameCopies(Copies, MaxErasures = 12):
+    '''
+    Combine the copies of a frame: a list of (station name, MessageBytes, Decoded), as in JoinStationIndexes.
+    Returns (MessageBytes, result, station name), where result is one of DiversityDecoded, DiversityVoted,
+    DiversityErasures or DiversityFailed, and station name is the station of the decoded copy (or None).
+    A decoded or combined copy is only accepted if its block CRCs check (see CheckMessageBlocksCRC)
+    '''
+    for StationName, MessageBytes, Decoded in Copies:
+        if Decoded and CheckMessageBlocksCRC(MessageBytes):
+            return MessageBytes, DiversityDecoded, StationName
+
+    Voted, ByteReliability = MajorityVote([MessageBytes for StationName, MessageBytes, Decoded in Copies])
+    if len(Copies) > 1:
+        VotedCopy = bytearray(Voted)
+        if TryDecodeReedSolomon(VotedCopy) and CheckMessageBlocksCRC(VotedCopy):
+            return VotedCopy, DiversityVoted, None
+
+        # The bytes that not all copies agree on are decoded as erasures
+        if (ByteReliability < 1.0).any():
+            VotedCopy = bytearray(Voted)
+            if TryDecodeReedSolomon(VotedCopy, np.where(ByteReliability < 1.0, 0.0, 1.0), MaxErasures) \
+               and CheckMessageBlocksCRC(VotedCopy):
+                return VotedCopy, DiversityErasures, None
+    return Voted, DiversityFailed, None
+
+def CombineStationLogs(StationLogs, FrameLength = 0x140, MaxErasures = 12):
+    '''
+    Merge station logs into one best-copy stream. StationLogs is a dictionary: station name -> (LoggedMessagesLength,
+    LoggedMessages), as returned by ReadLogFile. Returns a list of (RadiosondeID, FrameNumber, MessageBytes, result,
+    station name, number of copies), sorted by radiosonde ID and frame number. See CombineFrameCopies
+    '''
+    StationIndexes = {StationName: IndexStationLog(LoggedMessagesLength, LoggedMessages, FrameLength)
+                      for StationName, (LoggedMessagesLength, LoggedMessages) in StationLogs.items()}
+    Joined = JoinStationIndexes(StationIndexes)
+
+    Stream = []
+    for Key in sorted(Joined):
+        RadiosondeIDBytes, FrameNumber = Key
+        MessageBytes, Result, StationName = CombineFrameCopies(Joined[Key], MaxErasures)
+        Stream.append((RadiosondeIDBytes.decode('utf-8', errors='replace'), FrameNumber, MessageBytes, Result,
+                       StationName, len(Joined[Key])))
+    return Stream
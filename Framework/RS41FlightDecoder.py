@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 flight decoding to columns
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions decode a whole flight log   #
+# into a columnar result: a dictionary of   #
+# NumPy arrays, one entry per log record:   #
+# 1. Reed-Solomon correction of all of the  #
+#    records (DecodeReedSolomonBatch)       #
+# 2. Calibration reassembly: the subframes  #
+#    array of the whole flight, or (with    #
+#    the Incremental option) as a live      #
+#    receiver would have it at each frame   #
+# 3. STATUS, GPS and PTU (temperature,      #
+#    humidity, pressure) conversion         #
+#                                           #
+# Values that are not available (a bad      #
+# block CRC, missing calibration) are NaN.  #
+#############################################
+
+import numpy as np
+from RS41SimFunctions import *
+from RS41CalibrationReassembly import *
+
+# The columns of a decoded flight: column name -> dtype
+FlightColumns = {
+    'FrameNumber':          np.int32,
+    'Decoded':              np.bool_,   # Reed-Solomon correction succeeded
+    'STATUSOK':             np.bool_,   # Block CRCs
+    'MEASOK':               np.bool_,
+    'GPSPOSOK':             np.bool_,
+    'RadiosondeID':         'U8',
+    'Subframe':             np.int16,
+    'BatteryVoltage':       np.float32, # [V]
+    'TxPower':              np.int16,
+    'FlightMode':           np.bool_,   # STATUS flags (see ReadSTATUSblock). True = Flight mode, False = Start phase
+    'AscentDescent':        np.bool_,   # True = Descent
+    'BatteryVoltageOK':     np.bool_,   # The battery flag bit: True = Battery voltage is low
+    'CryptographyMode':     np.int8,
+    'GPSWeek':              np.int32,
+    'GPSMilliseconds':      np.int64,
+    'ECEFPositionX':        np.float64, # [m]
+    'ECEFPositionY':        np.float64,
+    'ECEFPositionZ':        np.float64,
+    'ECEFVelocityX':        np.float64, # [m/sec]
+    'ECEFVelocityY':        np.float64,
+    'ECEFVelocityZ':        np.float64,
+    'NumberOfSVs':          np.int16,
+    'GPSPDOP':              np.float32,
+    'Latitude':             np.float64, # [deg]
+    'Longitude':            np.float64, # [deg]
+    'Altitude':             np.float64, # [m]
+    'Temperature':          np.float64, # [Degrees Celsius]
+    'HeaterTemperature':    np.float64, # [Degrees Celsius]
+    'Pressure':             np.float64, # [hPa]
+    'RelativeHumidity':     np.float64, # [%]
+}
+
+# The default calibration options of DecodeFlight
+DefaultCalibrationOptions = {
+    'TotalSubframes': 51,
+    'RS41Model': None,      # None = the model in the subframes array
+    'Incremental': False,   # True = the measurements are available only after their calibration groups were received
+}
+
+# %% Flight decoding
+###################
+# Flight decoding #
+###################
+
+def NewFlightColumns(NumOfFrames):
+    '''
+    Create the columns of a decoded flight of NumOfFrames frames. Float columns are set to NaN
+    '''
+    Columns = {}
+    for Name, DType in FlightColumns.items():
+        Columns[Name] = np.zeros(NumOfFrames, dtype=DType)
+        if Columns[Name].dtype.kind == 'f':
+            Columns[Name][:] = np.nan
+    return Columns
+
+def GetCalibrationOptions(CalibrationOptions = None):
+    '''
+    Get the full calibration options: DefaultCalibrationOptions, updated by CalibrationOptions
+    '''
+    Options = dict(DefaultCalibrationOptions)
+    if CalibrationOptions is not None:
+        Options.update(CalibrationOptions)
+    return Options
+
+def DecodeFlight(LoggedMessagesLength, LoggedMessages, CalibrationOptions = None):
+    '''
+    Decode a flight log (see ReadLogFile) into columns: a dictionary of NumPy arrays, one entry per log record
+    (see FlightColumns). CalibrationOptions updates DefaultCalibrationOptions
+    '''
+    Options = GetCalibrationOptions(CalibrationOptions)
+    Columns = NewFlightColumns(LoggedMessagesLength)
+
+    # Reed-Solomon correction of all of the records
+    MessageArray = np.zeros((LoggedMessagesLength, 0x140), dtype=np.uint8)
+    MessageBytes = bytearray(1024)
+    for i in range(LoggedMessagesLength):
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        MessageArray[i] = np.frombuffer(MessageBytes, dtype=np.uint8, count=0x140)
+    Columns['Decoded'][:] = DecodeReedSolomonBatch(MessageArray)
+    Messages = [bytearray(MessageArray[i].tobytes()) for i in range(LoggedMessagesLength)]
+
+    # The subframes array of the whole flight
+    Reassembler = NewCalibrationReassembler(Options['TotalSubframes'])
+    if not(Options['Incremental']):
+        for MessageBytes in Messages:
+            AddFrameToCalibrationReassembler(Reassembler, MessageBytes)
+
+    for i, MessageBytes in enumerate(Messages):
+        STATUSOK = CheckSTATUSblockCRC(MessageBytes)
+        MEASOK = CheckMEASblockCRC(MessageBytes)
+        GPSPOSOK = CheckGPSPOSblockCRC(MessageBytes)
+        Columns['STATUSOK'][i], Columns['MEASOK'][i], Columns['GPSPOSOK'][i] = STATUSOK, MEASOK, GPSPOSOK
+        if STATUSOK:
+            Columns['FrameNumber'][i] = GetFrameNumber(MessageBytes)
+            Columns['RadiosondeID'][i] = GetRadiosondeID(MessageBytes)
+            Columns['Subframe'][i] = GetSubframe(MessageBytes)
+            Columns['BatteryVoltage'][i] = GetBatteryVoltage(MessageBytes)
+            Columns['TxPower'][i] = GetTxPower(MessageBytes)
+            Columns['FlightMode'][i], Columns['AscentDescent'][i] = GetFlightModeAscentDescent(MessageBytes)
+            Columns['BatteryVoltageOK'][i] = GetBatteryVoltageOK(MessageBytes)
+            Columns['CryptographyMode'][i] = GetCryptographyMode(MessageBytes)
+        if CheckGPSINFOblockCRC(MessageBytes):
+            Columns['GPSWeek'][i] = GetGPSWeek(MessageBytes)
+            Columns['GPSMilliseconds'][i] = GetGPSMilliseconds(MessageBytes)
+        if GPSPOSOK:
+            Columns['ECEFPositionX'][i] = GetECEFPositionX(MessageBytes)
+            Columns['ECEFPositionY'][i] = GetECEFPositionY(MessageBytes)
+            Columns['ECEFPositionZ'][i] = GetECEFPositionZ(MessageBytes)
+            Columns['ECEFVelocityX'][i] = GetECEFVelocityX(MessageBytes)
+            Columns['ECEFVelocityY'][i] = GetECEFVelocityY(MessageBytes)
+            Columns['ECEFVelocityZ'][i] = GetECEFVelocityZ(MessageBytes)
+            Columns['NumberOfSVs'][i] = GetNumberOfSVs(MessageBytes)
+            Columns['GPSPDOP'][i] = GetGPSPDOP(MessageBytes)
+
+    # The geodetic position, for all of the frames at once
+    Valid = Columns['GPSPOSOK']
+    if Valid.any():
+        import pymap3d
+        Columns['Latitude'][Valid], Columns['Longitude'][Valid], Columns['Altitude'][Valid] = pymap3d.ecef2geodetic(
+            Columns['ECEFPositionX'][Valid], Columns['ECEFPositionY'][Valid], Columns['ECEFPositionZ'][Valid])
+
+    # PTU conversion, with the calibration available at each frame
+    for i, MessageBytes in enumerate(Messages):
+        if Options['Incremental'] and Columns['STATUSOK'][i]:
+            AddFrameToCalibrationReassembler(Reassembler, MessageBytes)
+        if not(Columns['MEASOK'][i]):
+            continue
+        Measurements = GetFlightMeasurements(Reassembler, MessageBytes, Options['RS41Model'],
+                                             None if np.isnan(Columns['Altitude'][i]) else Columns['Altitude'][i])
+        for Name, Value in Measurements.items():
+            Columns[Name][i] = Value
+    return Columns
+
+def GetFlightMeasurements(Reassembler, MessageBytes, RS41Model, GPSAltitude):
+    '''
+    Calculate the PTU measurements of a frame (see GetAvailableMeasurements). If RS41Model is not None,
+    it is used instead of the model in the subframes array
+    '''
+    if RS41Model is None:
+        return GetAvailableMeasurements(Reassembler, MessageBytes, GPSAltitude)
+
+    # The model is overridden: the relative humidity is calculated here
+    Measurements = GetAvailableMeasurements(Reassembler, MessageBytes, None)
+    Measurements.pop('RelativeHumidity', None)
+    SubFrameArray = Reassembler['SubFrameArray']
+    if ('RelativeHumidity' in Reassembler['CompleteGroups']) and ('Temperature' in Measurements) \
+       and ('HeaterTemperature' in Measurements):
+        if (RS41Model == "RS41-SGP") and ('Pressure' in Measurements):
+            Measurements['RelativeHumidity'] = GetRelativeHumidity(RS41Model, Measurements['Pressure'], 0,
+                                                                   Measurements['Temperature'], Measurements['HeaterTemperature'],
+                                                                   SubFrameArray, MessageBytes)
+        elif (RS41Model != "RS41-SGP") and (GPSAltitude is not None):
+            Measurements['RelativeHumidity'] = GetRelativeHumidity(RS41Model, 0, GPSAltitude,
+                                                                   Measurements['Temperature'], Measurements['HeaterTemperature'],
+                                                                   SubFrameArray, MessageBytes)
+    return Measurements
+
+def DecodeFlightFile(LogFileName, CalibrationOptions = None):
+    '''
+    Read a flight log file and decode it into columns (see DecodeFlight)
+    '''
+    LoggedMessagesLength, LoggedMessages = ReadLogFile(LogFileName)
+    return DecodeFlight(LoggedMessagesLength, LoggedMessages, CalibrationOptions)
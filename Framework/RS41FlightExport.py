@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 decoded flight export to NDJSON and CSV
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions export the columns of a     #
+# decoded flight (see DecodeFlight and      #
+# IngestLogs) as NDJSON (a JSON record per  #
+# line) or CSV.                             #
+#                                           #
+# The export is done column by column: each #
+# column is formatted to strings in one     #
+# string formatting operation, and the rows #
+# are assembled from the formatted columns  #
+# in one more operation. No value is read   #
+# or formatted frame by frame.              #
+#                                           #
+# A value that is not available (a bad      #
+# block CRC, NaN) is exported as an empty   #
+# CSV field, or as a JSON null.             #
+#                                           #
+# Command line:                             #
+# python RS41FlightExport.py INPUT          #
+#        [--format ndjson|csv]              #
+#        [--output FILE]                    #
+# INPUT is a log file, or a .npz file of    #
+# columns (see RS41ArchiveIngest --output)  #
+#############################################
+
+import sys
+import json
+import argparse
+import numpy as np
+from RS41FlightDecoder import *
+
+# The exported fields: field name -> (format, the boolean column of the field's valid rows).
+# Format None: by the column type (string, boolean or the GPS time)
+ExportFields = {
+    'FrameNumber':          ('%d',   'STATUSOK'),
+    'RadiosondeID':         (None,   'STATUSOK'),
+    'Time':                 (None,   None),          # UTC, from GPSWeek and GPSMilliseconds
+    'Latitude':             ('%.6f', 'GPSPOSOK'),
+    'Longitude':            ('%.6f', 'GPSPOSOK'),
+    'Altitude':             ('%.1f', 'GPSPOSOK'),
+    'ECEFVelocityX':        ('%.2f', 'GPSPOSOK'),
+    'ECEFVelocityY':        ('%.2f', 'GPSPOSOK'),
+    'ECEFVelocityZ':        ('%.2f', 'GPSPOSOK'),
+    'NumberOfSVs':          ('%d',   'GPSPOSOK'),
+    'GPSPDOP':              ('%.1f', 'GPSPOSOK'),
+    'Temperature':          ('%.2f', 'MEASOK'),
+    'HeaterTemperature':    ('%.2f', 'MEASOK'),
+    'Pressure':             ('%.2f', 'MEASOK'),
+    'RelativeHumidity':     ('%.1f', 'MEASOK'),
+    'BatteryVoltage':       ('%.1f', 'STATUSOK'),
+    'TxPower':              ('%d',   'STATUSOK'),
+    'FlightMode':           (None,   'STATUSOK'),
+    'AscentDescent':        (None,   'STATUSOK'),
+    'BatteryVoltageOK':     (None,   'STATUSOK'),
+    'CryptographyMode':     ('%d',   'STATUSOK'),
+    'Decoded':              (None,   None),
+    'STATUSOK':             (None,   None),
+    'MEASOK':               (None,   None),
+    'GPSPOSOK':             (None,   None),
+}
+
+# GPS time - UTC [sec]
+LeapSeconds = 18
+
+# Separates the formatted values of a column. Not a character of any formatted value
+ValueSeparator = '\x1f'
+
+# %% Column formatting
+#####################
+# Column formatting #
+#####################
+
+def FormatValues(Values, Format):
+    '''
+    Format the values of a column (a list) with a %-format, in one formatting operation. Returns a list of strings
+    '''
+    if not(Values):
+        return []
+    return ((Format + ValueSeparator) * len(Values) % tuple(Values)).split(ValueSeparator)[:-1]
+
+def GetFlightTimes(Columns, LeapSeconds = LeapSeconds):
+    '''
+    Get the UTC time of each frame of a decoded flight, from its GPS week and milliseconds:
+    a datetime64[ms] array, NaT where there is no GPS time
+    '''
+    GPSEpoch = np.datetime64('1980-01-06T00:00:00', 'ms')
+    Milliseconds = Columns['GPSWeek'].astype(np.int64) * (7 * 86400 * 1000) + Columns['GPSMilliseconds'].astype(np.int64)
+    Times = GPSEpoch + (Milliseconds - LeapSeconds * 1000).astype('timedelta64[ms]')
+    Times[Columns['GPSWeek'] <= 0] = np.datetime64('NaT')
+    return Times
+
+def FormatExportField(Columns, FieldName, JSON, LeapSeconds = LeapSeconds):
+    '''
+    Format an export field of a decoded flight's columns (see ExportFields) to a list of strings: JSON values,
+    or CSV fields
+    '''
+    Format, ValidColumn = ExportFields.get(FieldName, (None, None))
+    if FieldName == 'Time':
+        Times = GetFlightTimes(Columns, LeapSeconds)
+        Valid = ~np.isnat(Times)
+        Strings = FormatValues(np.datetime_as_string(Times, unit='ms').tolist(), '"%sZ"' if JSON else '%sZ')
+    else:
+        Column = Columns[FieldName]
+        Valid = np.ones(len(Column), dtype=bool) if ValidColumn is None else Columns[ValidColumn].copy()
+        if Column.dtype.kind == 'b':
+            Strings = np.where(Column, 'true' if JSON else '1', 'false' if JSON else '0').tolist()
+        elif Column.dtype.kind in 'US':
+            # Each distinct string is quoted once
+            Unique, Inverse = np.unique(Column.astype(str), return_inverse=True)
+            Quoted = [json.dumps(Value) if JSON else QuoteCSVField(Value) for Value in Unique.tolist()]
+            Strings = [Quoted[Index] for Index in Inverse.tolist()]
+        else:
+            if Column.dtype.kind == 'f':
+                Valid &= ~np.isnan(Column)
+                Column = np.where(Valid, Column, 0)
+            Strings = FormatValues(Column.tolist(), Format or ('%.6g' if Column.dtype.kind == 'f' else '%d'))
+
+    # The values that are not available
+    Missing = 'null' if JSON else ''
+    for Index in np.flatnonzero(~Valid).tolist():
+        Strings[Index] = Missing
+    return Strings
+
+def QuoteCSVField(Value):
+    '''
+    Quote a CSV field (RFC 4180) if it has a comma, a quote or a line break
+    '''
+    if any(Character in Value for Character in ',"\r\n'):
+        return '"' + Value.replace('"', '""') + '"'
+    return Value
+
+def GetExportFieldNames(Columns, FieldNames = None):
+    '''
+    Get the exported field names: FieldNames, or the fields of ExportFields that the columns have,
+    with the FileNumber column of IngestLogs first
+    '''
+    if FieldNames is not None:
+        return list(FieldNames)
+    FieldNames = ['FileNumber'] if 'FileNumber' in Columns else []
+    return FieldNames + [FieldName for FieldName in ExportFields
+                         if (FieldName in Columns) or (FieldName == 'Time' and 'GPSWeek' in Columns)]
+
+def SelectRows(Columns, Rows):
+    '''
+    Select the rows of columns (a boolean mask or an index array). Rows None: all of the rows
+    '''
+    if Rows is None:
+        return Columns
+    return {Name: Column[Rows] for Name, Column in Columns.items()}
+
+# %% Export functions
+####################
+# Export functions #
+####################
+
+def FormatFlightNDJSON(Columns, FieldNames = None, Rows = None, LeapSeconds = LeapSeconds):
+    '''
+    Format the columns of a decoded flight as NDJSON: a JSON object per row (frame), per line.
+    FieldNames defaults to GetExportFieldNames. Rows selects the exported rows (see SelectRows)
+    '''
+    Columns = SelectRows(Columns, Rows)
+    FieldNames = GetExportFieldNames(Columns, FieldNames)
+    NumOfRows = len(next(iter(Columns.values()))) if Columns else 0
+    if (NumOfRows == 0) or not(FieldNames):
+        return ''
+
+    # The values of all of the fields, interleaved row by row, into one row template
+    Values = [None] * (NumOfRows * len(FieldNames))
+    for i, FieldName in enumerate(FieldNames):
+        Values[i::len(FieldNames)] = FormatExportField(Columns, FieldName, True, LeapSeconds)
+    RowTemplate = '{' + ','.join(json.dumps(FieldName).replace('%', '%%') + ':%s' for FieldName in FieldNames) + '}\n'
+    return RowTemplate * NumOfRows % tuple(Values)
+
+def FormatFlightCSV(Columns, FieldNames = None, Rows = None, LeapSeconds = LeapSeconds, Header = True):
+    '''
+    Format the columns of a decoded flight as CSV, a row per frame, with a header row of the field names.
+    FieldNames defaults to GetExportFieldNames. Rows selects the exported rows (see SelectRows)
+    '''
+    Columns = SelectRows(Columns, Rows)
+    FieldNames = GetExportFieldNames(Columns, FieldNames)
+    Lines = [','.join(QuoteCSVField(FieldName) for FieldName in FieldNames)] if Header else []
+    FieldStrings = [FormatExportField(Columns, FieldName, False, LeapSeconds) for FieldName in FieldNames]
+    Lines.extend(map(','.join, zip(*FieldStrings)))
+    return '\n'.join(Lines) + '\n' if Lines else ''
+
+def WriteFlightExport(Columns, OutputFileName, Format = None, FieldNames = None, Rows = None, LeapSeconds = LeapSeconds):
+    '''
+    Write the columns of a decoded flight to an NDJSON or a CSV file. Format ('ndjson' or 'csv') defaults to
+    the file name extension (.csv: CSV, otherwise NDJSON)
+    '''
+    if Format is None:
+        Format = 'csv' if OutputFileName.lower().endswith('.csv') else 'ndjson'
+    if Format == 'csv':
+        Text = FormatFlightCSV(Columns, FieldNames, Rows, LeapSeconds)
+    elif Format == 'ndjson':
+        Text = FormatFlightNDJSON(Columns, FieldNames, Rows, LeapSeconds)
+    else:
+        raise ValueError('Unknown export format: ' + str(Format))
+    with open(OutputFileName, 'w', encoding='utf-8', newline='') as File:
+        File.write(Text)
+
+def LoadExportColumns(InputFileName):
+    '''
+    Load the columns to export: decode a log file (see DecodeFlightFile), or load a .npz file of columns
+    '''
+    if InputFileName.lower().endswith('.npz'):
+        with np.load(InputFileName, allow_pickle=False) as Input:
+            return {Name: Input[Name] for Name in Input.files if Name != 'LogFileNames'}
+    return DecodeFlightFile(InputFileName)
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'Export a decoded RS41 flight as NDJSON or CSV')
+    Parser.add_argument('input', help = 'Log file, or .npz columns file (see RS41ArchiveIngest --output)')
+    Parser.add_argument('--format', choices = ['ndjson', 'csv'], help = 'Default: by the output file extension, or ndjson')
+    Parser.add_argument('--output', help = 'Output file. Default: stdout')
+    Args = Parser.parse_args()
+
+    Columns = LoadExportColumns(Args.input)
+    if Args.output:
+        WriteFlightExport(Columns, Args.output, Args.format)
+    elif Args.format == 'csv':
+        sys.stdout.write(FormatFlightCSV(Columns))
+    else:
+        sys.stdout.write(FormatFlightNDJSON(Columns))
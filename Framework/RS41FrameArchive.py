@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 compressed frame archive
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions store RS41 frame streams in #
+# a compressed archive file, with random    #
+# access by record number and frame number. #
+#                                           #
+# The frames are stored in chunks (256      #
+# frames by default). Each chunk is decoded #
+# on its own. Within a chunk:               #
+# 1. The Reed-Solomon parity and the block  #
+#    CRCs are replaced by their xor with    #
+#    the values calculated from the data:   #
+#    zero for a valid frame                 #
+# 2. Each frame is xor-ed with the previous #
+#    frame, byte by byte. Counters, time    #
+#    and positions are arithmetic deltas    #
+#    of the previous frame's values instead #
+# 3. The result is transposed (byte 0 of    #
+#    all of the frames, then byte 1, ...)   #
+#    and compressed with zlib or lzma       #
+#                                           #
+# File layout:                              #
+# - Header: "RS41ARC1", compressor name     #
+# - Chunks: "RSCK", number of frames,       #
+#   compressed length, compressed data      #
+# - Index: one record per chunk (see        #
+#   ArchiveIndexDType)                      #
+# - Footer: index offset, number of chunks, #
+#   "RS41IDX1"                              #
+# An archive without an index (e.g. an      #
+# interrupted writer) is read by scanning   #
+# the chunk headers.                        #
+#############################################
+
+import lzma
+import zlib
+import struct
+import numpy as np
+from RS41BlocksRW import *
+
+ArchiveMagic = b'RS41ARC1'
+ArchiveIndexMagic = b'RS41IDX1'
+ArchiveChunkMagic = b'RSCK'
+ArchiveHeaderStruct = struct.Struct('<8s8s')   # Magic, compressor name
+ArchiveChunkStruct = struct.Struct('<4sII')    # Magic, number of frames, compressed length
+ArchiveFooterStruct = struct.Struct('<QQ8s')   # Index offset, number of chunks, magic
+
+# The archive index: one record per chunk
+ArchiveIndexDType = np.dtype([('Offset', '<u8'),          # File offset of the compressed data
+                              ('Length', '<u4'),          # Compressed length [bytes]
+                              ('CRC32', '<u4'),           # CRC32 of the compressed data
+                              ('FirstRecord', '<u8'),     # Record number of the chunk's first frame
+                              ('NumOfFrames', '<u4'),
+                              ('MinFrameNumber', '<u2'),  # STATUS block frame numbers range of the chunk
+                              ('MaxFrameNumber', '<u2')])
+
+# Compressors, by name: (compress, decompress)
+ArchiveCompressors = {
+    'zlib': (lambda Data: zlib.compress(Data, 9), zlib.decompress),
+    'lzma': (lambda Data: lzma.compress(Data, preset=6), lzma.decompress),
+}
+
+# Fields stored as arithmetic deltas of the previous frame: (offset, width [bytes]), little endian
+ArchiveDeltaFields = ([(0x03B, 2)] +                                   # Frame number
+                      [(0x097, 4), (0x0B7, 4)] +                       # GPS time of week, minimal pseudorange
+                      [(0x0BC + 7*i, 4) for i in range(12)] +          # SVs deltaPR
+                      [(0x114, 4), (0x118, 4), (0x11C, 4)])            # ECEF position
+
+# Blocks whose CRCs are replaced by their residuals: (ID, regular offset, regular length)
+ArchiveCRCBlocks = [(BlockID, Offset, Length) for BlockID, (Name, Offset, Length, ReadFunction) in BlockDecoders.items()
+                    if Offset is not None]
+
+# %% Chunk coding
+################
+# Chunk coding #
+################
+
+def GetArchiveResiduals(FrameArray, Lengths, Encoded):
+    '''
+    Get the xor masks that turn the Reed-Solomon parity and block CRCs of frames (an (N, width) uint8 array)
+    into their residuals, and back. Calculated from the data bytes only, which the residuals don't change.
+    Encoded = The frames hold residuals (decoding), rather than the original parity and CRCs (encoding)
+    '''
+    Masks = np.zeros_like(FrameArray)
+    Full = np.flatnonzero(Lengths >= RegularFrameLength)
+    for BlockID, Offset, Length in ArchiveCRCBlocks:
+        Rows = Full[(FrameArray[Full, Offset] == BlockID) & (FrameArray[Full, Offset + 1] == Length)]
+        CRC = crc16Batch(FrameArray[Rows, Offset + 2:Offset + 2 + Length])
+        Masks[Rows, Offset + 2 + Length] = CRC & 0xFF
+        Masks[Rows, Offset + 3 + Length] = CRC >> 8
+
+    # The parity covers the CRCs: it's calculated from the frames with their CRCs restored
+    Parity = FrameArray[Full, 0:RegularFrameLength]
+    if Encoded:
+        Parity ^= Masks[Full, 0:RegularFrameLength]
+    SetReedSolomonBatch(Parity)
+    Masks[Full, 0x008:0x038] = Parity[:, 0x008:0x038]
+    return Masks
+
+def EncodeArchiveChunk(Frames, Compress):
+    '''
+    Encode a list of frames (RS41 message byte arrays) into a compressed chunk
+    '''
+    Lengths = np.array([len(Frame) for Frame in Frames], dtype=np.uint16)
+    FrameArray = np.zeros((len(Frames), int(Lengths.max())), dtype=np.uint8)
+    for i, Frame in enumerate(Frames):
+        FrameArray[i, 0:Lengths[i]] = np.frombuffer(bytes(Frame), dtype=np.uint8)
+
+    # Residuals, then the xor with the previous frame (the first frame of the chunk is stored as is)
+    Residuals = FrameArray ^ GetArchiveResiduals(FrameArray, Lengths, False)
+    Deltas = Residuals.copy()
+    Deltas[1:] ^= Residuals[:-1]
+    for Offset, Width in ArchiveDeltaFields:
+        if Offset + Width <= FrameArray.shape[1]:
+            Values = GetArchiveFieldValues(Residuals, Offset, Width)
+            Values[1:] = Values[1:] - Values[:-1]
+            SetArchiveFieldValues(Deltas, Offset, Width, Values)
+    return Compress(Lengths.astype('<u2').tobytes() + np.ascontiguousarray(Deltas.T).tobytes())
+
+def DecodeArchiveChunk(Data, NumOfFrames, Decompress):
+    '''
+    Decode a compressed chunk of NumOfFrames frames. Returns a list of frames (RS41 message byte arrays)
+    '''
+    Data = Decompress(Data)
+    Lengths = np.frombuffer(Data, dtype='<u2', count=NumOfFrames).astype(np.int64)
+    Width = int(Lengths.max())
+    Deltas = np.frombuffer(Data, dtype=np.uint8, offset=2*NumOfFrames).reshape(Width, NumOfFrames).T
+
+    # Undo the xor with the previous frame and the arithmetic deltas
+    Residuals = np.bitwise_xor.accumulate(Deltas, axis=0)
+    for Offset, Width in ArchiveDeltaFields:
+        if Offset + Width <= Residuals.shape[1]:
+            SetArchiveFieldValues(Residuals, Offset, Width, np.cumsum(GetArchiveFieldValues(Deltas, Offset, Width)))
+
+    # Restore the CRCs and the parity. The masks depend on the data bytes only
+    FrameArray = Residuals ^ GetArchiveResiduals(Residuals, Lengths, True)
+    return [bytearray(FrameArray[i, 0:Lengths[i]].tobytes()) for i in range(NumOfFrames)]
+
+def GetArchiveFieldValues(FrameArray, Offset, Width):
+    '''
+    Get a little endian unsigned field of each frame, as an int64 array
+    '''
+    Values = np.zeros(len(FrameArray), dtype=np.int64)
+    for i in range(Width):
+        Values |= FrameArray[:, Offset + i].astype(np.int64) << (8 * i)
+    return Values
+
+def SetArchiveFieldValues(FrameArray, Offset, Width, Values):
+    '''
+    Set a little endian unsigned field of each frame (modulo its size) from an int64 array
+    '''
+    for i in range(Width):
+        FrameArray[:, Offset + i] = (Values >> (8 * i)) & 0xFF
+
+# %% Archive writing
+###################
+# Archive writing #
+###################
+
+def OpenArchiveWriter(ArchiveFileName, Compression = 'lzma', ChunkFrames = 256):
+    '''
+    Create a frame archive file, and the state of its writer (see AddFrameToArchive and CloseArchiveWriter)
+    '''
+    if Compression not in ArchiveCompressors:
+        raise ValueError("Unknown archive compression: " + str(Compression))
+    File = open(ArchiveFileName, 'wb')
+    File.write(ArchiveHeaderStruct.pack(ArchiveMagic, Compression.encode('ascii')))
+    return {'File': File,
+            'Compression': Compression,
+            'ChunkFrames': ChunkFrames,
+            'PendingFrames': [],
+            'Index': [],
+            'NumOfRecords': 0}
+
+def AddFrameToArchive(Writer, MessageBytes):
+    '''
+    Add a frame (a RS41 message byte array: 320 or 518 bytes) to a frame archive
+    '''
+    Writer['PendingFrames'].append(bytes(MessageBytes))
+    if len(Writer['PendingFrames']) >= Writer['ChunkFrames']:
+        WriteArchiveChunk(Writer)
+
+def WriteArchiveChunk(Writer):
+    '''
+    Compress the pending frames of an archive writer into a chunk, and write it
+    '''
+    Frames = Writer['PendingFrames']
+    if len(Frames) == 0:
+        return
+    Data = EncodeArchiveChunk(Frames, ArchiveCompressors[Writer['Compression']][0])
+    FrameNumbers = [int.from_bytes(Frame[0x03B:0x03D], byteorder='little') for Frame in Frames]
+    File = Writer['File']
+    File.write(ArchiveChunkStruct.pack(ArchiveChunkMagic, len(Frames), len(Data)))
+    Writer['Index'].append((File.tell(), len(Data), zlib.crc32(Data), Writer['NumOfRecords'], len(Frames),
+                            min(FrameNumbers), max(FrameNumbers)))
+    File.write(Data)
+    Writer['NumOfRecords'] = Writer['NumOfRecords'] + len(Frames)
+    Writer['PendingFrames'] = []
+
+def CloseArchiveWriter(Writer):
+    '''
+    Write the last chunk and the index of a frame archive, and close it
+    '''
+    WriteArchiveChunk(Writer)
+    File = Writer['File']
+    IndexOffset = File.tell()
+    File.write(np.array(Writer['Index'], dtype=ArchiveIndexDType).tobytes())
+    File.write(ArchiveFooterStruct.pack(IndexOffset, len(Writer['Index']), ArchiveIndexMagic))
+    File.close()
+
+def WriteFrameArchive(ArchiveFileName, Frames, Compression = 'lzma', ChunkFrames = 256):
+    '''
+    Write frames (an iterable of RS41 message byte arrays) to a frame archive file. Returns the number of frames
+    '''
+    Writer = OpenArchiveWriter(ArchiveFileName, Compression, ChunkFrames)
+    try:
+        for MessageBytes in Frames:
+            AddFrameToArchive(Writer, MessageBytes)
+    finally:
+        CloseArchiveWriter(Writer)
+    return Writer['NumOfRecords']
+
+# %% Archive reading
+###################
+# Archive reading #
+###################
+
+def OpenFrameArchive(ArchiveFileName):
+    '''
+    Open a frame archive file for reading. Returns the state of the archive reader
+    '''
+    File = open(ArchiveFileName, 'rb')
+    Magic, Compression = ArchiveHeaderStruct.unpack(File.read(ArchiveHeaderStruct.size))
+    Compression = Compression.rstrip(b'\x00').decode('ascii')
+    if (Magic != ArchiveMagic) or (Compression not in ArchiveCompressors):
+        File.close()
+        raise ValueError("Not a RS41 frame archive: " + str(ArchiveFileName))
+    return {'File': File,
+            'Decompress': ArchiveCompressors[Compression][1],
+            'Index': ReadArchiveIndex(File),
+            'CachedChunk': (None, None)}
+
+def ReadArchiveIndex(File):
+    '''
+    Read the index of a frame archive file. If the file has no index, it's rebuilt from the chunk headers
+    '''
+    FileLength = File.seek(0, 2)
+    if FileLength >= ArchiveHeaderStruct.size + ArchiveFooterStruct.size:
+        File.seek(FileLength - ArchiveFooterStruct.size)
+        IndexOffset, NumOfChunks, Magic = ArchiveFooterStruct.unpack(File.read(ArchiveFooterStruct.size))
+        if (Magic == ArchiveIndexMagic) and \
+           (IndexOffset + NumOfChunks * ArchiveIndexDType.itemsize + ArchiveFooterStruct.size == FileLength):
+            File.seek(IndexOffset)
+            return np.frombuffer(File.read(NumOfChunks * ArchiveIndexDType.itemsize), dtype=ArchiveIndexDType)
+
+    # Scan the complete chunks
+    Index = []
+    Offset = ArchiveHeaderStruct.size
+    NumOfRecords = 0
+    while Offset + ArchiveChunkStruct.size <= FileLength:
+        File.seek(Offset)
+        Magic, NumOfFrames, Length = ArchiveChunkStruct.unpack(File.read(ArchiveChunkStruct.size))
+        if (Magic != ArchiveChunkMagic) or (Offset + ArchiveChunkStruct.size + Length > FileLength):
+            break
+        Data = File.read(Length)
+        Index.append((Offset + ArchiveChunkStruct.size, Length, zlib.crc32(Data), NumOfRecords, NumOfFrames, 0, 0xFFFF))
+        NumOfRecords = NumOfRecords + NumOfFrames
+        Offset = Offset + ArchiveChunkStruct.size + Length
+    return np.array(Index, dtype=ArchiveIndexDType)
+
+def CloseFrameArchive(Archive):
+    '''
+    Close a frame archive reader
+    '''
+    Archive['File'].close()
+
+def GetArchiveLength(Archive):
+    '''
+    Get the number of frames in a frame archive
+    '''
+    if len(Archive['Index']) == 0:
+        return 0
+    return int(Archive['Index']['FirstRecord'][-1] + Archive['Index']['NumOfFrames'][-1])
+
+def ReadArchiveChunk(Archive, ChunkNumber):
+    '''
+    Read and decode a chunk of a frame archive. Returns a list of frames. The last chunk read is kept decoded
+    '''
+    if Archive['CachedChunk'][0] == ChunkNumber:
+        return Archive['CachedChunk'][1]
+    Entry = Archive['Index'][ChunkNumber]
+    Archive['File'].seek(int(Entry['Offset']))
+    Data = Archive['File'].read(int(Entry['Length']))
+    if zlib.crc32(Data) != Entry['CRC32']:
+        raise ValueError("Corrupted frame archive chunk: " + str(ChunkNumber))
+    Frames = DecodeArchiveChunk(Data, int(Entry['NumOfFrames']), Archive['Decompress'])
+    Archive['CachedChunk'] = (ChunkNumber, Frames)
+    return Frames
+
+def ReadArchiveRecord(Archive, RecordNumber):
+    '''
+    Read a frame of a frame archive by its record number (its position in the archive, from 0)
+    '''
+    if not(0 <= RecordNumber < GetArchiveLength(Archive)):
+        raise IndexError("Frame archive record number out of range: " + str(RecordNumber))
+    ChunkNumber = int(np.searchsorted(Archive['Index']['FirstRecord'], RecordNumber, side='right')) - 1
+    return ReadArchiveChunk(Archive, ChunkNumber)[RecordNumber - int(Archive['Index']['FirstRecord'][ChunkNumber])]
+
+def FindArchiveFrame(Archive, FrameNumber, StartRecord = 0):
+    '''
+    Find the first frame with a STATUS block frame number, from StartRecord on. Only the chunks whose frame
+    numbers range holds the frame number are decoded. Returns (RecordNumber, MessageBytes), or None if not found
+    '''
+    Index = Archive['Index']
+    Candidates = np.flatnonzero((Index['MinFrameNumber'] <= FrameNumber) & (Index['MaxFrameNumber'] >= FrameNumber) &
+                                (Index['FirstRecord'] + Index['NumOfFrames'] > StartRecord))
+    for ChunkNumber in Candidates:
+        FirstRecord = int(Index['FirstRecord'][ChunkNumber])
+        for i, MessageBytes in enumerate(ReadArchiveChunk(Archive, ChunkNumber)):
+            if (FirstRecord + i >= StartRecord) and (int.from_bytes(MessageBytes[0x03B:0x03D], byteorder='little') == FrameNumber):
+                return FirstRecord + i, MessageBytes
+    return None
+
+def IterateArchive(Archive, StartRecord = 0):
+    '''
+    Yield the frames of a frame archive, from StartRecord on
+    '''
+    Index = Archive['Index']
+    for ChunkNumber in range(len(Index)):
+        FirstRecord = int(Index['FirstRecord'][ChunkNumber])
+        if FirstRecord + int(Index['NumOfFrames'][ChunkNumber]) <= StartRecord:
+            continue
+        for MessageBytes in ReadArchiveChunk(Archive, ChunkNumber)[max(0, StartRecord - FirstRecord):]:
+            yield MessageBytes
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 shared memory frame ring buffer
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions connect demodulator         #
+# processes to decoder processes through a  #
+# ring of fixed-size frame slots in shared  #
+# memory, so demodulation and decoding run  #
+# on separate cores.                        #
+#                                           #
+# Each slot holds one frame (up to 518      #
+# bytes), its byte reliability scores and   #
+# its sample index, sync score and source.  #
+# - A producer claims the next free slot,   #
+#   writes the frame in place and marks the #
+#   slot ready                              #
+# - A consumer claims the next ready slot,  #
+#   decodes the frame in place (a           #
+#   memoryview of the slot: no copy) and    #
+#   frees the slot                          #
+#                                           #
+# Backpressure: when the ring is full, a    #
+# producer waits for a free slot (up to a   #
+# timeout), or drops the frame. The drops,  #
+# waits and slot counts are kept in the     #
+# ring's shared header.                     #
+#                                           #
+# Each slot keeps the process ID of the     #
+# consumer that reads it. A slot held by a  #
+# consumer that died is freed by the        #
+# producer waiting for it, and counted as   #
+# lost.                                     #
+#############################################
+
+import os
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from RS41BlocksRW import *
+
+# Slot states
+SlotEmpty = 0
+SlotWriting = 1
+SlotReady = 2
+SlotReading = 3
+
+# A producer waiting for a slot checks if the slot's consumer is still alive every SlotWaitTimeout [sec]
+SlotWaitTimeout = 1.0
+
+# A frame slot. The byte reliability scores are quantized to 0-255
+RingSlotDType = np.dtype([('State', 'u1'),
+                          ('Length', '<u2'),
+                          ('Source', '<u4'),
+                          ('Reader', '<i4'),       # Process ID of the consumer that reads the slot
+                          ('SampleIndex', '<i8'),
+                          ('SyncScore', '<f4'),
+                          ('Data', 'u1', (ExtendedFrameLength,)),
+                          ('Reliability', 'u1', (ExtendedFrameLength,))], align=True)
+
+# The ring's shared header: slot indexes and counters
+RingHeaderDType = np.dtype([('Head', '<u8'),           # Slots claimed by producers
+                            ('Tail', '<u8'),           # Slots claimed by consumers
+                            ('Consumed', '<u8'),       # Slots freed by consumers
+                            ('Dropped', '<u8'),        # Frames dropped because the ring was full
+                            ('ProducerWaits', '<u8'),  # Frames whose producer waited for a free slot
+                            ('Lost', '<u8'),           # Slots freed because the consumer that read them died
+                            ('Closed', '<u8')])        # No more frames will be written
+
+# %% Ring functions
+##################
+# Ring functions #
+##################
+
+def NewFrameRing(Capacity = 256):
+    '''
+    Create a frame ring of Capacity slots in shared memory. The ring is passed to other processes by its handle
+    (see GetFrameRingHandle), and freed by DeleteFrameRing
+    '''
+    Block = shared_memory.SharedMemory(create=True, size=RingHeaderDType.itemsize + Capacity * RingSlotDType.itemsize)
+    Handle = (Block.name, Capacity, multiprocessing.Lock(), multiprocessing.Semaphore(Capacity), multiprocessing.Semaphore(0))
+    Ring = AttachFrameRing(Handle, Block)
+    Ring['Header'][0] = 0
+    Ring['Slots']['State'] = SlotEmpty
+    return Ring
+
+def GetFrameRingHandle(Ring):
+    '''
+    Get the handle of a frame ring: pass it to a process (as a multiprocessing.Process argument) that calls AttachFrameRing
+    '''
+    return Ring['Handle']
+
+def AttachFrameRing(Handle, Block = None):
+    '''
+    Attach to a frame ring by its handle (see GetFrameRingHandle)
+    '''
+    Name, Capacity, Lock, FreeSlots, ReadySlots = Handle
+    if Block is None:
+        # The processes of the pipeline share the resource tracker of the process that created the ring,
+        # so the ring is unlinked only once (see DeleteFrameRing)
+        Block = shared_memory.SharedMemory(name=Name)
+    return {'Handle': Handle,
+            'Block': Block,
+            'Capacity': Capacity,
+            'Lock': Lock,
+            'FreeSlots': FreeSlots,
+            'ReadySlots': ReadySlots,
+            'Header': np.ndarray(1, dtype=RingHeaderDType, buffer=Block.buf),
+            'Slots': np.ndarray(Capacity, dtype=RingSlotDType, buffer=Block.buf, offset=RingHeaderDType.itemsize)}
+
+def DetachFrameRing(Ring):
+    '''
+    Detach from a frame ring. The slot views of the ring can't be used after that
+    '''
+    Ring['Header'] = None
+    Ring['Slots'] = None
+    Ring['Block'].close()
+
+def DeleteFrameRing(Ring):
+    '''
+    Free a frame ring's shared memory (by the process that created it, after all of the other processes detached)
+    '''
+    DetachFrameRing(Ring)
+    Ring['Block'].unlink()
+
+def WaitSlotState(Ring, SlotIndex, State, Timeout = None):
+    '''
+    Wait for a slot to get to a state, up to Timeout [sec] (None = no limit). A slot claimed out of order can still
+    be in use by a slower process. Returns False on timeout
+    '''
+    Slots = Ring['Slots']
+    StartTime = time.monotonic()
+    while Slots['State'][SlotIndex] != State:
+        if (Timeout is not None) and (time.monotonic() - StartTime >= Timeout):
+            return False
+        time.sleep(1e-5)
+    return True
+
+def IsProcessAlive(ProcessID):
+    '''
+    Check if a process is alive, by its process ID. A process that died is alive until its parent reaps it
+    (e.g. by its multiprocessing.Process is_alive or join)
+    '''
+    try:
+        os.kill(ProcessID, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def FreeDeadSlot(Ring, SlotIndex):
+    '''
+    Free a slot that is read by a consumer that died, as the consumer would have (see ReleaseFrame).
+    Returns True if the slot was freed
+    '''
+    Slots = Ring['Slots']
+    with Ring['Lock']:
+        if (Slots['State'][SlotIndex] != SlotReading) or IsProcessAlive(int(Slots['Reader'][SlotIndex])):
+            return False
+        Slots['State'][SlotIndex] = SlotEmpty
+        Ring['Header']['Consumed'][0] += 1
+        Ring['Header']['Lost'][0] += 1
+    Ring['FreeSlots'].release()
+    return True
+
+def CloseFrameRing(Ring):
+    '''
+    Mark a frame ring as closed, by the producers' side: consumers get None once the ready slots are consumed
+    '''
+    with Ring['Lock']:
+        Ring['Header']['Closed'][0] = 1
+
+def GetFrameRingStatistics(Ring):
+    '''
+    Get the counters of a frame ring: a dictionary of Capacity, Written, Consumed, Pending (written, not consumed yet),
+    Dropped, ProducerWaits and Lost
+    '''
+    with Ring['Lock']:
+        Header = Ring['Header'][0]
+        return {'Capacity': Ring['Capacity'],
+                'Written': int(Header['Head']),
+                'Consumed': int(Header['Consumed']),
+                'Pending': int(Header['Head'] - Header['Consumed']),
+                'Dropped': int(Header['Dropped']),
+                'ProducerWaits': int(Header['ProducerWaits']),
+                'Lost': int(Header['Lost'])}
+
+# %% Producer and consumer functions
+####################################
+# Producer and consumer functions #
+####################################
+
+def PutFrame(Ring, MessageBytes, ByteReliability = None, SampleIndex = 0, SyncScore = 1.0, Source = 0, Timeout = None):
+    '''
+    Write a frame (a RS41 message byte array, fitted to its frame length, see FitFrameLength) to a frame ring.
+    The padding bytes of a short frame get a zero reliability. If the ring is full, waits up to
+    Timeout [sec] for a free slot (None = no limit, 0 = no wait). Returns False if the frame was dropped
+    '''
+    # The frame bytes past the received bytes (and byte reliabilities) are padding
+    Frame = FitFrameLength(MessageBytes)
+    Length = len(Frame)
+    Received = min(len(MessageBytes), Length)
+    if ByteReliability is not None:
+        Received = min(Received, len(ByteReliability))
+
+    if not(Ring['FreeSlots'].acquire(False)):
+        Waited = (Timeout is None) or (Timeout > 0)
+        if not(Waited) or not(Ring['FreeSlots'].acquire(True, Timeout)):
+            with Ring['Lock']:
+                Ring['Header']['Dropped'][0] += 1
+            return False
+        with Ring['Lock']:
+            Ring['Header']['ProducerWaits'][0] += 1
+    with Ring['Lock']:
+        SlotIndex = int(Ring['Header']['Head'][0] % Ring['Capacity'])
+        Ring['Header']['Head'][0] += 1
+
+    # A slot held by a consumer that died is freed here
+    while not(WaitSlotState(Ring, SlotIndex, SlotEmpty, SlotWaitTimeout)):
+        FreeDeadSlot(Ring, SlotIndex)
+
+    # Write the frame in place
+    Slot = Ring['Slots'][SlotIndex:SlotIndex + 1]
+    Slot['State'] = SlotWriting
+    Slot['Length'] = Length
+    Slot['Source'] = Source
+    Slot['SampleIndex'] = SampleIndex
+    Slot['SyncScore'] = SyncScore
+    Slot['Data'][0, 0:Length] = np.frombuffer(Frame, dtype=np.uint8)
+    if ByteReliability is None:
+        Slot['Reliability'][0, 0:Received] = 255
+    else:
+        Slot['Reliability'][0, 0:Received] = np.round(np.clip(ByteReliability[0:Received], 0.0, 1.0) * 255)
+    Slot['Reliability'][0, Received:Length] = 0
+    Slot['State'] = SlotReady
+    Ring['ReadySlots'].release()
+    return True
+
+def AcquireFrame(Ring, Timeout = None, PollInterval = 0.1):
+    '''
+    Claim the next ready slot of a frame ring. Waits up to Timeout [sec] (None = until the ring is closed).
+    Returns the slot index (see GetSlotFrame and ReleaseFrame), or None
+    '''
+    StartTime = time.monotonic()
+    while True:
+        Wait = PollInterval if Timeout is None else min(PollInterval, max(0.0, StartTime + Timeout - time.monotonic()))
+        if Ring['ReadySlots'].acquire(True, Wait):
+            break
+        if Ring['Header']['Closed'][0] or ((Timeout is not None) and (time.monotonic() - StartTime >= Timeout)):
+            if not(Ring['ReadySlots'].acquire(False)):
+                return None
+            break
+    with Ring['Lock']:
+        SlotIndex = int(Ring['Header']['Tail'][0] % Ring['Capacity'])
+        Ring['Header']['Tail'][0] += 1
+    WaitSlotState(Ring, SlotIndex, SlotReady)
+    Ring['Slots']['Reader'][SlotIndex] = os.getpid()
+    Ring['Slots']['State'][SlotIndex] = SlotReading
+    return SlotIndex
+
+def GetSlotFrame(Ring, SlotIndex):
+    '''
+    Get the frame of a claimed slot: (MessageBytes, ByteReliability, SampleIndex, SyncScore, Source).
+    MessageBytes is a writable memoryview of the slot (e.g. for DecodeReedSolomon's in place correction),
+    valid until the slot is released
+    '''
+    Slot = Ring['Slots'][SlotIndex]
+    Length = int(Slot['Length'])
+    MessageBytes = memoryview(Ring['Slots']['Data'][SlotIndex]).cast('B')[0:Length]
+    ByteReliability = Slot['Reliability'][0:Length] / 255.0
+    return MessageBytes, ByteReliability, int(Slot['SampleIndex']), float(Slot['SyncScore']), int(Slot['Source'])
+
+def ReleaseFrame(Ring, SlotIndex):
+    '''
+    Free a claimed slot of a frame ring
+    '''
+    Ring['Slots']['State'][SlotIndex] = SlotEmpty
+    with Ring['Lock']:
+        Ring['Header']['Consumed'][0] += 1
+    Ring['FreeSlots'].release()
+
+# %% Pipeline processes
+#######################
+# Pipeline processes #
+#######################
+
+def DecodeSlotFrame(MessageBytes, ByteReliability):
+    '''
+    Decode a frame in place: Reed-Solomon correction (with erasures), CRC checks and block parsing.
+    Returns (Decoded, Blocks), with the block values copied out of the slot (see ParseMessageBlocks)
+    '''
+    try:
+        Decoded = bool(DecodeReedSolomon(MessageBytes, ByteReliability))
+    except Exception:
+        Decoded = False
+    Blocks = ParseMessageBlocks(MessageBytes)
+    for BlockName, Values in Blocks.items():
+        if isinstance(Values, tuple):
+            Blocks[BlockName] = tuple(bytearray(Value) if isinstance(Value, memoryview) else Value for Value in Values)
+        elif isinstance(Values, memoryview):
+            Blocks[BlockName] = bytearray(Values)
+    return Decoded, Blocks
+
+def RunDemodulatorProcess(Handle, WaveFileName, Source = 0, Timeout = None):
+    '''
+    Producer process: demodulate a WAV file (see DemodulateWaveFile) into a frame ring
+    '''
+    from RS41Demodulator import DemodulateWaveFile
+    Ring = AttachFrameRing(Handle)
+    try:
+        for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in DemodulateWaveFile(WaveFileName):
+            PutFrame(Ring, MessageBytes, ByteReliability, FrameSampleIndex, SyncScore, Source, Timeout)
+    finally:
+        DetachFrameRing(Ring)
+
+def RunDecoderProcess(Handle, ResultQueue):
+    '''
+    Consumer process: decode the frames of a frame ring, until it's closed. Puts (Source, SampleIndex, SyncScore,
+    Decoded, Blocks) in ResultQueue for each frame (see DecodeSlotFrame), and None at the end
+    '''
+    Ring = AttachFrameRing(Handle)
+    try:
+        while True:
+            SlotIndex = AcquireFrame(Ring)
+            if SlotIndex is None:
+                break
+            MessageBytes, ByteReliability, SampleIndex, SyncScore, Source = GetSlotFrame(Ring, SlotIndex)
+            try:
+                Decoded, Blocks = DecodeSlotFrame(MessageBytes, ByteReliability)
+            finally:
+                del MessageBytes
+                ReleaseFrame(Ring, SlotIndex)
+            ResultQueue.put((Source, SampleIndex, SyncScore, Decoded, Blocks))
+    finally:
+        ResultQueue.put(None)
+        DetachFrameRing(Ring)
+
+def RunFramePipeline(WaveFileNames, NumOfDecoders = 2, Capacity = 256, Timeout = None, Statistics = None):
+    '''
+    Demodulate WAV files (one producer process per file) and decode their frames (NumOfDecoders consumer processes),
+    through a frame ring. Yields (Source, SampleIndex, SyncScore, Decoded, Blocks) for each frame, where Source
+    is the WAV file's index. Timeout = 0 drops frames when the ring is full (see PutFrame).
+    If Statistics is a dictionary, it's updated with the ring's counters at the end (see GetFrameRingStatistics)
+    '''
+    Ring = NewFrameRing(Capacity)
+    ResultQueue = multiprocessing.Queue()
+    Handle = GetFrameRingHandle(Ring)
+    Producers = [multiprocessing.Process(target=RunDemodulatorProcess, args=(Handle, WaveFileName, Source, Timeout))
+                 for Source, WaveFileName in enumerate(WaveFileNames)]
+    Consumers = [multiprocessing.Process(target=RunDecoderProcess, args=(Handle, ResultQueue))
+                 for i in range(NumOfDecoders)]
+    try:
+        for Process in Producers + Consumers:
+            Process.start()
+
+        # The ring is closed once all of the producers ended. The consumers end when the ring is empty.
+        # A consumer that was killed never puts its None: the pipeline also ends once no consumer is alive
+        # and their results were all read
+        RunningConsumers = len(Consumers)
+        while RunningConsumers > 0:
+            if not(Ring['Header']['Closed'][0]) and not(any(Producer.is_alive() for Producer in Producers)):
+                CloseFrameRing(Ring)
+            # Each consumer is polled, so a consumer that died is reaped (see IsProcessAlive)
+            ConsumersAlive = any([Consumer.is_alive() for Consumer in Consumers])
+            try:
+                Result = ResultQueue.get(timeout=0.1)
+            except queue.Empty:
+                if not(ConsumersAlive):
+                    break
+                continue
+            if Result is None:
+                RunningConsumers = RunningConsumers - 1
+            else:
+                yield Result
+    finally:
+        for Process in Producers + Consumers:
+            if Process.is_alive():
+                Process.terminate()
+            Process.join()
+        if Statistics is not None:
+            Statistics.update(GetFrameRingStatistics(Ring))
+        DeleteFrameRing(Ring)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 FFT-based frame synchronization
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions find the RS41 frame starts  #
+# in a long soft bits stream (e.g. a whole  #
+# flight capture, demodulated).             #
+#                                           #
+# The soft bits are cross-correlated with   #
+# the whitened header pattern by FFT        #
+# overlap-save: each FFT block correlates   #
+# FFTLength - HeaderLength + 1 new bits,    #
+# with the last HeaderLength - 1 bits of    #
+# the previous block as history. The cost   #
+# is O(N*log(FFTLength)) rather than the    #
+# O(N*HeaderLength) of a sliding compare,   #
+# and the memory is bounded by FFTLength,   #
+# however long the capture is.              #
+#                                           #
+# The correlation is normalized by the soft #
+# bits energy under the pattern, so the     #
+# score doesn't depend on the signal level. #
+# A negative correlation is an inverted     #
+# signal (both polarities are found).       #
+#############################################
+
+import numpy as np
+from RS41Demodulator import *
+
+# The RS41 frame header, as transmitted (whitened, in transmission order), as a +1/-1 correlation pattern
+# (64 bits). See the Demodulator's HeaderPattern
+WhitenedHeaderPattern = HeaderPattern
+
+# %% Synchronization functions
+###############################
+# Synchronization functions #
+###############################
+
+def NewFrameSynchronizer(Pattern = WhitenedHeaderPattern, FFTLength = 8192, Threshold = 0.75,
+                         MinFrameSpacing = 0x140 * 8):
+    '''
+    Create the state of a streaming frame synchronization (see SynchronizeBlock).
+    Pattern         = The +1/-1 pattern to find
+    FFTLength       = The overlap-save FFT length. Must be larger than the pattern length
+    Threshold       = The minimal normalized correlation magnitude of a frame start, in [0:1].
+                      With hard bits, 1 - 2*Threshold is the fraction of header bit errors allowed
+    MinFrameSpacing = The minimal number of bits between frame starts. Of the peaks closer than that,
+                      the strongest is kept
+    '''
+    Pattern = np.asarray(Pattern, dtype=np.float64)
+    PatternLength = len(Pattern)
+    if FFTLength <= PatternLength:
+        raise ValueError("FFTLength must be larger than the pattern length")
+
+    # Correlation = convolution with the reversed pattern. Its FFT is calculated once
+    return {'Pattern': Pattern,
+            'PatternNorm': float(np.sqrt(np.dot(Pattern, Pattern))),
+            'FFTLength': FFTLength,
+            'PatternFFT': np.fft.rfft(Pattern[::-1], FFTLength),
+            'Threshold': Threshold,
+            'MinFrameSpacing': MinFrameSpacing,
+            'History': np.zeros(0),  # The last soft bits of the previous block (up to PatternLength - 1)
+            'BitOffset': 0,          # Bit offset (from the start of the stream) of the first history bit
+            'PendingPeak': None}     # (BitOffset, Score, Polarity) of the strongest peak not reported yet
+
+def CorrelateSegment(State, Segment):
+    '''
+    Normalized correlation of a soft bits segment (at most FFTLength bits) with the pattern, by one FFT.
+    Returns the correlation at the len(Segment) - PatternLength + 1 full-overlap offsets
+    '''
+    PatternLength = len(State['Pattern'])
+    NumOfOffsets = len(Segment) - PatternLength + 1
+    Correlation = np.fft.irfft(np.fft.rfft(Segment, State['FFTLength']) * State['PatternFFT'],
+                               State['FFTLength'])[PatternLength - 1:PatternLength - 1 + NumOfOffsets]
+
+    # The soft bits energy under the pattern, at each offset
+    Energy = np.cumsum(np.concatenate(([0.0], Segment * Segment)))
+    Energy = Energy[PatternLength:] - Energy[:NumOfOffsets]
+    Norm = np.sqrt(np.maximum(Energy, 0.0)) * State['PatternNorm']
+    return np.where(Norm > 1e-12, Correlation / np.maximum(Norm, 1e-12), 0.0)
+
+def SynchronizeBlock(State, SoftBits):
+    '''
+    Add the next block of soft bits (any length) to a streaming frame synchronization.
+    Returns a list of (BitOffset, Score, Polarity) for the frame starts found:
+    BitOffset = The offset of the first header bit, from the start of the stream [bits]
+    Score     = The normalized correlation magnitude, in [0:1] (1.0 = perfect match)
+    Polarity  = 1 for a normal signal, -1 for an inverted signal
+    The strongest peak is reported only after MinFrameSpacing more bits (see FlushFrameSynchronizer)
+    '''
+    PatternLength = len(State['Pattern'])
+    SegmentStep = State['FFTLength'] - PatternLength + 1
+    FrameStarts = []
+    SoftBits = np.asarray(SoftBits, dtype=np.float64)
+    for BlockStart in range(0, len(SoftBits), SegmentStep):
+        Segment = np.concatenate((State['History'], SoftBits[BlockStart:BlockStart + SegmentStep]))
+        if len(Segment) >= PatternLength:
+            Correlation = CorrelateSegment(State, Segment)
+            for Candidate in np.flatnonzero(np.abs(Correlation) >= State['Threshold']):
+                AddPeak(State, FrameStarts, (State['BitOffset'] + int(Candidate), float(abs(Correlation[Candidate])),
+                                             1 if Correlation[Candidate] > 0 else -1))
+            Consumed = len(Segment) - (PatternLength - 1)
+        else:
+            Consumed = 0
+        State['History'] = Segment[Consumed:]
+        State['BitOffset'] = State['BitOffset'] + Consumed
+
+    # Report the pending peak, once no stronger peak can follow it
+    PendingPeak = State['PendingPeak']
+    if (PendingPeak is not None) and (State['BitOffset'] - PendingPeak[0] >= State['MinFrameSpacing']):
+        FrameStarts.append(PendingPeak)
+        State['PendingPeak'] = None
+    return FrameStarts
+
+def AddPeak(State, FrameStarts, Peak):
+    '''
+    Add a correlation peak: keep the strongest of the peaks closer than MinFrameSpacing,
+    and move the pending peak to FrameStarts once a peak further away is found
+    '''
+    PendingPeak = State['PendingPeak']
+    if PendingPeak is None:
+        State['PendingPeak'] = Peak
+    elif Peak[0] - PendingPeak[0] >= State['MinFrameSpacing']:
+        FrameStarts.append(PendingPeak)
+        State['PendingPeak'] = Peak
+    elif Peak[1] > PendingPeak[1]:
+        State['PendingPeak'] = Peak
+
+def FlushFrameSynchronizer(State):
+    '''
+    End a streaming frame synchronization. Returns a list with the last pending frame start, if any
+    '''
+    PendingPeak = State['PendingPeak']
+    State['PendingPeak'] = None
+    return [] if PendingPeak is None else [PendingPeak]
+
+def FindFrameStarts(SoftBits, Pattern = WhitenedHeaderPattern, FFTLength = 8192, Threshold = 0.75,
+                    MinFrameSpacing = 0x140 * 8, BlockLength = 1 << 20):
+    '''
+    Find the RS41 frame starts in a soft bits array (a NumPy array or a memory mapped file, of any length).
+    The array is read BlockLength bits at a time. Yields (BitOffset, Score, Polarity) for each frame start
+    (see SynchronizeBlock)
+    '''
+    State = NewFrameSynchronizer(Pattern, FFTLength, Threshold, MinFrameSpacing)
+    for BlockStart in range(0, len(SoftBits), BlockLength):
+        for FrameStart in SynchronizeBlock(State, SoftBits[BlockStart:BlockStart + BlockLength]):
+            yield FrameStart
+    for FrameStart in FlushFrameSynchronizer(State):
+        yield FrameStart
@@ -23,9 +23,9 @@ RS41 protocol and measurements read-write operations
 import numpy as np
 import math
 import datetime
-from skyfield.api import load, wgs84
-from numpy import array2string
-import pymap3d
+
+# Skyfield and pymap3d are imported inside the GPS calculations functions,
+# so importing this module doesn't load them
 
 from RS41SubframeRW import *
 from RS41BlocksRW import *
@@ -62,24 +62,33 @@ XorArray = np.uint8([0x96, 0x83, 0x3E, 0x51, 0xB1, 0x49, 0x08, 0x98,
             0xD0, 0xBC, 0xB4, 0xB6, 0x06, 0xAA, 0xF4, 0x23,
             0x78, 0x6E, 0x3B, 0xAE, 0xBF, 0x7B, 0x4C, 0xC1])
 
-# Prefrom data whitening: Xor message bytes with a predefined xor mask
+# Prefrom data whitening: Xor message bytes with a predefined xor mask.
+# The message must hold at least FrameLength bytes, on both backends
 def DataWhitening(FrameLength, MessageBytes):
-    EncryptedMessageBytes = np.zeros(FrameLength, dtype=np.uint8)
-    
-    TempStartIndex = 0
-    TempEndIndex = 0
-    while TempStartIndex < FrameLength:
-        if (FrameLength - TempStartIndex) >= 64:
-            TempEndIndex = TempStartIndex + 64
-        else:
-            TempEndIndex = FrameLength
-        EncryptedMessageBytes[TempStartIndex:TempEndIndex] = np.bitwise_xor(MessageBytes[TempStartIndex:TempEndIndex], XorArray[0:(TempEndIndex-TempStartIndex)]) 
-        TempStartIndex = TempEndIndex
+    if len(MessageBytes) < FrameLength:
+        raise ValueError('The message is shorter than the frame length: %d < %d' % (len(MessageBytes), FrameLength))
+    MessageArray = np.frombuffer(bytes(MessageBytes[0:FrameLength]), dtype=np.uint8)
+
+    # Use the JIT-compiled kernel if the Numba backend is active (see RS41Backend)
+    if WhiteningKernel is not None:
+        return bytearray(WhiteningKernel(MessageArray, XorArray, BitReverseTable256))
+
+    # The xor mask repeats every 64 bytes
+    EncryptedMessageBytes = np.bitwise_xor(MessageArray, np.resize(XorArray, FrameLength))
     
     # Reverse bits order MSB->LSB, LSB->MSB
     ReversedEncryptedMessageBytes = bytearray(BitReverseTable256[EncryptedMessageBytes])
     return ReversedEncryptedMessageBytes 
 
+# Reverse data whitening: Reverse bits order and Xor the received bytes with the predefined xor mask
+def DataDewhitening(FrameLength, ReversedEncryptedMessageBytes):
+    # Reverse bits order MSB->LSB, LSB->MSB
+    EncryptedMessageBytes = BitReverseTable256[np.frombuffer(bytes(ReversedEncryptedMessageBytes[0:FrameLength]), dtype=np.uint8)]
+    
+    # The xor mask repeats every 64 bytes
+    MessageBytes = bytearray(np.bitwise_xor(EncryptedMessageBytes, np.resize(XorArray, FrameLength)))
+    return MessageBytes
+
 # %% Ambient temperature calculations functions
 ##############################################
 # Ambient temperature calculations functions #
@@ -722,6 +731,9 @@ def CalculateGPSData(SkyfieldSatellites, UTCTime,
     '''
     Calculate GPS data for the RS41 message blocks
     '''   
+    from skyfield.api import load, wgs84
+    import pymap3d
+
     # Define skyfield object
     Obj = wgs84.latlon(GPSLatitudeN, GPSLongitudeE, GPSAltitude)
     ObjTime = load.timescale()
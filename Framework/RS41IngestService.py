@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 asyncio ingestion service
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions read several local receiver #
+# feeds concurrently, in one asyncio event  #
+# loop, and publish the decoded frames to   #
+# subscribers.                              #
+#                                           #
+# A feed carries hex frames, one per line   #
+# (the log file format, see ReadLogFile):   #
+# - A TCP or a UNIX socket of a local       #
+#   demodulator process (reconnected when   #
+#   the connection is lost)                 #
+# - Tailed log files (see RS41LogFollower)  #
+#                                           #
+# The Reed-Solomon correction, CRC checks   #
+# and block parsing run in an executor (a   #
+# process pool by default). Each feed keeps #
+# its frames order, and a bounded number of #
+# frames in decoding: a slow decoder stops  #
+# the reading of the feed (backpressure).   #
+#                                           #
+# Per feed statistics: frames, bad lines,   #
+# decoded frames, connections and the       #
+# latency from a frame's arrival to its     #
+# publishing.                               #
+#                                           #
+# Stand-in feeds replay a log file at a     #
+# configurable speed, for testing.          #
+#                                           #
+# Command line:                             #
+# python RS41IngestService.py               #
+#        [--tcp HOST:PORT] [--unix PATH]    #
+#        [--file PATTERN] [--workers N]     #
+#############################################
+
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import collections
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from RS41LogFollower import *
+
+# Frames read but not published yet, per feed. A full feed queue stops the reading of the feed
+MaxPendingFeedFrames = 64
+
+# Latencies kept per feed, for the latency statistics
+LatencyWindow = 1024
+
+# Reconnection delay of a socket feed [sec]
+FeedReconnectDelay = 1.0
+
+# %% Frame decoding
+##################
+# Frame decoding #
+##################
+
+def DecodeFeedFrame(MessageBytes):
+    '''
+    Decode a feed frame (runs in the service's executor): Reed-Solomon correction, CRC checks and block parsing.
+    The frame length is set by the frame type (see FitFrameLength). Returns (Decoded, Blocks), with Blocks as returned
+    by ParseMessageBlocks
+    '''
+    MessageBytes = FitFrameLength(MessageBytes)
+    try:
+        Decoded = bool(DecodeReedSolomon(MessageBytes))
+    except Exception:
+        Decoded = False
+    return Decoded, ParseMessageBlocks(MessageBytes)
+
+def IgnoreInterrupt():
+    '''
+    Decoder process initializer: a Ctrl-C stops the service, which then shuts down its decoder processes
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# %% Service functions
+######################
+# Service functions #
+######################
+
+def NewIngestService(Executor = None, Workers = None):
+    '''
+    Create the state of an ingestion service. Executor runs DecodeFeedFrame: a concurrent.futures executor,
+    or None for a process pool of Workers processes (default: the number of CPUs), shut down by StopIngestService.
+    The pool's processes are started by a fork server (or spawned), not forked from the service: the pool starts
+    its processes on demand, and forked processes would hold copies of the service's sockets (e.g. of a stand-in
+    feed's connection, that then never ends)
+    '''
+    OwnExecutor = Executor is None
+    if OwnExecutor:
+        StartMethod = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        Executor = concurrent.futures.ProcessPoolExecutor(Workers, mp_context = multiprocessing.get_context(StartMethod),
+                                                              initializer = IgnoreInterrupt)
+    return {'Executor': Executor,
+            'OwnExecutor': OwnExecutor,
+            'Feeds': {},
+            'Subscribers': []}
+
+def NewFeed(FeedName):
+    '''
+    Create the state of a feed: its pending frames queue, tasks and statistics
+    '''
+    return {'FeedName': FeedName,
+            'Pending': asyncio.Queue(MaxPendingFeedFrames),
+            'Tasks': [],
+            'Frames': 0,
+            'BadLines': 0,
+            'Decoded': 0,
+            'Connections': 0,
+            'Errors': 0,
+            'LastError': None,
+            'Latencies': collections.deque(maxlen=LatencyWindow)}
+
+def AddFeed(Service, FeedName, ReaderCoroutine):
+    '''
+    Add a feed to the service, and start its reader and publisher tasks
+    '''
+    if FeedName in Service['Feeds']:
+        raise ValueError('Feed ' + FeedName + ' already exists')
+    Feed = Service['Feeds'][FeedName] = NewFeed(FeedName)
+    Feed['Tasks'].append(asyncio.ensure_future(ReaderCoroutine(Service, Feed)))
+    Feed['Tasks'].append(asyncio.ensure_future(PublishFeedFrames(Service, Feed)))
+    return Feed
+
+async def SubmitFeedFrame(Service, Feed, MessageBytes):
+    '''
+    Submit a feed frame to the executor. Waits while the feed's pending frames queue is full
+    '''
+    ArrivalTime = time.perf_counter()
+    Future = asyncio.get_running_loop().run_in_executor(Service['Executor'], DecodeFeedFrame, MessageBytes)
+    Feed['Frames'] = Feed['Frames'] + 1
+    await Feed['Pending'].put((ArrivalTime, Future))
+
+async def SubmitFeedLine(Service, Feed, Line):
+    '''
+    Parse a feed line (see ParseLogLine), and submit its frame
+    '''
+    MessageBytes = ParseLogLine(Line.strip())
+    if MessageBytes is None:
+        if Line.strip():
+            Feed['BadLines'] = Feed['BadLines'] + 1
+        return
+    await SubmitFeedFrame(Service, Feed, MessageBytes)
+
+async def PublishFeedFrames(Service, Feed):
+    '''
+    Publish the decoded frames of a feed to the subscribers, in the feed's order
+    '''
+    while True:
+        ArrivalTime, Future = await Feed['Pending'].get()
+        try:
+            Decoded, Blocks = await Future
+        except Exception as Error:
+            Feed['Errors'] = Feed['Errors'] + 1
+            Feed['LastError'] = repr(Error)
+            continue
+        Latency = time.perf_counter() - ArrivalTime
+        Feed['Latencies'].append(Latency)
+        Feed['Decoded'] = Feed['Decoded'] + Decoded
+        Telemetry = {'Feed': Feed['FeedName'],
+                     'ArrivalTime': ArrivalTime,
+                     'Latency': Latency,
+                     'Decoded': Decoded,
+                     'Blocks': Blocks}
+        for Subscriber in Service['Subscribers']:
+            PublishTelemetry(Subscriber, Telemetry)
+
+# %% Feed readers
+################
+# Feed readers #
+################
+
+async def ReadFeedStream(Service, Feed, Reader):
+    '''
+    Read the lines of a stream feed, until the stream ends
+    '''
+    while True:
+        try:
+            Line = await Reader.readline()
+        except ValueError:
+            # A line longer than the stream limit is not a frame
+            Feed['BadLines'] = Feed['BadLines'] + 1
+            continue
+        if not(Line):
+            return
+        await SubmitFeedLine(Service, Feed, Line)
+
+def MakeSocketFeedReader(OpenConnection):
+    '''
+    Make the reader coroutine of a socket feed: OpenConnection() opens the (reader, writer) stream pair.
+    The feed is reconnected after FeedReconnectDelay when the connection fails or ends
+    '''
+    async def SocketFeedReader(Service, Feed):
+        while True:
+            try:
+                Reader, Writer = await OpenConnection()
+            except OSError as Error:
+                Feed['LastError'] = repr(Error)
+                await asyncio.sleep(FeedReconnectDelay)
+                continue
+            Feed['Connections'] = Feed['Connections'] + 1
+            try:
+                await ReadFeedStream(Service, Feed, Reader)
+            except (OSError, asyncio.IncompleteReadError) as Error:
+                Feed['LastError'] = repr(Error)
+            finally:
+                Writer.close()
+            await asyncio.sleep(FeedReconnectDelay)
+    return SocketFeedReader
+
+def AddTCPFeed(Service, FeedName, Host, Port):
+    '''
+    Add a TCP socket feed: a connection to a local demodulator process that sends hex frame lines
+    '''
+    return AddFeed(Service, FeedName, MakeSocketFeedReader(
+        lambda: asyncio.open_connection(Host, Port, limit=MaxLogLineLength)))
+
+def AddUNIXFeed(Service, FeedName, Path):
+    '''
+    Add a UNIX socket feed: a connection to a local demodulator process that sends hex frame lines
+    '''
+    return AddFeed(Service, FeedName, MakeSocketFeedReader(
+        lambda: asyncio.open_unix_connection(Path, limit=MaxLogLineLength)))
+
+def AddFileFeed(Service, FeedName, FileNames, PollInterval = 0.2, FromStart = False):
+    '''
+    Add a tailed log files feed (file names and glob patterns, see NewLogFollower). The files are polled
+    in a thread, every PollInterval [sec] when there are no new records
+    '''
+    async def FileFeedReader(Service, Feed):
+        Follower = NewLogFollower(FileNames, None, FromStart)
+        try:
+            while True:
+                Records = await asyncio.to_thread(PollLogFollower, Follower)
+                for FileName, MessageBytes in Records:
+                    await SubmitFeedFrame(Service, Feed, MessageBytes)
+                Feed['BadLines'] = sum(Statistics['BadLines'] for Statistics in GetLogFollowerStatistics(Follower).values())
+                if not(Records):
+                    await asyncio.sleep(PollInterval)
+        finally:
+            CloseLogFollower(Follower)
+    return AddFeed(Service, FeedName, FileFeedReader)
+
+# %% Subscribers and statistics
+##############################
+# Subscribers and statistics #
+##############################
+
+def SubscribeIngestService(Service, MaxQueueLength = 1024):
+    '''
+    Subscribe to the decoded frames of all of the feeds. Returns a subscriber: read its telemetry with
+    GetTelemetry. A telemetry record is a dictionary of Feed, ArrivalTime (time.perf_counter), Latency [sec],
+    Decoded (Reed-Solomon correction succeeded) and Blocks (see ParseMessageBlocks).
+    When the subscriber's queue is full, the oldest records are dropped (and counted)
+    '''
+    Subscriber = {'Queue': asyncio.Queue(MaxQueueLength), 'Dropped': 0}
+    Service['Subscribers'].append(Subscriber)
+    return Subscriber
+
+def UnsubscribeIngestService(Service, Subscriber):
+    '''
+    Remove a subscriber
+    '''
+    Service['Subscribers'].remove(Subscriber)
+
+def PublishTelemetry(Subscriber, Telemetry):
+    '''
+    Put a telemetry record in a subscriber's queue, dropping its oldest record if the queue is full
+    '''
+    if Subscriber['Queue'].full():
+        Subscriber['Queue'].get_nowait()
+        Subscriber['Dropped'] = Subscriber['Dropped'] + 1
+    Subscriber['Queue'].put_nowait(Telemetry)
+
+async def GetTelemetry(Subscriber, Timeout = None):
+    '''
+    Get the next telemetry record of a subscriber. Returns None after Timeout [sec] (None = no limit)
+    '''
+    try:
+        return await asyncio.wait_for(Subscriber['Queue'].get(), Timeout)
+    except asyncio.TimeoutError:
+        return None
+
+def GetIngestServiceStatistics(Service):
+    '''
+    Get the statistics of the feeds: a dictionary: feed name -> dictionary of Frames, BadLines, Decoded,
+    Pending, Connections, Errors, LastError and the latency (from arrival to publishing) over the last
+    LatencyWindow frames: LatencyMean, LatencyP50, LatencyP95, LatencyP99 and LatencyMax [sec]
+    '''
+    Statistics = {}
+    for FeedName, Feed in Service['Feeds'].items():
+        FeedStatistics = {Key: Feed[Key] for Key in ('Frames', 'BadLines', 'Decoded', 'Connections', 'Errors', 'LastError')}
+        FeedStatistics['Pending'] = Feed['Pending'].qsize()
+        Latencies = np.array(Feed['Latencies'])
+        if len(Latencies) > 0:
+            FeedStatistics['LatencyMean'] = float(Latencies.mean())
+            FeedStatistics['LatencyP50'], FeedStatistics['LatencyP95'], FeedStatistics['LatencyP99'] = \
+                (float(Latency) for Latency in np.percentile(Latencies, [50, 95, 99]))
+            FeedStatistics['LatencyMax'] = float(Latencies.max())
+        Statistics[FeedName] = FeedStatistics
+    return Statistics
+
+async def StopIngestService(Service):
+    '''
+    Stop the feeds of a service, and shut down its executor (if created by NewIngestService)
+    '''
+    Tasks = [Task for Feed in Service['Feeds'].values() for Task in Feed['Tasks']]
+    for Task in Tasks:
+        Task.cancel()
+    await asyncio.gather(*Tasks, return_exceptions=True)
+    if Service['OwnExecutor']:
+        Service['Executor'].shutdown(wait=True, cancel_futures=True)
+
+# %% Stand-in feeds
+##################
+# Stand-in feeds #
+##################
+
+def ReadLogLines(LogFileName):
+    '''
+    Read the hex frame lines of a log file
+    '''
+    with open(LogFileName, 'rb') as File:
+        return [Line.rstrip() + b'\n' for Line in File if Line.strip()]
+
+async def WriteLogReplay(Writer, LogLines, FrameInterval, Speed):
+    '''
+    Write log lines to a stream, a line every FrameInterval / Speed [sec] (Speed = 0: no delay)
+    '''
+    StartTime = time.perf_counter()
+    for i, Line in enumerate(LogLines):
+        if Speed > 0:
+            await asyncio.sleep(max(0.0, StartTime + i * FrameInterval / Speed - time.perf_counter()))
+        Writer.write(Line)
+        await Writer.drain()
+
+async def ServeLogReplay(LogFileName, Host = '127.0.0.1', Port = 0, Path = None, Speed = 1.0, FrameInterval = 1.0):
+    '''
+    Start a stand-in demodulator feed: a TCP (or, if Path is given, a UNIX socket) server that replays a log file
+    to each connection, at Speed times the real frame rate (one frame every FrameInterval [sec]), and then closes
+    the connection. Returns the asyncio server (the TCP port is in server.sockets[0].getsockname())
+    '''
+    LogLines = ReadLogLines(LogFileName)
+
+    async def ReplayConnection(Reader, Writer):
+        try:
+            await WriteLogReplay(Writer, LogLines, FrameInterval, Speed)
+        except (OSError, asyncio.CancelledError):
+            pass # The feed disconnected, or the stand-in was stopped
+        finally:
+            Writer.close()
+
+    if Path is not None:
+        return await asyncio.start_unix_server(ReplayConnection, Path)
+    return await asyncio.start_server(ReplayConnection, Host, Port)
+
+async def ReplayLogToFile(LogFileName, OutputFileName, Speed = 1.0, FrameInterval = 1.0):
+    '''
+    A stand-in receiver log: append the lines of a log file to a file, at Speed times the real frame rate
+    '''
+    LogLines = ReadLogLines(LogFileName)
+    StartTime = time.perf_counter()
+    with open(OutputFileName, 'ab', buffering=0) as File:
+        for i, Line in enumerate(LogLines):
+            if Speed > 0:
+                await asyncio.sleep(max(0.0, StartTime + i * FrameInterval / Speed - time.perf_counter()))
+            File.write(Line)
+
+# %% Command line
+################
+# Command line #
+################
+
+async def RunIngestService(TCPFeeds, UNIXFeeds, FileFeeds, Workers = None, StatisticsInterval = 10.0):
+    '''
+    Run an ingestion service: print a line per decoded frame to stdout, and the feed statistics to stderr
+    every StatisticsInterval [sec]
+    '''
+    Service = NewIngestService(Workers = Workers)
+    for HostPort in TCPFeeds:
+        Host, Port = HostPort.rsplit(':', 1)
+        AddTCPFeed(Service, 'tcp:' + HostPort, Host, int(Port))
+    for Path in UNIXFeeds:
+        AddUNIXFeed(Service, 'unix:' + Path, Path)
+    for Pattern in FileFeeds:
+        AddFileFeed(Service, 'file:' + Pattern, [Pattern])
+    Subscriber = SubscribeIngestService(Service)
+    NextStatisticsTime = time.perf_counter() + StatisticsInterval
+    try:
+        while True:
+            Telemetry = await GetTelemetry(Subscriber, StatisticsInterval)
+            if Telemetry is not None:
+                STATUS = Telemetry['Blocks'].get('STATUS')
+                print('%s frame %s %s%s' % (Telemetry['Feed'], STATUS[0] if STATUS else '-', STATUS[1] if STATUS else '-',
+                                            '' if Telemetry['Decoded'] else ' (not decoded)'), flush = True)
+            if time.perf_counter() >= NextStatisticsTime:
+                NextStatisticsTime = time.perf_counter() + StatisticsInterval
+                for FeedName, FeedStatistics in GetIngestServiceStatistics(Service).items():
+                    print('%s: %d frames, %d decoded, %d bad lines, latency p50 %.1f ms, p99 %.1f ms' %
+                          (FeedName, FeedStatistics['Frames'], FeedStatistics['Decoded'], FeedStatistics['BadLines'],
+                           1e3 * FeedStatistics.get('LatencyP50', np.nan), 1e3 * FeedStatistics.get('LatencyP99', np.nan)),
+                          file = sys.stderr)
+    finally:
+        await StopIngestService(Service)
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'Decode RS41 frames from local receiver feeds')
+    Parser.add_argument('--tcp', action = 'append', default = [], help = 'TCP feed HOST:PORT')
+    Parser.add_argument('--unix', action = 'append', default = [], help = 'UNIX socket feed path')
+    Parser.add_argument('--file', action = 'append', default = [], help = 'Tailed log file name or glob pattern')
+    Parser.add_argument('--workers', type = int, help = 'Number of decoding processes. Default: the number of CPUs')
+    Args = Parser.parse_args()
+    if not(Args.tcp or Args.unix or Args.file):
+        Parser.error('No feeds')
+    try:
+        asyncio.run(RunIngestService(Args.tcp, Args.unix, Args.file, Args.workers))
+    except KeyboardInterrupt:
+        pass
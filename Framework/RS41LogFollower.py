@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 receiver log file follower
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions follow growing receiver log #
+# files (hex frames, one per line, as read  #
+# by ReadLogFile), like "tail -F":          #
+# - Per file, the device, inode and byte    #
+#   offset are kept. Each poll reads only   #
+#   the bytes appended since the last poll, #
+#   and parses only the complete lines      #
+# - Rotation (the file name points to a new #
+#   inode): the rest of the old file is     #
+#   read, and the new file is read from its #
+#   start                                   #
+# - Truncation (the file got shorter than   #
+#   the offset): the file is read again     #
+#   from its start                          #
+# - Glob patterns are expanded on each      #
+#   poll, so new log files are followed as  #
+#   they appear                             #
+#############################################
+
+import os
+import glob
+import time
+import collections
+from RS41BlocksRW import *
+
+# Longest partial line kept between polls [bytes]. A longer line is not a log record, and is dropped
+MaxLogLineLength = 8192
+
+# Number of rotated files whose read offsets are kept, so a rotated file that matches a followed glob pattern
+# (e.g. "*.txt*" matching "log.txt.1") is not read twice
+MaxRotatedFiles = 64
+
+# %% Line parsing
+################
+# Line parsing #
+################
+
+def ParseLogLine(Line):
+    '''
+    Parse a log file line (hex bytes separated by spaces) to a message byte array.
+    Returns None for an empty line or a line that is not a log record
+    '''
+    try:
+        MessageBytes = bytearray.fromhex(Line.decode('ascii'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return MessageBytes if len(MessageBytes) > 0 else None
+
+def MakeDecodingFrameHandler(BlocksHandler):
+    '''
+    Make a FrameHandler (see NewLogFollower) that decodes each record: Reed-Solomon correction (when possible)
+    and block parsing. The frame length is set by the frame type (see FitFrameLength).
+    Calls BlocksHandler(FileName, MessageBytes, Decoded, Blocks), with Decoded = the frame was Reed-Solomon
+    corrected and Blocks as returned by ParseMessageBlocks. An uncorrectable frame is parsed as received
+    '''
+    from reedsolo import ReedSolomonError
+
+    def DecodingFrameHandler(FileName, MessageBytes):
+        MessageBytes = FitFrameLength(MessageBytes)
+        try:
+            Decoded = bool(DecodeReedSolomon(MessageBytes))
+        except ReedSolomonError:
+            Decoded = False
+        BlocksHandler(FileName, MessageBytes, Decoded, ParseMessageBlocks(MessageBytes))
+    return DecodingFrameHandler
+
+# %% Follower functions
+#######################
+# Follower functions #
+#######################
+
+def NewLogFollower(FileNames, FrameHandler = None, FromStart = True):
+    '''
+    Create the state of a log file follower.
+    FileNames    = A list of log file names and glob patterns (e.g. "/var/log/rs41/*.txt")
+    FrameHandler = Called as FrameHandler(FileName, MessageBytes) for each new log record (e.g. a function that
+                   Reed-Solomon corrects and parses the frame). If None, PollLogFollower returns the records
+    FromStart    = Read the files found by the first poll from their start. If False, only the lines appended
+                   after the first poll are read. Files that appear later are always read from their start
+    '''
+    return {'FileNames': list(FileNames),
+            'FrameHandler': FrameHandler,
+            'FromStart': FromStart,
+            'FirstPoll': True,
+            'Files': {},
+            'RotatedFiles': collections.OrderedDict()}
+
+def NewFollowedFile(FileName, File, FileStatus, Offset):
+    '''
+    Create the state of a followed file: its open file, identity (device, inode), byte offset and partial last line
+    '''
+    File.seek(Offset)
+    return {'FileName': FileName,
+            'File': File,
+            'Identity': (FileStatus.st_dev, FileStatus.st_ino),
+            'Offset': Offset,
+            'PartialLine': b'',
+            'Frames': 0,
+            'BadLines': 0,
+            'Rotations': 0,
+            'Truncations': 0}
+
+def ReadNewLines(FollowedFile, Records):
+    '''
+    Read the bytes appended to a followed file since the last read, and parse its new complete lines.
+    Appends (FileName, MessageBytes) to Records
+    '''
+    Data = FollowedFile['File'].read()
+    if not(Data):
+        return
+    FollowedFile['Offset'] = FollowedFile['Offset'] + len(Data)
+    Lines = (FollowedFile['PartialLine'] + Data).split(b'\n')
+
+    # The last line is complete only when the data ends with a new line
+    FollowedFile['PartialLine'] = Lines.pop()
+    if len(FollowedFile['PartialLine']) > MaxLogLineLength:
+        FollowedFile['PartialLine'] = b''
+        FollowedFile['BadLines'] = FollowedFile['BadLines'] + 1
+    for Line in Lines:
+        MessageBytes = ParseLogLine(Line)
+        if MessageBytes is None:
+            if Line.strip():
+                FollowedFile['BadLines'] = FollowedFile['BadLines'] + 1
+            continue
+        FollowedFile['Frames'] = FollowedFile['Frames'] + 1
+        Records.append((FollowedFile['FileName'], MessageBytes))
+
+def PollFollowedFile(Follower, FileName, Records):
+    '''
+    Poll a followed file: open it if new, handle rotation and truncation, and read its new lines
+    '''
+    FollowedFile = Follower['Files'].get(FileName)
+    try:
+        FileStatus = os.stat(FileName)
+    except OSError:
+        FileStatus = None # Removed, or being rotated: the open file (if any) is still read
+
+    if FollowedFile is None:
+        if FileStatus is None:
+            return
+        try:
+            File = open(FileName, 'rb')
+        except OSError:
+            return
+        FileStatus = os.fstat(File.fileno())
+        Offset = 0 if (Follower['FromStart'] or not(Follower['FirstPoll'])) else FileStatus.st_size
+        Offset = Follower['RotatedFiles'].pop((FileStatus.st_dev, FileStatus.st_ino), Offset)
+        FollowedFile = Follower['Files'][FileName] = NewFollowedFile(FileName, File, FileStatus, Offset)
+        ReadNewLines(FollowedFile, Records)
+        return
+
+    # Truncation: the file is shorter than what was already read
+    if (FileStatus is not None) and ((FileStatus.st_dev, FileStatus.st_ino) == FollowedFile['Identity']) \
+       and (FileStatus.st_size < FollowedFile['Offset']):
+        FollowedFile['File'].seek(0)
+        FollowedFile['Offset'] = 0
+        FollowedFile['PartialLine'] = b''
+        FollowedFile['Truncations'] = FollowedFile['Truncations'] + 1
+    ReadNewLines(FollowedFile, Records)
+
+    # Rotation: the rest of the old file was read above. The new file is read from its start
+    if (FileStatus is not None) and ((FileStatus.st_dev, FileStatus.st_ino) != FollowedFile['Identity']):
+        try:
+            File = open(FileName, 'rb')
+        except OSError:
+            return
+        FollowedFile['File'].close()
+        Follower['RotatedFiles'][FollowedFile['Identity']] = FollowedFile['Offset'] - len(FollowedFile['PartialLine'])
+        while len(Follower['RotatedFiles']) > MaxRotatedFiles:
+            Follower['RotatedFiles'].popitem(last=False)
+        FileStatus = os.fstat(File.fileno())
+        Counters = {Counter: FollowedFile[Counter] for Counter in ('Frames', 'BadLines', 'Rotations', 'Truncations')}
+        FollowedFile = Follower['Files'][FileName] = NewFollowedFile(FileName, File, FileStatus, 0)
+        FollowedFile.update(Counters)
+        FollowedFile['Rotations'] = FollowedFile['Rotations'] + 1
+        ReadNewLines(FollowedFile, Records)
+
+def PollLogFollower(Follower):
+    '''
+    Read the new log records of all of the followed files. If the follower has a FrameHandler, it is called
+    for each record, and the number of records is returned. Otherwise, a list of (FileName, MessageBytes) is returned
+    '''
+    FileNames = []
+    for FileName in Follower['FileNames']:
+        if glob.has_magic(FileName):
+            FileNames.extend(sorted(glob.glob(FileName)))
+        else:
+            FileNames.append(FileName)
+
+    # Files that are not found any more (e.g. old rotated logs) are read to their end, and closed
+    Records = []
+    for FileName in list(Follower['Files']):
+        if FileName not in FileNames:
+            ReadNewLines(Follower['Files'][FileName], Records)
+            Follower['Files'].pop(FileName)['File'].close()
+    for FileName in dict.fromkeys(FileNames):
+        PollFollowedFile(Follower, FileName, Records)
+    Follower['FirstPoll'] = False
+
+    if Follower['FrameHandler'] is None:
+        return Records
+    for FileName, MessageBytes in Records:
+        Follower['FrameHandler'](FileName, MessageBytes)
+    return len(Records)
+
+def GetLogFollowerStatistics(Follower):
+    '''
+    Get the statistics of the followed files: a dictionary: file name -> dictionary of
+    Offset, Frames, BadLines, Rotations and Truncations
+    '''
+    return {FileName: {Key: FollowedFile[Key] for Key in ('Offset', 'Frames', 'BadLines', 'Rotations', 'Truncations')}
+            for FileName, FollowedFile in Follower['Files'].items()}
+
+def CloseLogFollower(Follower):
+    '''
+    Close the files of a log file follower
+    '''
+    for FollowedFile in Follower['Files'].values():
+        FollowedFile['File'].close()
+    Follower['Files'].clear()
+
+def FollowLogFiles(FileNames, PollInterval = 1.0, FromStart = True):
+    '''
+    Follow log files forever (or until the generator is closed). Yields (FileName, MessageBytes) for each new
+    log record. Polls every PollInterval [sec] when there are no new records
+    '''
+    Follower = NewLogFollower(FileNames, None, FromStart)
+    try:
+        while True:
+            Records = PollLogFollower(Follower)
+            for Record in Records:
+                yield Record
+            if not(Records):
+                time.sleep(PollInterval)
+    finally:
+        CloseLogFollower(Follower)
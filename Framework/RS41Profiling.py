@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 decode path profiling
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions are opt-in profiling hooks  #
+# for the decode path: Reed-Solomon         #
+# correction, block CRC checks, subframes   #
+# loading, calibration math and geodetic    #
+# conversions.                              #
+#                                           #
+# Profiling is off until EnableProfiling()  #
+# is called. While enabled, each profiled   #
+# function is replaced (in every loaded     #
+# module that imported it) by a wrapper     #
+# that counts calls and keeps latencies.    #
+#############################################
+
+import sys
+import json
+import time
+import functools
+import importlib
+import numpy as np
+
+# Profiled stages: stage name -> (module name, function name)
+ProfilingStages = {
+    'DecodeReedSolomon':       ('RS41BlocksRW', 'DecodeReedSolomon'),
+    'CheckSTATUSblockCRC':     ('RS41BlocksRW', 'CheckSTATUSblockCRC'),
+    'CheckMEASblockCRC':       ('RS41BlocksRW', 'CheckMEASblockCRC'),
+    'CheckGPSINFOblockCRC':    ('RS41BlocksRW', 'CheckGPSINFOblockCRC'),
+    'CheckGPSRAWblockCRC':     ('RS41BlocksRW', 'CheckGPSRAWblockCRC'),
+    'CheckGPSPOSblockCRC':     ('RS41BlocksRW', 'CheckGPSPOSblockCRC'),
+    'LoadSubframeDataFromLog': ('RS41SimFunctions', 'LoadSubframeDataFromLog'),
+    'GetPressure':             ('RS41Functions', 'GetPressure'),
+    'GetRelativeHumidity':     ('RS41Functions', 'GetRelativeHumidity'),
+    'ecef2geodetic':           ('pymap3d', 'ecef2geodetic'),
+    'geodetic2ecef':           ('pymap3d', 'geodetic2ecef'),
+    'ecef2enuv':               ('pymap3d', 'ecef2enuv'),
+    'enu2aer':                 ('pymap3d', 'enu2aer'),
+}
+
+# Number of latest latencies kept per stage for the percentiles calculation
+ProfilingSampleSize = 4096
+
+# Stage counters: stage name -> [Calls, TotalTime [ns], Latencies [ns] ring buffer]
+ProfilingCounters = {}
+
+# Replaced functions, for restoring: list of (module, attribute name, original function)
+ProfilingPatches = []
+
+def MakeProfiledFunction(StageCounters, Function):
+    '''
+    Wrap a function with a call counter and a latency recorder
+    '''
+    Latencies = StageCounters[2]
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(Function)
+    def ProfiledFunction(*args, **kwargs):
+        StartTime = perf_counter_ns()
+        try:
+            return Function(*args, **kwargs)
+        finally:
+            Latency = perf_counter_ns() - StartTime
+            Latencies[StageCounters[0] % ProfilingSampleSize] = Latency
+            StageCounters[0] += 1
+            StageCounters[1] += Latency
+    ProfiledFunction.RS41ProfiledFunction = Function
+    return ProfiledFunction
+
+def EnableProfiling(Stages = None):
+    '''
+    Enable profiling of the decode path stages. Stages is a list of stage names from ProfilingStages. Default: all stages
+    '''
+    if Stages is None:
+        Stages = list(ProfilingStages)
+    for Stage in Stages:
+        ModuleName, FunctionName = ProfilingStages[Stage]
+        Module = importlib.import_module(ModuleName)
+        Function = getattr(Module, FunctionName)
+        if hasattr(Function, 'RS41ProfiledFunction'):
+            continue # Already profiled
+
+        StageCounters = ProfilingCounters.setdefault(Stage, [0, 0, [0] * ProfilingSampleSize])
+        ProfiledFunction = MakeProfiledFunction(StageCounters, Function)
+
+        # The framework modules use star imports, so each module holds its own reference
+        # to the function. Replace the function wherever it is referenced
+        for LoadedModule in list(sys.modules.values()):
+            if getattr(LoadedModule, FunctionName, None) is Function:
+                setattr(LoadedModule, FunctionName, ProfiledFunction)
+                ProfilingPatches.append((LoadedModule, FunctionName, Function))
+
+def DisableProfiling():
+    '''
+    Disable profiling and restore the original functions. The counters are kept
+    '''
+    while ProfilingPatches:
+        LoadedModule, FunctionName, Function = ProfilingPatches.pop()
+        setattr(LoadedModule, FunctionName, Function)
+
+def ResetProfiling():
+    '''
+    Reset the profiling counters
+    '''
+    for StageCounters in ProfilingCounters.values():
+        StageCounters[0] = 0
+        StageCounters[1] = 0
+
+def GetProfilingSnapshot():
+    '''
+    Get a snapshot of the profiling counters. Returns a dictionary: stage name -> calls, total time in [ms],
+    and mean, 50th, 90th and 99th percentile and maximal latencies in [us]
+    '''
+    Snapshot = {}
+    for Stage, (Calls, TotalTime, Latencies) in ProfilingCounters.items():
+        if Calls == 0:
+            continue
+        Samples = np.array(Latencies[:min(Calls, ProfilingSampleSize)], dtype=np.float64) / 1000 # [us]
+        P50, P90, P99 = np.percentile(Samples, [50, 90, 99])
+        Snapshot[Stage] = {'calls': Calls,
+                           'total_ms': TotalTime / 1e6,
+                           'mean_us': TotalTime / Calls / 1000,
+                           'p50_us': P50,
+                           'p90_us': P90,
+                           'p99_us': P99,
+                           'max_us': Samples.max()}
+    return Snapshot
+
+def ProfilingSnapshotToJSON(Snapshot = None):
+    '''
+    Format a profiling snapshot as JSON. Default: a snapshot of the current counters
+    '''
+    if Snapshot is None:
+        Snapshot = GetProfilingSnapshot()
+    return json.dumps(Snapshot, indent = 2)
+
+def ProfilingSnapshotToTable(Snapshot = None):
+    '''
+    Format a profiling snapshot as a text table, sorted by total time. Default: a snapshot of the current counters
+    '''
+    if Snapshot is None:
+        Snapshot = GetProfilingSnapshot()
+    Lines = ['Stage'.ljust(24) + 'Calls'.rjust(9) + 'Total [ms]'.rjust(12) + 'Mean [us]'.rjust(11)
+             + 'P50 [us]'.rjust(11) + 'P90 [us]'.rjust(11) + 'P99 [us]'.rjust(11) + 'Max [us]'.rjust(11)]
+    for Stage, Counters in sorted(Snapshot.items(), key=lambda item: -item[1]['total_ms']):
+        Lines.append(Stage.ljust(24) + str(Counters['calls']).rjust(9) + ('%.2f' % Counters['total_ms']).rjust(12)
+                     + ('%.1f' % Counters['mean_us']).rjust(11) + ('%.1f' % Counters['p50_us']).rjust(11)
+                     + ('%.1f' % Counters['p90_us']).rjust(11) + ('%.1f' % Counters['p99_us']).rjust(11)
+                     + ('%.1f' % Counters['max_us']).rjust(11))
+    return '\n'.join(Lines)
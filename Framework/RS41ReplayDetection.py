@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 replay attack detection
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions detect replayed flights: a  #
+# new transmission built from an archived   #
+# flight log, possibly with a rewritten     #
+# radiosonde ID, frequency and GPS blocks.  #
+#                                           #
+# A replay keeps the data that the spoofer  #
+# can't easily synthesize:                  #
+# 1. The sensors' calibration coefficients  #
+#    in the subframes array                 #
+# 2. The raw MEAS block counters, which     #
+#    are unique to each flight              #
+#                                           #
+# A replay index holds fingerprints (hash   #
+# values) of both, for all of the archived  #
+# flights. Each new frame is checked with   #
+# a constant number of hash table lookups.  #
+#############################################
+
+import struct
+import hashlib
+import numpy as np
+from RS41BlocksRW import *
+from RS41SimFunctions import *
+
+# Calibration regions of the subframes array: (start address, end address + 1).
+# Only the coefficients that are calibrated per radiosonde are used: temperature, humidity, heater temperature
+# and pressure calibration coefficients. The polynomial and correction coefficients are the same for all of
+# the radiosondes of a model, and the frequency, serial numbers and flight state fields are rewritten by a spoofer
+ReplayCalibrationRegions = [(0x059, 0x065), (0x075, 0x07D), (0x131, 0x13D), (0x25E, 0x2A6)]
+
+# Minimal number of calibration bytes in a subframe, for checking the subframe on its own
+ReplayMinSubframeCalibrationBytes = 4
+
+def GetSubframeCalibrationRanges(Subframe):
+    '''
+    Get the calibration byte ranges of a subframe: a list of (start, end + 1) offsets within the subframe
+    '''
+    Ranges = []
+    for Start, End in ReplayCalibrationRegions:
+        RangeStart = max(Start, Subframe*16) - Subframe*16
+        RangeEnd = min(End, (Subframe+1)*16) - Subframe*16
+        if RangeStart < RangeEnd:
+            Ranges.append((RangeStart, RangeEnd))
+    return Ranges
+
+# Calibration subframes: subframe number -> calibration byte ranges within the subframe
+ReplayCalibrationSubframes = {Subframe: GetSubframeCalibrationRanges(Subframe) for Subframe in range(51)
+                              if sum(End - Start for Start, End in GetSubframeCalibrationRanges(Subframe)) >= ReplayMinSubframeCalibrationBytes}
+
+# Rolling hash parameters: a polynomial hash modulo a Mersenne prime
+RollingHashModulus = (1 << 61) - 1
+RollingHashBase = 0x1F3D5B79A2C4E687 % RollingHashModulus
+
+# %% Fingerprint functions
+#########################
+# Fingerprint functions #
+#########################
+
+def GetFingerprint(Data):
+    '''
+    Get a 61 bit fingerprint (hash value) of a bytes object
+    '''
+    return int.from_bytes(hashlib.blake2b(Data, digest_size=8).digest(), byteorder='little') % RollingHashModulus
+
+def GetCalibrationFingerprint(SubFrameArray):
+    '''
+    Get the fingerprint of the calibration regions of a RS41 subframes array
+    '''
+    return GetFingerprint(b''.join(bytes(SubFrameArray[Start:End]) for Start, End in ReplayCalibrationRegions))
+
+def GetCalibrationSubframeFingerprint(Subframe, SubFrameBytes):
+    '''
+    Get the fingerprint of the calibration bytes of a subframe. Returns None for a non-calibration subframe, or if
+    the calibration bytes are all zeros (e.g. the pressure coefficients of a radiosonde without a pressure sensor)
+    '''
+    if Subframe not in ReplayCalibrationSubframes:
+        return None
+    CalibrationBytes = b''.join(bytes(SubFrameBytes[Start:End]) for Start, End in ReplayCalibrationSubframes[Subframe])
+    if not(any(CalibrationBytes)):
+        return None
+    return GetFingerprint(bytes([Subframe]) + CalibrationBytes)
+
+def GetMEASFingerprint(MessageBytes):
+    '''
+    Get the fingerprint of the MEAS block counters of a RS41 message byte array
+    '''
+    MEASblock = ReadMEASblock(MessageBytes)
+    return GetFingerprint(struct.pack('<12Ih', *MEASblock[0:12], int(round(MEASblock[12] * 100))))
+
+# %% Replay index functions
+##########################
+# Replay index functions #
+##########################
+# A replay index is a dictionary of hash tables. Each table maps a fingerprint to (flight number, frame number):
+# 'Calibration':          Calibration regions fingerprint -> (flight number, -1)
+# 'CalibrationSubframes': Calibration subframe fingerprint -> (flight number, subframe number)
+# 'MEAS':                 MEAS counters fingerprint -> (flight number, frame number)
+# 'Sequences':            Rolling hash of WindowLength consecutive MEAS fingerprints -> (flight number, last frame number)
+
+ReplayIndexTables = ['Calibration', 'CalibrationSubframes', 'MEAS', 'Sequences']
+
+def NewReplayIndex(WindowLength = 8):
+    '''
+    Create an empty replay index. WindowLength is the number of consecutive frames in each MEAS sequence
+    '''
+    ReplayIndex = {'WindowLength': WindowLength, 'FlightNames': []}
+    for Table in ReplayIndexTables:
+        ReplayIndex[Table] = {}
+    return ReplayIndex
+
+def AddFlightToReplayIndex(ReplayIndex, FlightName, SubFrameArray, Messages):
+    '''
+    Add a flight to a replay index. SubFrameArray is the flight's subframes array (None if it wasn't loaded), and
+    Messages is a list of the flight's message byte arrays, after Reed-Solomon correction. Returns the flight number
+    '''
+    FlightNumber = len(ReplayIndex['FlightNames'])
+    ReplayIndex['FlightNames'].append(FlightName)
+
+    # Index the calibration data
+    if SubFrameArray is not None:
+        ReplayIndex['Calibration'][GetCalibrationFingerprint(SubFrameArray)] = (FlightNumber, -1)
+        for Subframe in ReplayCalibrationSubframes:
+            Fingerprint = GetCalibrationSubframeFingerprint(Subframe, SubFrameArray[(Subframe*16):((Subframe+1)*16)])
+            if Fingerprint is not None:
+                ReplayIndex['CalibrationSubframes'][Fingerprint] = (FlightNumber, Subframe)
+
+    # Index the MEAS fingerprints, and the rolling hashes of the MEAS sequences
+    ReplayTracker = NewReplayTracker(ReplayIndex)
+    for MessageBytes in Messages:
+        if not(CheckMEASblockCRC(MessageBytes) and CheckSTATUSblockCRC(MessageBytes)):
+            continue
+        FrameNumber = GetFrameNumber(MessageBytes)
+        Fingerprint = GetMEASFingerprint(MessageBytes)
+        ReplayIndex['MEAS'].setdefault(Fingerprint, (FlightNumber, FrameNumber))
+        SequenceHash = UpdateReplayTracker(ReplayTracker, FrameNumber, Fingerprint)
+        if SequenceHash is not None:
+            ReplayIndex['Sequences'].setdefault(SequenceHash, (FlightNumber, FrameNumber))
+    return FlightNumber
+
+def AddLogToReplayIndex(ReplayIndex, LogFileName, FlightName = None):
+    '''
+    Add a RS41 log file to a replay index. Default flight name: the log file name. Returns the flight number
+    '''
+    LoggedMessagesLength, LoggedMessages = ReadLogFile(LogFileName)
+    SubFrameArray = bytearray(51*16) # 51*16 bytes
+    LoadSuccess, _ = LoadSubframeDataFromLog(51, LoggedMessagesLength, LoggedMessages, SubFrameArray, bytearray(1024))
+
+    Messages = []
+    for i in range(LoggedMessagesLength):
+        MessageBytes = bytearray(1024)
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        try:
+            DecodeReedSolomon(MessageBytes)
+        except Exception:
+            pass
+        Messages.append(MessageBytes)
+    return AddFlightToReplayIndex(ReplayIndex, LogFileName if FlightName is None else FlightName,
+                                  SubFrameArray if LoadSuccess else None, Messages)
+
+def SaveReplayIndex(ReplayIndex, FileName):
+    '''
+    Save a replay index to a NumPy .npz file
+    '''
+    Arrays = {'WindowLength': np.int64(ReplayIndex['WindowLength']),
+              'FlightNames': np.array(ReplayIndex['FlightNames'], dtype=str)}
+    for Table in ReplayIndexTables:
+        Arrays[Table + 'Keys'] = np.fromiter(ReplayIndex[Table].keys(), dtype=np.uint64, count=len(ReplayIndex[Table]))
+        Arrays[Table + 'Values'] = np.array(list(ReplayIndex[Table].values()), dtype=np.int32).reshape(-1, 2)
+    np.savez_compressed(FileName, **Arrays)
+
+def LoadReplayIndex(FileName):
+    '''
+    Load a replay index from a NumPy .npz file
+    '''
+    with np.load(FileName, allow_pickle=False) as Arrays:
+        ReplayIndex = NewReplayIndex(int(Arrays['WindowLength']))
+        ReplayIndex['FlightNames'] = Arrays['FlightNames'].tolist()
+        for Table in ReplayIndexTables:
+            ReplayIndex[Table] = dict(zip(Arrays[Table + 'Keys'].tolist(), map(tuple, Arrays[Table + 'Values'].tolist())))
+    return ReplayIndex
+
+# %% Replay check functions
+##########################
+# Replay check functions #
+##########################
+
+def NewReplayTracker(ReplayIndex):
+    '''
+    Create the state of a checked transmission: the last MEAS fingerprints and their rolling hash
+    '''
+    WindowLength = ReplayIndex['WindowLength']
+    return {'WindowLength': WindowLength,
+            'OutgoingFactor': pow(RollingHashBase, WindowLength - 1, RollingHashModulus),
+            'Fingerprints': [],
+            'SequenceHash': 0,
+            'LastFrameNumber': None}
+
+def UpdateReplayTracker(ReplayTracker, FrameNumber, Fingerprint):
+    '''
+    Add a frame's MEAS fingerprint to a replay tracker. Returns the rolling hash of the last WindowLength
+    consecutive frames, or None if fewer consecutive frames were added
+    '''
+    # A missing frame breaks the sequence. Only the frame numbers difference is used, as a spoofer may offset them
+    Fingerprints = ReplayTracker['Fingerprints']
+    if (ReplayTracker['LastFrameNumber'] is None) or (FrameNumber != ((ReplayTracker['LastFrameNumber'] + 1) & 0xFFFF)):
+        Fingerprints.clear()
+        ReplayTracker['SequenceHash'] = 0
+    ReplayTracker['LastFrameNumber'] = FrameNumber
+
+    # Remove the oldest fingerprint and add the new one
+    SequenceHash = ReplayTracker['SequenceHash']
+    if len(Fingerprints) == ReplayTracker['WindowLength']:
+        SequenceHash = SequenceHash - Fingerprints.pop(0) * ReplayTracker['OutgoingFactor']
+    SequenceHash = (SequenceHash * RollingHashBase + Fingerprint) % RollingHashModulus
+    Fingerprints.append(Fingerprint)
+    ReplayTracker['SequenceHash'] = SequenceHash
+    return SequenceHash if len(Fingerprints) == ReplayTracker['WindowLength'] else None
+
+def CheckFrameForReplay(ReplayIndex, ReplayTracker, MessageBytes):
+    '''
+    Check a RS41 message byte array (after Reed-Solomon correction) against a replay index.
+    Returns a list of matches. Each match is (match type, flight name, archived frame or subframe number).
+    Match types, from the strongest to the weakest:
+    'Sequence'            = The last WindowLength frames' MEAS counters match consecutive archived frames
+    'MEAS'                = The frame's MEAS counters match an archived frame
+    'CalibrationSubframe' = The frame's subframe matches an archived flight's calibration subframe
+    '''
+    Matches = []
+    if not(CheckSTATUSblockCRC(MessageBytes)):
+        return Matches
+
+    # Check the subframe
+    Subframe = GetSubframe(MessageBytes)
+    Fingerprint = GetCalibrationSubframeFingerprint(Subframe, GetSubFrameBytes(MessageBytes))
+    if Fingerprint in ReplayIndex['CalibrationSubframes']:
+        FlightNumber, ArchivedSubframe = ReplayIndex['CalibrationSubframes'][Fingerprint]
+        Matches.append(('CalibrationSubframe', ReplayIndex['FlightNames'][FlightNumber], ArchivedSubframe))
+
+    # Check the MEAS counters and the MEAS sequence
+    if CheckMEASblockCRC(MessageBytes):
+        Fingerprint = GetMEASFingerprint(MessageBytes)
+        SequenceHash = UpdateReplayTracker(ReplayTracker, GetFrameNumber(MessageBytes), Fingerprint)
+        if Fingerprint in ReplayIndex['MEAS']:
+            FlightNumber, ArchivedFrameNumber = ReplayIndex['MEAS'][Fingerprint]
+            Matches.insert(0, ('MEAS', ReplayIndex['FlightNames'][FlightNumber], ArchivedFrameNumber))
+        if SequenceHash in ReplayIndex['Sequences']:
+            FlightNumber, ArchivedFrameNumber = ReplayIndex['Sequences'][SequenceHash]
+            Matches.insert(0, ('Sequence', ReplayIndex['FlightNames'][FlightNumber], ArchivedFrameNumber))
+    return Matches
+
+def CheckSubFrameArrayForReplay(ReplayIndex, SubFrameArray):
+    '''
+    Check a complete RS41 subframes array against a replay index. Returns the name of the archived flight
+    with the same calibration data, or None
+    '''
+    Match = ReplayIndex['Calibration'].get(GetCalibrationFingerprint(SubFrameArray))
+    return None if Match is None else ReplayIndex['FlightNames'][Match[0]]
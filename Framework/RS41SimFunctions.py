@@ -15,16 +15,26 @@ RS41 simulation functions
 
 import csv
 import numpy as np
-import scipy.signal as signal
 import math
 from RS41BlocksRW import *
-import pymap3d
+
+# scipy.signal and pymap3d are imported inside the functions that use them,
+# so importing this module for log operations doesn't load them
 
 def AccessBit(data, num):
     base = int(num // 8)
     shift = 7 - int(num % 8)
     return (data[base] & (0x01 << shift)) >> shift
 
+# Get the first NumOfBits bits of a byte array, MSB first (as AccessBit)
+def GetBitStream(data, NumOfBits):
+    DataArray = np.frombuffer(bytes(data[0:((NumOfBits + 7) // 8)]), dtype=np.uint8)
+    
+    # Use the JIT-compiled kernel if the Numba backend is active (see RS41Backend)
+    if BitStreamKernel is not None:
+        return BitStreamKernel(DataArray, NumOfBits)
+    return np.unpackbits(DataArray)[0:NumOfBits]
+
 # Open a log file and read its contents
 def ReadLogFile(LogFileName):
     with open(LogFileName, newline = '') as file:
@@ -116,6 +126,7 @@ def FindCreteriaInMessage(MessageBytes, Criteria, CriteriaValue):
             ECEFPositionZ = GetECEFPositionZ(MessageBytes)
     
             # Convert ECEF coordinates to GPS geodetic
+            import pymap3d
             GPSLatitudeN, GPSLongitudeE, GPSAltitude = pymap3d.ecef2geodetic(ECEFPositionX, ECEFPositionY, ECEFPositionZ)
 
             # Check if the altitude criteria is met 
@@ -157,18 +168,74 @@ def SetupRFMessage(RFMessageNumOfBytes, TxDataBytesLength, FrequencyStart, DataR
     byte_array[15:16] = Power.to_bytes(1, 'big', signed =True)
     return byte_array
 
-# Build the wave data from the TxDataBytes and wave paramters
-def BuildAudioStream(TxDataBytes, TxDataBytesLength, SampleRateMultipliler, DataRate, SamplesRate):
+# The GFSK shaping filters, by (DataRate, SamplesRate). See GetShapingFilter
+ShapingFilters = {}
+
+# Get the GFSK shaping low pass filter coefficients. The filter is designed once per data rate and sample rate
+def GetShapingFilter(DataRate, SamplesRate):
+    if (DataRate, SamplesRate) not in ShapingFilters:
+        import scipy.signal as signal
+        filt_order = 2
+        filt_low = DataRate / (0.5 * SamplesRate)
+        ShapingFilters[(DataRate, SamplesRate)] = signal.butter(filt_order, filt_low, btype='low')
+    return ShapingFilters[(DataRate, SamplesRate)]
+
+# Build the wave data from the TxDataBytes and wave paramters.
+# If OutputBuffer (a float32 array) is given, the wave data is written to its start, and a view of it is returned
+def BuildAudioStream(TxDataBytes, TxDataBytesLength, SampleRateMultipliler, DataRate, SamplesRate, OutputBuffer = None):
     # Build the bit stream that will be converted to WAV data
-    BaseBitStream = [AccessBit(TxDataBytes,i) for i in range(TxDataBytesLength*8)]
-    FinalBitStream = [BaseBitStream[round(i/SampleRateMultipliler)-1] for i in range(math.floor(len(BaseBitStream)*SampleRateMultipliler))]
+    BaseBitStream = GetBitStream(TxDataBytes, TxDataBytesLength*8)
+
+    # Resample the bit stream: sample i is bit round(i/SampleRateMultipliler)-1 (sample 0 is the last bit)
+    SampleIndexes = np.rint(np.arange(math.floor(len(BaseBitStream)*SampleRateMultipliler)) / SampleRateMultipliler).astype(np.int64) - 1
     
     # Generate the WAV data
-    BinaryWaveData = [(FinalBitStream[i]-0.5) for i in range(len(FinalBitStream))]
+    BinaryWaveData = BaseBitStream[SampleIndexes] - 0.5
     
-    # Calculate low pass filter. The low pass filtering is shaping the signal as GFSK
-    filt_order = 2
-    filt_low = DataRate / (0.5 * SamplesRate)
-    filt_b, filt_a = signal.butter(filt_order, filt_low, btype='low')
-    WaveData = (signal.lfilter(filt_b, filt_a, BinaryWaveData)).astype(np.float32)
-    return WaveData
\ No newline at end of file
+    # Low pass filter. The low pass filtering is shaping the signal as GFSK
+    import scipy.signal as signal
+    filt_b, filt_a = GetShapingFilter(DataRate, SamplesRate)
+    WaveData = signal.lfilter(filt_b, filt_a, BinaryWaveData)
+    if OutputBuffer is None:
+        return WaveData.astype(np.float32)
+    OutputBuffer[0:len(WaveData)] = WaveData
+    return OutputBuffer[0:len(WaveData)]
+
+# Get the number of wave data samples BuildAudioStream builds for TxDataBytesLength bytes
+def GetAudioStreamLength(TxDataBytesLength, SampleRateMultipliler):
+    return math.floor(TxDataBytesLength*8*SampleRateMultipliler)
+
+# Build the wave data of several TxDataBytes (e.g. a test corpus of frames) in one preallocated float32 array.
+# The streams are separated (and followed) by GapSamples zero samples. Returns the array and the start sample of each stream
+def BuildAudioStreams(TxDataBytesList, SampleRateMultipliler, DataRate, SamplesRate, GapSamples = 0):
+    StreamLengths = [GetAudioStreamLength(len(TxDataBytes), SampleRateMultipliler) for TxDataBytes in TxDataBytesList]
+    WaveData = np.zeros(sum(StreamLengths) + GapSamples*(len(StreamLengths)+1), dtype=np.float32)
+    StreamStarts = []
+    Position = 0
+    for TxDataBytes, StreamLength in zip(TxDataBytesList, StreamLengths):
+        Position = Position + GapSamples
+        StreamStarts.append(Position)
+        BuildAudioStream(TxDataBytes, len(TxDataBytes), SampleRateMultipliler, DataRate, SamplesRate, WaveData[Position:Position+StreamLength])
+        Position = Position + StreamLength
+    return WaveData, StreamStarts
+
+# Write the wave data of several TxDataBytes to a 16 bit mono WAV file, one stream at a time.
+# The streams are separated (and followed) by GapSamples zero samples. Returns the start sample of each stream
+def WriteAudioStreamsToWaveFile(WaveFileName, TxDataBytesList, SampleRateMultipliler, DataRate, SamplesRate, GapSamples = 0):
+    import wave
+    StreamStarts = []
+    Position = 0
+    with wave.open(WaveFileName, 'wb') as WaveFile:
+        WaveFile.setnchannels(1)
+        WaveFile.setsampwidth(2)
+        WaveFile.setframerate(int(SamplesRate))
+        Gap = np.zeros(GapSamples, dtype=np.int16).tobytes()
+        for TxDataBytes in TxDataBytesList:
+            WaveData = BuildAudioStream(TxDataBytes, len(TxDataBytes), SampleRateMultipliler, DataRate, SamplesRate)
+            WaveFile.writeframes(Gap)
+            StreamStarts.append(Position + GapSamples)
+            # The wave data is +/-0.5 (with some shaping overshoot): full scale is +/-1.0
+            WaveFile.writeframes(np.clip(np.round(WaveData * 32767), -32768, 32767).astype('<i2').tobytes())
+            Position = Position + GapSamples + len(WaveData)
+        WaveFile.writeframes(Gap)
+    return StreamStarts
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 batched telemetry upload client
+"""
+
+#############################################
+# The following functions are a part of an  #
+# RS41-SG/P radiosonde simulation framework.#
+# The functions forward decoded telemetry   #
+# (positions and PTU) to an HTTP collector. #
+#                                           #
+# - Enqueueing a record never blocks: the   #
+#   records are kept in a bounded queue     #
+#   (the oldest are dropped when it's full) #
+#   and uploaded by a background thread     #
+# - The records are batched by time and by  #
+#   size: a batch is sent when it's full,   #
+#   or BatchInterval after its first record #
+# - A batch is one POST of gzip compressed  #
+#   NDJSON (a JSON record per line), on one #
+#   persistent HTTP/1.1 connection          #
+# - A failed batch is retried with an       #
+#   exponential backoff, while new records  #
+#   keep queueing up                        #
+# - A record that can't be serialized (e.g. #
+#   a NaN value) is dropped, and an error   #
+#   doesn't stop the upload thread          #
+#                                           #
+# A stand-in collector (a local HTTP        #
+# server that counts the records) is        #
+# included, for testing.                    #
+#############################################
+
+import gzip
+import json
+import time
+import threading
+import collections
+import http.client
+import http.server
+import urllib.parse
+import numpy as np
+
+# The columns of a decoded flight (see FlightColumns) that are uploaded
+UploadColumns = ['FrameNumber', 'RadiosondeID', 'GPSWeek', 'GPSMilliseconds', 'Latitude', 'Longitude', 'Altitude',
+                 'ECEFVelocityX', 'ECEFVelocityY', 'ECEFVelocityZ', 'NumberOfSVs', 'Temperature', 'Pressure',
+                 'RelativeHumidity', 'BatteryVoltage']
+
+# HTTP statuses of a batch that is retried. Other error statuses reject the batch
+RetryHTTPStatuses = {408, 429, 500, 502, 503, 504}
+
+# %% Upload records
+##################
+# Upload records #
+##################
+
+def GetUploadRecord(Columns, Index):
+    '''
+    Get the upload record of a frame of a decoded flight (see DecodeFlight): a dictionary of the frame's
+    UploadColumns, without the values that are not available (NaN)
+    '''
+    Record = {}
+    for Name in UploadColumns:
+        Value = Columns[Name][Index]
+        if isinstance(Value, np.floating):
+            if np.isnan(Value):
+                continue
+            Value = float(Value)
+        elif isinstance(Value, np.integer):
+            Value = int(Value)
+        elif isinstance(Value, np.str_):
+            Value = str(Value)
+        Record[Name] = Value
+    return Record
+
+def GetBlocksUploadRecord(Blocks):
+    '''
+    Get the upload record of a parsed frame (see ParseMessageBlocks): the STATUS and GPSPOS values.
+    Returns None if the frame has neither
+    '''
+    Record = {}
+    if 'STATUS' in Blocks:
+        STATUS = Blocks['STATUS']
+        Record.update({'FrameNumber': int(STATUS[0]), 'RadiosondeID': str(STATUS[1]), 'BatteryVoltage': float(STATUS[2])})
+    if 'GPSPOS' in Blocks:
+        GPSPOS = Blocks['GPSPOS']
+        Record.update({'ECEFPositionX': float(GPSPOS[0]), 'ECEFPositionY': float(GPSPOS[1]), 'ECEFPositionZ': float(GPSPOS[2]),
+                       'ECEFVelocityX': float(GPSPOS[3]), 'ECEFVelocityY': float(GPSPOS[4]), 'ECEFVelocityZ': float(GPSPOS[5]),
+                       'NumberOfSVs': int(GPSPOS[6])})
+    return Record if Record else None
+
+def GetJSONValue(Value):
+    '''
+    Get a JSON serializable value of a NumPy scalar (a json.dumps default function)
+    '''
+    if isinstance(Value, np.generic):
+        return Value.item()
+    raise TypeError('Object of type %s is not JSON serializable' % type(Value).__name__)
+
+# %% Uploader functions
+#######################
+# Uploader functions #
+#######################
+
+def NewTelemetryUploader(URL, BatchInterval = 1.0, MaxBatchRecords = 500, MaxBatchBytes = 1 << 20,
+                         MaxQueueRecords = 10000, MaxRetries = 5, RetryDelay = 0.5,
+                         Timeout = 10.0, CompressionLevel = 6):
+    '''
+    Create a telemetry uploader to an HTTP collector URL, and start its upload thread.
+    BatchInterval     = The longest time a record waits for its batch to fill [sec]
+    MaxBatchRecords   = Records per batch
+    MaxBatchBytes     = Uncompressed NDJSON bytes per batch
+    MaxQueueRecords   = Records waiting for a batch (also while a batch is retried). When full, the oldest records
+                        are dropped
+    MaxRetries        = Retries of a batch. The retry delay is RetryDelay, doubled after each retry
+    '''
+    ParsedURL = urllib.parse.urlsplit(URL)
+    if ParsedURL.scheme not in ('http', 'https'):
+        raise ValueError('Unsupported collector URL: ' + URL)
+    Uploader = {'Scheme': ParsedURL.scheme,
+                'Host': ParsedURL.hostname,
+                'Port': ParsedURL.port,
+                'Path': (ParsedURL.path or '/') + ('?' + ParsedURL.query if ParsedURL.query else ''),
+                'BatchInterval': BatchInterval,
+                'MaxBatchRecords': MaxBatchRecords,
+                'MaxBatchBytes': MaxBatchBytes,
+                'MaxRetries': MaxRetries,
+                'RetryDelay': RetryDelay,
+                'Timeout': Timeout,
+                'CompressionLevel': CompressionLevel,
+                'Records': collections.deque(maxlen=MaxQueueRecords),
+                'Condition': threading.Condition(),
+                'Connection': None,
+                'Sending': False,
+                'Closing': False,
+                'Statistics': {'Enqueued': 0, 'Uploaded': 0, 'DroppedRecords': 0, 'DroppedBatches': 0,
+                               'RejectedBatches': 0, 'Batches': 0, 'Requests': 0, 'Retries': 0, 'Connections': 0,
+                               'UncompressedBytes': 0, 'CompressedBytes': 0, 'LastError': None}}
+    Uploader['Thread'] = threading.Thread(target=UploadLoop, args=(Uploader,), name='TelemetryUploader', daemon=True)
+    Uploader['Thread'].start()
+    return Uploader
+
+def EnqueueTelemetry(Uploader, Record):
+    '''
+    Enqueue a telemetry record (a JSON serializable dictionary, see GetUploadRecord). Never blocks:
+    if the queue is full, its oldest record is dropped. A record that can't be serialized (NaN values included)
+    is dropped when its batch is collected
+    '''
+    with Uploader['Condition']:
+        if len(Uploader['Records']) == Uploader['Records'].maxlen:
+            Uploader['Statistics']['DroppedRecords'] += 1
+        Uploader['Records'].append(Record)
+        Uploader['Statistics']['Enqueued'] += 1
+        if len(Uploader['Records']) >= Uploader['MaxBatchRecords']:
+            Uploader['Condition'].notify_all()
+
+def EnqueueFlightColumns(Uploader, Columns):
+    '''
+    Enqueue the frames of a decoded flight (see DecodeFlight) that have a STATUS block
+    '''
+    for Index in np.flatnonzero(Columns['STATUSOK']):
+        EnqueueTelemetry(Uploader, GetUploadRecord(Columns, Index))
+
+def FlushTelemetryUploader(Uploader, Timeout = None):
+    '''
+    Wait until the enqueued records are uploaded (or dropped). Returns False after Timeout [sec]
+    '''
+    EndTime = None if Timeout is None else time.monotonic() + Timeout
+    with Uploader['Condition']:
+        Uploader['Condition'].notify_all()
+        while Uploader['Records'] or Uploader['Sending']:
+            Wait = None if EndTime is None else EndTime - time.monotonic()
+            if (Wait is not None) and (Wait <= 0):
+                return False
+            Uploader['Condition'].wait(Wait)
+    return True
+
+def CloseTelemetryUploader(Uploader, Timeout = 10.0):
+    '''
+    Upload the enqueued records (up to Timeout [sec]), and stop the upload thread
+    '''
+    FlushTelemetryUploader(Uploader, Timeout)
+    with Uploader['Condition']:
+        Uploader['Closing'] = True
+        Uploader['Condition'].notify_all()
+    Uploader['Thread'].join(Timeout)
+
+def GetTelemetryUploaderStatistics(Uploader):
+    '''
+    Get the uploader counters: Enqueued, Uploaded, DroppedRecords, DroppedBatches, RejectedBatches, Batches,
+    Requests, Retries, Connections, UncompressedBytes, CompressedBytes, LastError and QueuedRecords
+    '''
+    with Uploader['Condition']:
+        Statistics = dict(Uploader['Statistics'])
+        Statistics['QueuedRecords'] = len(Uploader['Records'])
+    return Statistics
+
+# %% Upload thread
+#################
+# Upload thread #
+#################
+
+def CollectBatch(Uploader):
+    '''
+    Take the next batch of the queue: wait for MaxBatchRecords records, up to BatchInterval after the first record.
+    Returns a batch: a dictionary of its NDJSON payload and its number of records, or None
+    when the uploader is closing
+    '''
+    Condition = Uploader['Condition']
+    with Condition:
+        while not(Uploader['Records']):
+            if Uploader['Closing']:
+                return None
+            Condition.wait()
+        BatchEndTime = time.monotonic() + Uploader['BatchInterval']
+        while (len(Uploader['Records']) < Uploader['MaxBatchRecords']) and not(Uploader['Closing']):
+            Wait = BatchEndTime - time.monotonic()
+            if Wait <= 0:
+                break
+            Condition.wait(Wait)
+        Records = [Uploader['Records'].popleft() for i in range(min(len(Uploader['Records']), Uploader['MaxBatchRecords']))]
+        Uploader['Sending'] = True
+
+    # The records are serialized without holding the lock, so EnqueueTelemetry doesn't wait for it.
+    # A record that can't be serialized is dropped
+    Lines = []
+    BatchBytes = 0
+    Rest = []
+    Dropped = 0
+    LastError = None
+    for i, Record in enumerate(Records):
+        try:
+            Line = json.dumps(Record, separators=(',', ':'), allow_nan=False, default=GetJSONValue).encode('utf-8') + b'\n'
+        except (TypeError, ValueError) as Error:
+            Dropped = Dropped + 1
+            LastError = repr(Error)
+            continue
+        if Lines and (BatchBytes + len(Line) > Uploader['MaxBatchBytes']):
+            Rest = Records[i:]
+            break
+        Lines.append(Line)
+        BatchBytes = BatchBytes + len(Line)
+
+    with Condition:
+        # The records past the batch bytes limit go back to the front of the queue. If records were enqueued
+        # meanwhile and the queue can't hold them all, the oldest are dropped
+        Overflow = max(0, len(Uploader['Records']) + len(Rest) - Uploader['Records'].maxlen)
+        Uploader['Records'].extendleft(reversed(Rest[Overflow:]))
+        Uploader['Statistics']['DroppedRecords'] += Dropped + Overflow
+        if LastError is not None:
+            Uploader['Statistics']['LastError'] = LastError
+    return {'Payload': b''.join(Lines), 'Records': len(Lines)}
+
+def GetCollectorConnection(Uploader):
+    '''
+    Get the persistent connection to the collector, and open it if needed
+    '''
+    if Uploader['Connection'] is None:
+        ConnectionClass = http.client.HTTPSConnection if Uploader['Scheme'] == 'https' else http.client.HTTPConnection
+        Uploader['Connection'] = ConnectionClass(Uploader['Host'], Uploader['Port'], timeout=Uploader['Timeout'])
+        Uploader['Statistics']['Connections'] += 1
+    return Uploader['Connection']
+
+def CloseCollectorConnection(Uploader):
+    '''
+    Close the connection to the collector (after an error, or when the collector closes it)
+    '''
+    if Uploader['Connection'] is not None:
+        Uploader['Connection'].close()
+        Uploader['Connection'] = None
+
+def SendBatch(Uploader, Batch):
+    '''
+    POST a batch to the collector. Returns the HTTP status, or None if the connection failed
+    '''
+    Body = gzip.compress(Batch['Payload'], Uploader['CompressionLevel'])
+    Headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip', 'Connection': 'keep-alive'}
+    # A connection closed by the collector while idle fails on first use: it's retried once, on a new connection
+    for Attempt in range(2):
+        Connection = GetCollectorConnection(Uploader)
+        try:
+            Uploader['Statistics']['Requests'] += 1
+            Connection.request('POST', Uploader['Path'], Body, Headers)
+            Response = Connection.getresponse()
+            Response.read() # The response is read to its end, so the connection can be reused
+            if Response.will_close:
+                CloseCollectorConnection(Uploader)
+            Uploader['Statistics']['UncompressedBytes'] += len(Batch['Payload'])
+            Uploader['Statistics']['CompressedBytes'] += len(Body)
+            return Response.status
+        except (OSError, http.client.HTTPException) as Error:
+            Uploader['Statistics']['LastError'] = repr(Error)
+            CloseCollectorConnection(Uploader)
+            if not(isinstance(Error, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))):
+                break
+    return None
+
+def UploadBatch(Uploader, Batch):
+    '''
+    Send a batch to the collector, with up to MaxRetries retries (with an exponential backoff). A batch that
+    failed all of its retries, or was rejected by the collector, is dropped
+    '''
+    Condition = Uploader['Condition']
+    Statistics = Uploader['Statistics']
+    for Retry in range(Uploader['MaxRetries'] + 1):
+        if Retry > 0:
+            # Backoff. Closing the uploader ends the wait, and the retries
+            with Condition:
+                Statistics['Retries'] += 1
+                if not(Uploader['Closing']):
+                    Condition.wait(Uploader['RetryDelay'] * (2 ** (Retry - 1)))
+                if Uploader['Closing']:
+                    break
+        Status = SendBatch(Uploader, Batch)
+        with Condition:
+            if (Status is not None) and (200 <= Status < 300):
+                Statistics['Batches'] += 1
+                Statistics['Uploaded'] += Batch['Records']
+                return
+            if Status is not None:
+                Statistics['LastError'] = 'HTTP status %d' % Status
+                if Status not in RetryHTTPStatuses:
+                    Statistics['RejectedBatches'] += 1
+                    return
+    with Condition:
+        Statistics['DroppedBatches'] += 1
+
+def UploadLoop(Uploader):
+    '''
+    The upload thread: collect and send batches until the uploader is closed. An unexpected error drops
+    the batch it happened in, and the uploads go on
+    '''
+    try:
+        while True:
+            try:
+                Batch = CollectBatch(Uploader)
+                if Batch is None:
+                    return
+                if Batch['Records'] > 0:
+                    UploadBatch(Uploader, Batch)
+            except Exception as Error:
+                CloseCollectorConnection(Uploader)
+                with Uploader['Condition']:
+                    Uploader['Statistics']['DroppedBatches'] += 1
+                    Uploader['Statistics']['LastError'] = repr(Error)
+            finally:
+                with Uploader['Condition']:
+                    Uploader['Sending'] = False
+                    Uploader['Condition'].notify_all()
+    finally:
+        CloseCollectorConnection(Uploader)
+
+# %% Stand-in collector
+######################
+# Stand-in collector #
+######################
+
+class CollectorRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    A stand-in collector request handler: decompresses the NDJSON batches and stores their records.
+    Fails the requests listed in the server's FailRequests set (by request number) with a 503
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        Body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        Collector = self.server.Collector
+        with Collector['Lock']:
+            Collector['Requests'] += 1
+            RequestNumber = Collector['Requests']
+            Collector['Connections'].add(self.client_address)
+        if RequestNumber in Collector['FailRequests']:
+            Status = 503
+        else:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                Body = gzip.decompress(Body)
+            Records = [json.loads(Line) for Line in Body.splitlines() if Line]
+            with Collector['Lock']:
+                Collector['Records'].extend(Records)
+            Status = 200
+        self.send_response(Status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def ServeTelemetryCollector(Host = '127.0.0.1', Port = 0, FailRequests = ()):
+    '''
+    Start a stand-in HTTP collector in a thread. Returns (Server, Collector, URL): Collector is a dictionary of
+    Records (the received records), Requests and Connections (a set of client addresses). Stop with Server.shutdown()
+    '''
+    Server = http.server.ThreadingHTTPServer((Host, Port), CollectorRequestHandler)
+    Server.daemon_threads = True
+    Server.Collector = {'Lock': threading.Lock(), 'Records': [], 'Requests': 0, 'Connections': set(),
+                        'FailRequests': set(FailRequests)}
+    threading.Thread(target=Server.serve_forever, name='TelemetryCollector', daemon=True).start()
+    return Server, Server.Collector, 'http://%s:%d/telemetry' % Server.server_address[0:2]
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 framework tests configuration
+"""
+
+import os
+import sys
+
+# The framework and examples folders, relative to this file
+TestsPath = os.path.dirname(os.path.abspath(__file__))
+FrameworkPath = os.path.join(TestsPath, '..', 'Framework')
+ExamplesPath = os.path.join(TestsPath, '..', 'Examples')
+sys.path.insert(0, FrameworkPath)
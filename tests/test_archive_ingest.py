@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 parallel archive ingest tests
+"""
+
+#############################################
+# A directory of copies of the example logs #
+# is ingested, and the ingest is            #
+# interrupted (a KeyboardInterrupt in the   #
+# progress report) after the first task.    #
+# No shared memory block of the workers may #
+# be left behind.                           #
+#############################################
+
+import os
+import shutil
+import multiprocessing
+import pytest
+from conftest import ExamplesPath
+import RS41ArchiveIngest
+from RS41ArchiveIngest import *
+
+SharedMemoryPath = '/dev/shm'
+LogFileNames = ['RS41-SGP 2021-01-09-S1511071.txt',
+                'RS41-SGP 2021-01-11-S1340533.txt']
+
+def CopyLogFiles(Directory, NumOfCopies):
+    '''
+    Copy the example logs NumOfCopies times to a directory. Returns the copies' file names
+    '''
+    FileNames = []
+    for i in range(NumOfCopies):
+        for LogFileName in LogFileNames:
+            FileName = os.path.join(Directory, '%02d %s' % (i, LogFileName))
+            shutil.copyfile(os.path.join(ExamplesPath, LogFileName), FileName)
+            FileNames.append(FileName)
+    return FileNames
+
+@pytest.mark.skipif(not(os.path.isdir(SharedMemoryPath)), reason = 'No ' + SharedMemoryPath)
+def test_interrupted_ingest_frees_shared_memory(tmp_path, monkeypatch):
+    FileNames = CopyLogFiles(str(tmp_path), 8)
+    def Interrupt(*Args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(RS41ArchiveIngest, 'PrintIngestProgress', Interrupt)
+
+    Blocks = set(os.listdir(SharedMemoryPath))
+    with pytest.raises(KeyboardInterrupt):
+        IngestLogs(FileNames, Workers = 3, ChunkFiles = 1, Progress = True)
+    # Tasks that still run after IngestLogs returned would write more blocks
+    for Worker in multiprocessing.active_children():
+        Worker.join(60)
+    assert set(os.listdir(SharedMemoryPath)) - Blocks == set()
+
+def test_ingest(tmp_path):
+    FileNames = CopyLogFiles(str(tmp_path), 2)
+    Blocks = set(os.listdir(SharedMemoryPath)) if os.path.isdir(SharedMemoryPath) else set()
+    Columns, Errors = IngestLogs(FileNames + [str(tmp_path / 'missing.txt')], Workers = 2, ChunkFiles = 1, Progress = False)
+    assert list(Errors) == [str(tmp_path / 'missing.txt')]
+    assert sorted(set(Columns['FileNumber'].tolist())) == [0, 1, 2, 3]
+    if os.path.isdir(SharedMemoryPath):
+        assert set(os.listdir(SharedMemoryPath)) - Blocks == set()
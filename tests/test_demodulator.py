@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 demodulator tests
+"""
+
+#############################################
+# Frames modulated by BuildAudioStreams     #
+# with no lead-in and no lead-out (the      #
+# stream starts with the first header bit   #
+# and ends with the last frame bit) are     #
+# demodulated back bit exact, first and     #
+# last frames included, also with a         #
+# drifting DC offset (a frequency drift).   #
+#############################################
+
+import os
+import pytest
+import numpy as np
+from conftest import ExamplesPath
+from RS41Functions import *
+from RS41SimFunctions import *
+from RS41Demodulator import *
+
+LogFileName = os.path.join(ExamplesPath, 'RS41-SGP 2021-01-09-S1511071.txt')
+
+def GetLogFrames(FirstRecord, NumOfFrames):
+    '''
+    Get Reed-Solomon corrected regular frames of the test log
+    '''
+    LoggedMessagesLength, LoggedMessages = ReadLogFile(LogFileName)
+    Frames = []
+    for i in range(FirstRecord, FirstRecord + NumOfFrames):
+        MessageBytes = bytearray(1024)
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        try:
+            DecodeReedSolomon(MessageBytes)
+        except Exception:
+            pass
+        Frames.append(bytes(MessageBytes[0:RegularFrameLength]))
+    return Frames
+
+@pytest.mark.parametrize('SampleRate', [24000, 44100, 48000, 96000])
+@pytest.mark.parametrize('FirstRecord', [0, 100, 200])
+@pytest.mark.parametrize('BlockLength', [4096, 65536])
+def test_no_lead_in_no_lead_out(SampleRate, FirstRecord, BlockLength):
+    Frames = GetLogFrames(FirstRecord, 3)
+    TxFrames = [DataWhitening(RegularFrameLength, bytearray(Frame)) for Frame in Frames]
+    Samples, StreamStarts = BuildAudioStreams(TxFrames, SampleRate / DataRate, DataRate, SampleRate)
+    Demodulated = list(DemodulateFrames(Samples, SampleRate, BlockLength = BlockLength))
+    assert [bytes(MessageBytes) for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in Demodulated] == Frames
+    assert all(SyncScore == 1.0 for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in Demodulated)
+
+    # The first header bit is sampled at the end of its matched filter window: up to 2 bits after the frame start
+    Offsets = np.array([FrameSampleIndex for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in Demodulated]) - StreamStarts
+    assert np.all((Offsets >= 0) & (Offsets <= 2 * SampleRate / DataRate))
+    assert np.ptp(Offsets) <= 1
+
+@pytest.mark.parametrize('SampleRate', [24000, 48000])
+@pytest.mark.parametrize('BlockLength', [4096, 65536])
+def test_drifting_dc_offset(SampleRate, BlockLength):
+    Frames = GetLogFrames(0, 8)
+    TxFrames = [DataWhitening(RegularFrameLength, bytearray(Frame)) for Frame in Frames]
+    Samples, StreamStarts = BuildAudioStreams(TxFrames, SampleRate / DataRate, DataRate, SampleRate)
+    Samples = np.asarray(Samples, dtype=np.float64)
+
+    # A DC offset of up to 0.8 of the signal amplitude, with a 2 s period
+    Samples = Samples + 0.8 * np.max(np.abs(Samples)) * np.sin(2 * np.pi * np.arange(len(Samples)) / (2.0 * SampleRate))
+    Demodulated = list(DemodulateFrames(Samples, SampleRate, BlockLength = BlockLength))
+    assert [bytes(MessageBytes) for FrameSampleIndex, MessageBytes, SyncScore, ByteReliability in Demodulated] == Frames
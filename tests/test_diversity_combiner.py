@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 diversity combiner tests
+"""
+
+#############################################
+# Two station copies of each frame of an    #
+# example log are corrupted with random     #
+# byte errors, up to where the majority     #
+# vote and erasure decoding miscorrect.     #
+# Every frame that CombineFrameCopies does  #
+# not report as failed must be the original #
+# frame.                                    #
+#############################################
+
+import os
+import pytest
+import numpy as np
+from conftest import ExamplesPath
+from RS41DiversityCombiner import *
+
+LogFileName = 'RS41-SGP 2021-01-09-S1511071.txt'
+NumOfFrames = 200
+
+def GetLogFrames(LogFileName, NumOfFrames):
+    '''
+    Get the first NumOfFrames Reed-Solomon correctable frames of a log, corrected
+    '''
+    LoggedMessagesLength, LoggedMessages = ReadLogFile(os.path.join(ExamplesPath, LogFileName))
+    Frames = []
+    MessageBytes = bytearray(1024)
+    for i in range(LoggedMessagesLength):
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        Frame = bytearray(MessageBytes[:RegularFrameLength])
+        if TryDecodeReedSolomon(Frame):
+            Frames.append(Frame)
+        if len(Frames) == NumOfFrames:
+            break
+    return Frames
+
+@pytest.mark.parametrize('MinErrors, MaxErrors', [(14, 22), (20, 30)])
+def test_combined_frames_are_not_miscorrected(MinErrors, MaxErrors):
+    Generator = np.random.default_rng(MinErrors)
+    Results = {}
+    for Frame in GetLogFrames(LogFileName, NumOfFrames):
+        Copies = []
+        for StationName in ('A', 'B'):
+            Copy = np.frombuffer(bytes(Frame), dtype=np.uint8).copy()
+            Positions = Generator.choice(np.arange(0x008, RegularFrameLength), Generator.integers(MinErrors, MaxErrors), replace=False)
+            Copy[Positions] ^= Generator.integers(1, 256, len(Positions), dtype=np.uint8)
+            Copies.append((StationName, bytearray(Copy.tobytes()), False))
+        MessageBytes, Result, StationName = CombineFrameCopies(Copies)
+        Results[Result] = Results.get(Result, 0) + 1
+        if Result != DiversityFailed:
+            assert bytes(MessageBytes) == bytes(Frame), Result
+    # Some frames are recovered by erasure decoding
+    assert Results.get(DiversityErasures, 0) > 0
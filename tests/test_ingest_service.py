@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 asyncio ingestion service tests
+"""
+
+#############################################
+# The first frames of an example log are    #
+# replayed by the TCP, UNIX socket and log  #
+# file stand-in feeds, in the test's event  #
+# loop, so the decoder processes start      #
+# while the stand-in connections are open.  #
+# Each feed must publish the frames as      #
+# DecodeFeedFrame decodes them, and the     #
+# socket feeds must reconnect after their   #
+# stand-in closed the connection.           #
+#############################################
+
+import os
+import asyncio
+import pytest
+from conftest import ExamplesPath
+import RS41IngestService
+from RS41IngestService import *
+
+LogFileName = 'RS41-SGP 2021-01-09-S1511071.txt'
+NumOfFrames = 40
+
+async def CollectTelemetry(Service, Subscriber, FeedFrames, MinConnections, Timeout):
+    '''
+    Collect the telemetry of the feeds until each feed published FeedFrames frames, and each socket feed connected
+    MinConnections times. Returns a dictionary: feed name -> telemetry records
+    '''
+    Telemetry = {FeedName: [] for FeedName in Service['Feeds']}
+    EndTime = asyncio.get_running_loop().time() + Timeout
+    while asyncio.get_running_loop().time() < EndTime:
+        Record = await GetTelemetry(Subscriber, 0.1)
+        if Record is not None:
+            Telemetry[Record['Feed']].append(Record)
+        Statistics = GetIngestServiceStatistics(Service)
+        if all(len(Records) >= FeedFrames for Records in Telemetry.values()) and \
+           all(Statistics[FeedName]['Connections'] >= MinConnections for FeedName in ('tcp', 'unix')):
+            break
+    return Telemetry
+
+@pytest.mark.skipif(not(hasattr(asyncio, 'start_unix_server')), reason = 'No UNIX sockets')
+def test_stand_in_feeds(tmp_path, monkeypatch):
+    monkeypatch.setattr(RS41IngestService, 'FeedReconnectDelay', 0.1)
+    LogLines = ReadLogLines(os.path.join(ExamplesPath, LogFileName))[0:NumOfFrames]
+    ReplayFileName = str(tmp_path / 'replay.txt')
+    with open(ReplayFileName, 'wb') as File:
+        File.writelines(LogLines)
+    Expected = [DecodeFeedFrame(ParseLogLine(Line.strip())) for Line in LogLines]
+
+    async def RunFeeds():
+        TCPServer = await ServeLogReplay(ReplayFileName, Speed = 100)
+        UNIXServer = await ServeLogReplay(ReplayFileName, Path = str(tmp_path / 'feed.sock'), Speed = 100)
+        Service = NewIngestService(Workers = 2)
+        Subscriber = SubscribeIngestService(Service, 4 * NumOfFrames)
+        try:
+            AddTCPFeed(Service, 'tcp', '127.0.0.1', TCPServer.sockets[0].getsockname()[1])
+            AddUNIXFeed(Service, 'unix', str(tmp_path / 'feed.sock'))
+            AddFileFeed(Service, 'file', [str(tmp_path / 'tail.txt')], PollInterval = 0.05, FromStart = True)
+            await ReplayLogToFile(ReplayFileName, str(tmp_path / 'tail.txt'), Speed = 0)
+            Telemetry = await CollectTelemetry(Service, Subscriber, NumOfFrames, 2, 60.0)
+            return Telemetry, GetIngestServiceStatistics(Service)
+        finally:
+            await StopIngestService(Service)
+            for Server in (TCPServer, UNIXServer):
+                Server.close()
+                await Server.wait_closed()
+
+    Telemetry, Statistics = asyncio.run(RunFeeds())
+    for FeedName in ('tcp', 'unix', 'file'):
+        Records = Telemetry[FeedName][0:NumOfFrames]
+        assert [(Record['Decoded'], repr(Record['Blocks'])) for Record in Records] == \
+               [(Decoded, repr(Blocks)) for Decoded, Blocks in Expected], FeedName
+        assert Statistics[FeedName]['Errors'] == 0
+    for FeedName in ('tcp', 'unix'):
+        assert Statistics[FeedName]['Connections'] >= 2, FeedName
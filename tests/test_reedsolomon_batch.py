@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 batch Reed-Solomon decoder tests
+"""
+
+#############################################
+# DecodeReedSolomonBatch is checked against #
+# the scalar DecodeReedSolomon, on the      #
+# frames of the example logs with random    #
+# byte errors injected in each codeword:    #
+# from no errors, through the 12 errors per #
+# codeword limit, to uncorrectable frames   #
+# (one or both codewords).                  #
+# The recoverable flags and the corrected   #
+# bytes must be identical.                  #
+#############################################
+
+import os
+import pytest
+import numpy as np
+from conftest import ExamplesPath
+from RS41BlocksRW import *
+from RS41SimFunctions import *
+
+LogFileNames = ['RS41-SGP 2021-01-09-S1511071.txt',
+                'RS41-SGP 2021-01-11-S1340533.txt']
+
+def GetLogMessageArray(LogFileName):
+    '''
+    Get the regular frames of a log that are Reed-Solomon correctable, corrected, as an (N, 320) uint8 array
+    '''
+    LoggedMessagesLength, LoggedMessages = ReadLogFile(os.path.join(ExamplesPath, LogFileName))
+    MessageArray = np.zeros((LoggedMessagesLength, RegularFrameLength), dtype=np.uint8)
+    MessageBytes = bytearray(1024)
+    for i in range(LoggedMessagesLength):
+        LogRecordToMessageBytes(i, LoggedMessages, MessageBytes)
+        MessageArray[i] = np.frombuffer(MessageBytes, dtype=np.uint8, count=RegularFrameLength)
+    return MessageArray[DecodeReedSolomonBatch(MessageArray)]
+
+def InjectErrors(MessageArray, ErrorsPerCodeword, Generator):
+    '''
+    Replace ErrorsPerCodeword random bytes of each codeword of each message with random different values.
+    ErrorsPerCodeword is a number of errors, or a (codeword 1 errors, codeword 2 errors) pair
+    '''
+    if np.isscalar(ErrorsPerCodeword):
+        ErrorsPerCodeword = (ErrorsPerCodeword, ErrorsPerCodeword)
+    Corrupted = MessageArray.copy()
+    for i in range(len(Corrupted)):
+        for CodewordIndexes, NumOfErrors in zip((RS_CodewordIndexes1, RS_CodewordIndexes2), ErrorsPerCodeword):
+            Positions = Generator.choice(CodewordIndexes, NumOfErrors, replace=False)
+            Corrupted[i, Positions] ^= Generator.integers(1, 256, NumOfErrors, dtype=np.uint8)
+    return Corrupted
+
+def DecodeReedSolomonScalar(MessageArray):
+    '''
+    Decode each message with DecodeReedSolomon. Returns the corrected messages and the recoverable flags
+    '''
+    Decoded = MessageArray.copy()
+    Recoverable = np.zeros(len(MessageArray), dtype=bool)
+    for i in range(len(MessageArray)):
+        MessageBytes = bytearray(Decoded[i].tobytes())
+        try:
+            Recoverable[i] = DecodeReedSolomon(MessageBytes)
+        except Exception:
+            continue # Uncorrectable: the message is unchanged
+        Decoded[i] = np.frombuffer(MessageBytes, dtype=np.uint8)
+    return Decoded, Recoverable
+
+@pytest.mark.parametrize('LogFileName', LogFileNames)
+@pytest.mark.parametrize('ErrorsPerCodeword', [0, 1, 6, 12, 13, 16, 24, (12, 13), (20, 3)])
+def test_batch_matches_scalar(LogFileName, ErrorsPerCodeword):
+    Generator = np.random.default_rng(np.sum(ErrorsPerCodeword))
+    MessageArray = GetLogMessageArray(LogFileName)
+    MessageArray = MessageArray[Generator.choice(len(MessageArray), 120, replace=False)]
+    Corrupted = InjectErrors(MessageArray, ErrorsPerCodeword, Generator)
+
+    Expected, ExpectedRecoverable = DecodeReedSolomonScalar(Corrupted)
+    Batch = Corrupted.copy()
+    Recoverable = DecodeReedSolomonBatch(Batch)
+    assert np.array_equal(Recoverable, ExpectedRecoverable)
+    assert np.array_equal(Batch[Recoverable], Expected[Recoverable])
+    assert np.array_equal(Batch[~Recoverable], Corrupted[~Recoverable]) # Not recoverable: unchanged
+
+    # Up to 12 errors per codeword are always corrected, to the original message
+    if np.max(ErrorsPerCodeword) <= RS_ECCSymbols // 2:
+        assert Recoverable.all()
+        assert np.array_equal(Batch, MessageArray)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+RS41 telemetry upload client tests
+"""
+
+#############################################
+# Records are uploaded to the stand-in      #
+# collector. A record that can't be         #
+# serialized is dropped and counted, and    #
+# the upload thread goes on with the next   #
+# records. NumPy scalars are serialized as  #
+# their values. The records past the batch  #
+# bytes limit are uploaded by the next      #
+# batches, in order.                        #
+#############################################
+
+import math
+import pytest
+import numpy as np
+from RS41TelemetryUpload import *
+
+@pytest.fixture
+def Collector():
+    Server, Collector, URL = ServeTelemetryCollector()
+    yield Collector, URL
+    Server.shutdown()
+    Server.server_close()
+
+def UploadRecords(URL, Records, MaxBatchBytes = 1 << 20):
+    '''
+    Upload records (in one batch, up to MaxBatchBytes). Returns the uploader statistics
+    '''
+    Uploader = NewTelemetryUploader(URL, BatchInterval = 0.05, MaxBatchBytes = MaxBatchBytes)
+    for Record in Records:
+        EnqueueTelemetry(Uploader, Record)
+    assert FlushTelemetryUploader(Uploader, 10.0)
+    CloseTelemetryUploader(Uploader)
+    assert not(Uploader['Thread'].is_alive())
+    return GetTelemetryUploaderStatistics(Uploader)
+
+@pytest.mark.parametrize('BadRecord', [{'Temperature': math.nan},
+                                       {'Temperature': np.float32('nan')},
+                                       {'Temperature': object()}])
+def test_unserializable_record_is_dropped(Collector, BadRecord):
+    Collector, URL = Collector
+    Statistics = UploadRecords(URL, [{'FrameNumber': 1}, BadRecord, {'FrameNumber': 2}])
+    assert Collector['Records'] == [{'FrameNumber': 1}, {'FrameNumber': 2}]
+    assert Statistics['Uploaded'] == 2
+    assert Statistics['DroppedRecords'] == 1
+    assert Statistics['LastError'] is not None
+
+def test_numpy_scalars_are_uploaded(Collector):
+    Collector, URL = Collector
+    Statistics = UploadRecords(URL, [{'FrameNumber': np.int64(7), 'Temperature': np.float32(-21.5),
+                                      'RadiosondeID': np.str_('S1511071'), 'STATUSOK': np.bool_(True)}])
+    assert Collector['Records'] == [{'FrameNumber': 7, 'Temperature': -21.5, 'RadiosondeID': 'S1511071', 'STATUSOK': True}]
+    assert Statistics['DroppedRecords'] == 0
+
+def test_batch_bytes_limit(Collector):
+    Collector, URL = Collector
+    Records = [{'FrameNumber': FrameNumber, 'RadiosondeID': 'S1511071'} for FrameNumber in range(100)]
+    Statistics = UploadRecords(URL, Records + [{'Temperature': math.nan}], MaxBatchBytes = 400)
+    assert Collector['Records'] == Records
+    assert Statistics['Batches'] > 1
+    assert Statistics['DroppedRecords'] == 1
+
+def test_upload_thread_survives_errors(Collector, monkeypatch):
+    Collector, URL = Collector
+    Uploader = NewTelemetryUploader(URL, BatchInterval = 0.05)
+
+    # The first batch fails with an unexpected error
+    Failures = [RuntimeError('Unexpected')]
+    OriginalSendBatch = SendBatch
+    def FailingSendBatch(Uploader, Batch):
+        if Failures:
+            raise Failures.pop()
+        return OriginalSendBatch(Uploader, Batch)
+    monkeypatch.setitem(UploadBatch.__globals__, 'SendBatch', FailingSendBatch)
+
+    EnqueueTelemetry(Uploader, {'FrameNumber': 1})
+    assert FlushTelemetryUploader(Uploader, 10.0)
+    EnqueueTelemetry(Uploader, {'FrameNumber': 2})
+    assert FlushTelemetryUploader(Uploader, 10.0)
+    assert Uploader['Thread'].is_alive()
+    CloseTelemetryUploader(Uploader)
+    Statistics = GetTelemetryUploaderStatistics(Uploader)
+    assert Collector['Records'] == [{'FrameNumber': 2}]
+    assert Statistics['DroppedBatches'] == 1
+    assert 'Unexpected' in Statistics['LastError']